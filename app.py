@@ -1,15 +1,31 @@
+import asyncio
 from flask import Flask, jsonify, render_template, session, redirect, request
-from db.connection import get_db_connection
+from db.async_db import fetch_all, get_async_pool_stats
+from db.connection import get_db_connection, get_read_connection, get_pool_stats, get_replica_stats, init_app as init_db
+from db.feed import attach_feed_data
+from db.home_feed import FEED_PAGE_SQL, decode_feed_rows
+from db.trending import TRENDING_FEED_SQL, ensure_pruner
+from db.likes import get_like_buffer
+from db.pagination import get_page_args, keyset_clause, paginate
+from db.search import search_posts
+from db.tag_index import get_tag_index
 from routes.users import users_bp
 from routes.posts import posts_bp
 from routes.comments import comments_bp
 from routes.tags import tags_bp
 from routes.likes import likes_bp
+from routes.images import images_bp
+from routes.debug import debug_bp
 import os
 from dotenv import load_dotenv
-import markdown as md
 
 from utils.image_handler import init_upload_folders
+from utils.markdown_renderer import render_cached, post_html
+from utils.current_user import init_app as init_current_user, load_current_user_async
+from utils.async_views import async_twin
+from utils.page_cache import cached_page, skip_page_cache, get_page_cache_stats
+from utils.profiling import init_app as init_profiling
+import cli
 
 load_dotenv()
 
@@ -18,112 +34,160 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+# Return pooled database connections when each request finishes
+init_db(app)
+
+# Server-Timing headers and per-route stats when PROFILING=1
+init_profiling(app)
+
+# Expose the logged-in user to every template as current_user
+init_current_user(app)
+
+# flask db upgrade/downgrade/status and the maintenance commands
+cli.init_app(app)
+
 # Register blueprints
 app.register_blueprint(users_bp, url_prefix='/api')
 app.register_blueprint(posts_bp, url_prefix='/api')
 app.register_blueprint(comments_bp, url_prefix='/api')
 app.register_blueprint(tags_bp, url_prefix='/api')
 app.register_blueprint(likes_bp, url_prefix='/api')
+app.register_blueprint(images_bp, url_prefix='/api')
+app.register_blueprint(debug_bp, url_prefix='/debug')
 
 @app.template_filter('markdown')
 def markdown_filter(text):
     """Convert markdown text to HTML"""
-    return md.markdown(text, extensions=['fenced_code', 'codehilite'])
+    return render_cached(text)
+
+@app.template_filter('post_html')
+def post_html_filter(post):
+    """Stored HTML for a post, rendered lazily if it's missing or stale"""
+    return post_html(post)
+
+PAGE_LIKES_SQL = 'SELECT post_id FROM likes WHERE user_id = %s AND post_id = ANY(%s)'
+
+def _mark_liked(posts, user_liked_posts):
+    for post in posts:
+        # Check if the current user liked the post
+        post['liked_by_user'] = post['id'] in user_liked_posts
+
+    # Show clicks the like buffer hasn't written yet
+    like_buffer = get_like_buffer()
+    if like_buffer is not None:
+        like_buffer.overlay(session.get('user_id'), posts)
 
 @app.route('/')
+@cached_page('posts', 'comments', 'likes', 'tags', 'users')
 def home():
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+    except ValueError as e:
+        return f"Invalid page: {str(e)}", 400
+    
+    try:
+        conn = get_read_connection()
         cur = conn.cursor()
         
-        # Get all posts with user information and like counts
-        cur.execute('''
-            SELECT 
-                posts.id,
-                posts.title,
-                posts.content,
-                posts.cover_image,
-                posts.created_at,
-                users.username,
-                users.id as user_id,
-                users.profile_image,
-                COUNT(DISTINCT likes.user_id) as like_count
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            LEFT JOIN likes ON posts.id = likes.post_id
-            GROUP BY posts.id, posts.title, posts.content, posts.created_at, users.username, users.id
-            ORDER BY posts.created_at DESC
-        ''')
+        # A page of precomputed feed rows: author, counts, tags and latest comments
+        after, after_params = keyset_clause(position, 'created_at', 'post_id')
+        cur.execute(FEED_PAGE_SQL.format(after=after), (*after_params, limit + 1))
         
-        posts = cur.fetchall()
+        posts, next_cursor = paginate(decode_feed_rows(cur.fetchall()), limit)
         
-        # Get current user's liked posts if logged in
+        # Get which posts on this page the current user liked
         user_liked_posts = set()
-        if 'user_id' in session:
-            cur.execute(
-                'SELECT post_id FROM likes WHERE user_id = %s',
-                (session['user_id'],)
-            )
+        if 'user_id' in session and posts:
+            cur.execute(PAGE_LIKES_SQL, (session['user_id'], [post['id'] for post in posts]))
             user_liked_posts = {row['post_id'] for row in cur.fetchall()}
         
-        # get comments and tags for each post
-        for post in posts:
-            # Check if the current user liked the post
-            post['liked_by_user'] = post['id'] in user_liked_posts
-            
-            # Get comments for the post
-            cur.execute('''
-                SELECT 
-                    comments.id,
-                    comments.content,
-                    comments.created_at,
-                    users.username
-                FROM comments
-                JOIN users ON comments.user_id = users.id
-                WHERE comments.post_id = %s
-                ORDER BY comments.created_at ASC
-            ''', (post['id'],))
-            post['comments'] = cur.fetchall()
-        
-        # Get tags for each post
-            cur.execute('''
-                SELECT tags.id,
-                       tags.name
-                FROM tags
-                JOIN post_tags ON tags.id = post_tags.tag_id
-                WHERE post_tags.post_id = %s
-                ORDER BY tags.name ASC
-            ''', (post['id'],))
-            post['tags'] = cur.fetchall()
+        _mark_liked(posts, user_liked_posts)
 
         cur.close()
         conn.close()
         
-        return render_template('index.html', posts=posts)
+        return render_template('index.html', posts=posts, next_cursor=next_cursor)
         
     except Exception as e:
+        skip_page_cache()
+        return render_template('index.html', posts=[], error=str(e))
+
+@async_twin('home')
+@cached_page('posts', 'comments', 'likes', 'tags', 'users')
+async def home_async():
+    """home() for asgi.py: queries that don't depend on each other run concurrently"""
+    try:
+        position, limit = get_page_args()
+    except ValueError as e:
+        return f"Invalid page: {str(e)}", 400
+
+    try:
+        after, after_params = keyset_clause(position, 'created_at', 'post_id')
+        # The page of feed rows and the logged-in user (for the nav) at the same time
+        rows, _ = await asyncio.gather(
+            fetch_all(FEED_PAGE_SQL.format(after=after), (*after_params, limit + 1)),
+            load_current_user_async(),
+        )
+        posts, next_cursor = paginate(decode_feed_rows(rows), limit)
+
+        # Then which of those posts the user liked
+        user_liked_posts = set()
+        if 'user_id' in session and posts:
+            rows = await fetch_all(PAGE_LIKES_SQL, (session['user_id'], [post['id'] for post in posts]))
+            user_liked_posts = {row['post_id'] for row in rows}
+        _mark_liked(posts, user_liked_posts)
+
+        return render_template('index.html', posts=posts, next_cursor=next_cursor)
+
+    except Exception as e:
+        skip_page_cache()
         return render_template('index.html', posts=[], error=str(e))
     
+@app.route('/trending')
+@cached_page('posts', 'comments', 'likes', 'tags', 'users')
+def trending_page():
+    """Posts ranked by time-decayed likes and comments"""
+    try:
+        position, limit = get_page_args()
+    except ValueError as e:
+        return f"Invalid page: {str(e)}", 400
+
+    try:
+        ensure_pruner()
+        conn = get_read_connection()
+        cur = conn.cursor()
+
+        # The trending index picks the posts, their feed rows have everything else
+        after, after_params = keyset_clause(position, 'posts.trending_score', 'posts.id')
+        cur.execute(TRENDING_FEED_SQL.format(after=after), (*after_params, limit + 1))
+        posts, next_cursor = paginate(decode_feed_rows(cur.fetchall()), limit, created_key='trending_key')
+
+        user_liked_posts = set()
+        if 'user_id' in session and posts:
+            cur.execute(PAGE_LIKES_SQL, (session['user_id'], [post['id'] for post in posts]))
+            user_liked_posts = {row['post_id'] for row in cur.fetchall()}
+        _mark_liked(posts, user_liked_posts)
+
+        cur.close()
+        conn.close()
+
+        return render_template('index.html', posts=posts, next_cursor=next_cursor, heading='Trending')
+
+    except Exception as e:
+        skip_page_cache()
+        return render_template('index.html', posts=[], error=str(e), heading='Trending')
+
 @app.route('/tags')
+@cached_page('tags')
 def all_tags_page():
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
         
-        # Get all tags with post counts
-        cur.execute('''
-            SELECT 
-                tags.id,
-                tags.name,
-                COUNT(post_tags.post_id) as post_count
-            FROM tags
-            LEFT JOIN post_tags ON tags.id = post_tags.tag_id
-            GROUP BY tags.id, tags.name
-            HAVING COUNT(post_tags.post_id) > 0
-            ORDER BY post_count DESC, tags.name ASC
-        ''')
-        
-        tags = cur.fetchall()
+        # Tags in use, most used first, from the in-memory tag index
+        index = get_tag_index()
+        index.refresh(cur)
+        tags = [tag for tag in index.ranked()[0] if tag['post_count'] > 0]
         cur.close()
         conn.close()
         
@@ -139,7 +203,7 @@ def liked_posts_page():
         return redirect('/login')
     
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
         
         user_id = session['user_id']
@@ -149,36 +213,24 @@ def liked_posts_page():
             SELECT
                 posts.id,
                 posts.title,
-                posts.content,
+                posts.excerpt,
+                posts.reading_time,
                 posts.created_at,
                 users.username,
                 users.id as user_id,
-                COUNT(DISTINCT comments.id) as comment_count,
-                COUNT(DISTINCT likes.user_id) as like_count
+                posts.comment_count,
+                posts.like_count
             FROM likes
             JOIN posts ON likes.post_id = posts.id
             JOIN users ON posts.user_id = users.id
-            LEFT JOIN comments ON posts.id = comments.post_id
-            LEFT JOIN likes as post_likes ON posts.id = post_likes.post_id
             WHERE likes.user_id = %s
-            GROUP BY posts.id, posts.title, posts.content, posts.created_at, users.username, users.id
             ORDER BY posts.created_at DESC
         ''', (user_id,))
         
         posts = cur.fetchall()
         
-        # Get tags for each post
-        for post in posts:
-            cur.execute('''
-                SELECT tags.id,
-                       tags.name
-                FROM tags
-                JOIN post_tags ON tags.id = post_tags.tag_id
-                WHERE post_tags.post_id = %s
-                ORDER BY tags.name ASC
-            ''', (post['id'],))
-            
-            post['tags'] = cur.fetchall()
+        # Get tags for all liked posts in one query
+        attach_feed_data(cur, posts, comments=False)
 
         cur.close()
         conn.close()
@@ -211,7 +263,7 @@ def edit_post_page(post_id):
         return redirect('/login')
     
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
         
         # Get post and verify ownership
@@ -238,15 +290,21 @@ def edit_post_page(post_id):
     
 # User profile route    
 @app.route('/user/<username>')
+@cached_page('posts', 'comments', 'users')
 def user_profile(username):
     """Display user profile page"""
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+    except ValueError as e:
+        return f"Invalid page: {str(e)}", 400
+    
+    try:
+        conn = get_read_connection()
         cur = conn.cursor()
         
         # Get user information
         cur.execute('''
-            SELECT id, username, email, profile_image, created_at 
+            SELECT id, username, email, profile_image, profile_image_variants, post_count, created_at 
             FROM users 
             WHERE username = %s
         ''', (username,))
@@ -258,71 +316,62 @@ def user_profile(username):
             conn.close()
             return "User not found", 404
         
-        # Get user's posts with comment counts
-        cur.execute('''
+        # Get a page of the user's posts with comment counts
+        after, after_params = keyset_clause(position, 'posts.created_at', 'posts.id')
+        cur.execute(f'''
             SELECT 
                 posts.id,
                 posts.title,
-                posts.content,
+                posts.excerpt,
+                posts.reading_time,
                 posts.cover_image,
                 posts.created_at,
                 posts.updated_at,
-                COUNT(DISTINCT comments.id) as comment_count
+                posts.comment_count
             FROM posts
-            LEFT JOIN comments ON posts.id = comments.post_id
-            WHERE posts.user_id = %s
-            GROUP BY posts.id, posts.title, posts.content, posts.cover_image, posts.created_at, posts.updated_at
-            ORDER BY posts.created_at DESC
-        ''', (user['id'],))
+            WHERE posts.user_id = %s AND {after}
+            ORDER BY posts.created_at DESC, posts.id DESC
+            LIMIT %s
+        ''', (user['id'], *after_params, limit + 1))
         
-        posts = cur.fetchall()
+        posts, next_cursor = paginate(cur.fetchall(), limit)
         
         cur.close()
         conn.close()
         
-        return render_template('user_profile.html', user=user, posts=posts)
+        return render_template('user_profile.html', user=user, posts=posts, post_count=user['post_count'], next_cursor=next_cursor)
     
     except Exception as e:
         print(f"Error loading user_profile: {e}")  
         return f"An error occurred while loading user profile: {str(e)}", 500
     
 @app.route('/search')
+@cached_page('posts', 'comments', 'users')
 def search_page():
     query = request.args.get('q', '').strip()
     if not query:
         return render_template('search.html', posts=[], query='')
     
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+    except ValueError as e:
+        skip_page_cache()
+        return render_template('search.html', posts=[], query=query, error=str(e))
+    
+    try:
+        conn = get_read_connection()
         cur = conn.cursor()
         
-        # Search posts by title or content
-        search_query = f"%{query}%"
-        cur.execute('''
-            SELECT 
-                posts.id,
-                posts.title,
-                posts.content,
-                posts.created_at,
-                users.username,
-                users.id as user_id,
-                COUNT(comments.id) as comment_count
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            LEFT JOIN comments ON posts.id = comments.post_id
-            WHERE posts.title ILIKE %s OR posts.content ILIKE %s
-            GROUP BY posts.id, posts.title, posts.content, posts.created_at, users.username, users.id
-            ORDER BY posts.created_at DESC
-        ''', (search_query, search_query))
-        
-        posts = cur.fetchall()
+        # Full-text search, ranked by relevance
+        posts, next_cursor = search_posts(cur, query, limit, position)
         
         cur.close()
         conn.close()
         
-        return render_template('search.html', posts=posts, query=query)
+        return render_template('search.html', posts=posts, query=query, next_cursor=next_cursor)
     
     except Exception as e:
+        skip_page_cache()
         return render_template('search.html', posts=[], query=query, error=str(e))
     
 @app.route('/settings')
@@ -332,12 +381,12 @@ def settings_page():
         return redirect('/login')
     
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
         
         # Get user information
         cur.execute('''
-            SELECT id, username, email, profile_image 
+            SELECT id, username, email, profile_image, profile_image_variants 
             FROM users 
             WHERE id = %s
         ''', (session['user_id'],))
@@ -366,6 +415,22 @@ def test_db():
         return jsonify({'success': True, 'database_time': str(result['now']), 'message': 'Database connection successful!'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e), 'message': 'Database connection failed!'})
+
+@app.route('/db-stats')
+def db_stats():
+    """Connection pool, replica and page cache usage for monitoring"""
+    stats = get_pool_stats()
+    extra = {'page_cache': get_page_cache_stats()}
+    # Only present when serving through asgi.py
+    async_pool = get_async_pool_stats()
+    if async_pool is not None:
+        extra['async_pool'] = async_pool
+    replicas = get_replica_stats()
+    if replicas is not None:
+        extra['replicas'] = replicas
+    if stats is None:
+        return jsonify({'pool': None, **extra, 'message': 'Connection pool not created yet'})
+    return jsonify({'pool': stats, **extra})
     
 with app.app_context():
     init_upload_folders()
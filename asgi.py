@@ -0,0 +1,122 @@
+import io
+import os
+import sys
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from flask import request
+from werkzeug.exceptions import HTTPException
+
+from app import app
+from db.async_db import open_pool, close_pool
+from utils.async_views import ASYNC_VIEWS
+
+# ASGI entry point, e.g.  uvicorn asgi:application
+#
+# The read endpoints registered in ASYNC_VIEWS run as coroutines on the event
+# loop, querying through psycopg's async pool, so a worker isn't tied up
+# while they wait on Postgres. Everything else (writes, uploads, ?stream=1)
+# goes to the normal Flask app on asgiref's thread pool.
+#
+# Needs psycopg[binary], psycopg-pool, asgiref and an ASGI server on top of
+# requirements.txt. ASYNC_READS=0 sends every request through the WSGI app,
+# for comparing the two under the same server.
+ASYNC_READS = os.getenv('ASYNC_READS', '1') == '1'
+
+wsgi_application = WsgiToAsgi(app)
+
+
+def _environ(scope):
+    """A WSGI environ for an ASGI HTTP scope, so Flask's request context works as usual"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        # Only GET/HEAD views run async, so there's never a body to read
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+def _async_view(scope, environ):
+    """The async view for this request, or None to let the WSGI app handle it"""
+    if not ASYNC_READS or scope['method'] not in ('GET', 'HEAD'):
+        return None
+    # Streaming keeps a server-side cursor open; that stays on the sync path
+    if parse_qs(environ['QUERY_STRING']).get('stream') == ['1']:
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return ASYNC_VIEWS.get(endpoint)
+
+async def _serve(view, environ, send):
+    # Mirrors Flask's wsgi_app/full_dispatch_request, awaiting the view
+    with app.request_context(environ):
+        try:
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.finalize_request(rv)
+        except Exception as e:
+            response = app.handle_exception(e)
+        body = b'' if environ['REQUEST_METHOD'] == 'HEAD' else response.get_data()
+        headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]
+
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                if ASYNC_READS:
+                    await open_pool()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            print("✓ Async read views enabled" if ASYNC_READS else "✓ Serving every request through the WSGI app")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http':
+        environ = _environ(scope)
+        view = _async_view(scope, environ)
+        if view is not None:
+            return await _serve(view, environ, send)
+    return await wsgi_application(scope, receive, send)
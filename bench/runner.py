@@ -0,0 +1,302 @@
+import io
+import json
+import random
+import re
+import resource
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from PIL import Image
+from urllib.parse import urlencode
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from db.query_counter import count_queries
+from bench.seed import BENCH_PASSWORD, BENCH_PREFIX, BENCH_TAG_PREFIX
+
+# Regressions are flagged when p95 grows by more than this fraction, or
+# when a scenario runs more queries per request than the baseline did
+DEFAULT_TOLERANCE = 0.2
+
+_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def _cover_image(rng):
+    """A small noisy PNG, so uploads exercise hashing and the image workers"""
+    img = Image.effect_noise((320, 200), 64).convert('RGB')
+    img.putpixel((rng.randrange(320), rng.randrange(200)), (rng.randrange(256), 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+# name -> (method, needs login, request builder(rng, ctx) -> (path, kwargs))
+SCENARIOS = {
+    'home_anonymous': ('GET', False, lambda rng, ctx: ('/', {})),
+    'home_logged_in': ('GET', True, lambda rng, ctx: ('/', {})),
+    'search': ('GET', False, lambda rng, ctx: (
+        '/search?' + urlencode({'q': rng.choice(['python', 'cache', 'index query', 'flask'])}), {})),
+    'api_posts': ('GET', False, lambda rng, ctx: ('/api/posts', {})),
+    'api_post': ('GET', False, lambda rng, ctx: (f"/api/posts/{rng.choice(ctx['post_ids'])}", {})),
+    'api_comments': ('GET', False, lambda rng, ctx: (f"/api/posts/{rng.choice(ctx['post_ids'])}/comments", {})),
+    'api_tags': ('GET', False, lambda rng, ctx: ('/api/tags', {})),
+    'api_post_likes': ('GET', False, lambda rng, ctx: (f"/api/posts/{rng.choice(ctx['post_ids'])}/likes", {})),
+    'like_toggle': ('POST', True, lambda rng, ctx: (f"/api/posts/{rng.choice(ctx['post_ids'])}/like", {})),
+    'create_post_image': ('POST', True, lambda rng, ctx: ('/api/posts', {'form': {
+        'title': f'Bench post {rng.randrange(10**9)}',
+        'content': 'Benchmark post with a *cover image*.',
+        'tags': f'{BENCH_TAG_PREFIX}0,{BENCH_TAG_PREFIX}1',
+    }, 'file': ('cover_image', 'cover.png', _cover_image(rng))})),
+    'login': ('POST', False, lambda rng, ctx: ('/api/login', {'json': {
+        'username': f"{BENCH_PREFIX}{rng.choice(ctx['user_numbers'])}", 'password': BENCH_PASSWORD,
+    }})),
+}
+
+# The endpoints asgi.py can serve natively, for sync vs async comparisons
+READ_SCENARIOS = ('home_anonymous', 'home_logged_in', 'api_posts', 'api_post',
+                  'api_comments', 'api_tags', 'api_post_likes')
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _summarize(name, samples, elapsed):
+    """samples: [(seconds, ok, queries or None)]"""
+    latencies = sorted(s[0] * 1000 for s in samples)
+    queries = [s[2] for s in samples if s[2] is not None]
+    return {
+        'scenario': name,
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if not s[1]),
+        'p50_ms': round(_percentile(latencies, 50), 2),
+        'p95_ms': round(_percentile(latencies, 95), 2),
+        'p99_ms': round(_percentile(latencies, 99), 2),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+def _context(conn):
+    cur = conn.cursor()
+    cur.execute('SELECT id FROM posts ORDER BY id DESC LIMIT 500')
+    post_ids = [r['id'] for r in cur.fetchall()]
+    cur.execute("SELECT substring(username from %s)::int AS n FROM users WHERE starts_with(username, %s)",
+                (f'^{BENCH_PREFIX}(\\d+)$', BENCH_PREFIX))
+    user_numbers = [r['n'] for r in cur.fetchall() if r['n'] is not None]
+    cur.close()
+    if not post_ids or not user_numbers:
+        raise RuntimeError('No benchmark data; run `flask bench seed` first')
+    return {'post_ids': post_ids, 'user_numbers': user_numbers}
+
+
+class _TestClientDriver:
+    """Calls the app in-process, one thread, counting queries exactly"""
+
+    def __init__(self, app, ctx, rng):
+        self.app = app
+        self.ctx = ctx
+        self.rng = rng
+        self.clients = {}
+
+    def _client(self, logged_in):
+        if logged_in not in self.clients:
+            client = self.app.test_client()
+            if logged_in:
+                client.post('/api/login', json={
+                    'username': f"{BENCH_PREFIX}{self.ctx['user_numbers'][0]}", 'password': BENCH_PASSWORD,
+                })
+            self.clients[logged_in] = client
+        return self.clients[logged_in]
+
+    def run(self, name, count, threads):
+        method, logged_in, build = SCENARIOS[name]
+        client = self._client(logged_in)
+        samples = []
+        started = time.perf_counter()
+        for _ in range(count):
+            path, kwargs = build(self.rng, self.ctx)
+            if 'file' in kwargs:
+                field, filename, data = kwargs['file']
+                kwargs = {'data': {**kwargs['form'], field: (io.BytesIO(data), filename)},
+                          'content_type': 'multipart/form-data'}
+            with count_queries() as queries:
+                t0 = time.perf_counter()
+                response = client.open(path, method=method, **kwargs)
+                elapsed = time.perf_counter() - t0
+            samples.append((elapsed, response.status_code < 400, len(queries)))
+        return _summarize(name, samples, time.perf_counter() - started)
+
+    def close(self):
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _ServerDriver:
+    """Real HTTP against a threaded WSGI server, from a pool of client threads
+
+    Queries per request come from the Server-Timing header, so they're only
+    reported when the app runs with PROFILING=1.
+    """
+
+    def __init__(self, app, ctx, rng):
+        self.ctx = ctx
+        self.rng = rng
+        self._rng_lock = threading.Lock()
+        self._local = threading.local()
+        self.base = self.start(app)
+
+    def start(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def _opener(self, logged_in):
+        openers = getattr(self._local, 'openers', None)
+        if openers is None:
+            openers = self._local.openers = {}
+        if logged_in not in openers:
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+            if logged_in:
+                with self._rng_lock:
+                    number = self.rng.choice(self.ctx['user_numbers'])
+                self._send(opener, 'POST', '/api/login', {'json': {
+                    'username': f'{BENCH_PREFIX}{number}', 'password': BENCH_PASSWORD}})
+            openers[logged_in] = opener
+        return openers[logged_in]
+
+    def _send(self, opener, method, path, kwargs):
+        headers = {}
+        data = None
+        if 'json' in kwargs:
+            data = json.dumps(kwargs['json']).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif 'file' in kwargs:
+            boundary = f'bench{random.getrandbits(64):x}'
+            field, filename, payload = kwargs['file']
+            body = io.BytesIO()
+            for key, value in kwargs['form'].items():
+                body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+            body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                       f'Content-Type: image/png\r\n\r\n'.encode())
+            body.write(payload)
+            body.write(f'\r\n--{boundary}--\r\n'.encode())
+            data = body.getvalue()
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        request = urllib.request.Request(self.base + path, data=data, method=method, headers=headers)
+        try:
+            with opener.open(request) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Server-Timing')
+
+    def run(self, name, count, threads):
+        method, logged_in, build = SCENARIOS[name]
+
+        def one(_):
+            opener = self._opener(logged_in)
+            with self._rng_lock:
+                path, kwargs = build(self.rng, self.ctx)
+            t0 = time.perf_counter()
+            status, timing = self._send(opener, method, path, kwargs)
+            elapsed = time.perf_counter() - t0
+            match = _QUERIES_RE.search(timing or '')
+            return elapsed, status < 400, int(match.group(1)) if match else None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            samples = list(pool.map(one, range(count)))
+        return _summarize(name, samples, time.perf_counter() - started)
+
+    def close(self):
+        self.server.shutdown()
+
+
+class _AsgiDriver(_ServerDriver):
+    """The same HTTP clients against asgi.py under uvicorn
+
+    ASYNC_READS decides whether the read endpoints run as async views or
+    through the WSGI app on asgiref's threads, so the two can be compared on
+    one server and one process.
+    """
+
+    def start(self, app):
+        import uvicorn
+        from asgi import application
+
+        port = _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(application, host='127.0.0.1', port=port,
+                                                    log_level='warning', lifespan='on'))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError('uvicorn failed to start')
+            time.sleep(0.05)
+        return f'http://127.0.0.1:{port}'
+
+    def close(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+_DRIVERS = {'client': _TestClientDriver, 'server': _ServerDriver, 'asgi': _AsgiDriver}
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (Linux reports KiB)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def run_benchmarks(app, conn, scenarios=None, requests=200, threads=8, mode='client', seed=1):
+    """Run each scenario `requests` times and return a list of result dicts"""
+    from utils.passwords import ip_limiter, user_limiter
+
+    ctx = _context(conn)
+    rng = random.Random(seed)
+    # The login limiter would otherwise start answering 429 partway through
+    saved = ip_limiter.max_attempts, user_limiter.max_attempts
+    ip_limiter.max_attempts = user_limiter.max_attempts = 10 ** 9
+
+    driver = _DRIVERS[mode](app, ctx, rng)
+    try:
+        results = []
+        for name in scenarios or SCENARIOS:
+            if name not in SCENARIOS:
+                raise ValueError(f"Unknown scenario: {name}")
+            results.append(driver.run(name, requests, threads))
+        return results
+    finally:
+        driver.close()
+        ip_limiter.max_attempts, user_limiter.max_attempts = saved
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regressions against a saved baseline, as human-readable strings"""
+    previous = {r['scenario']: r for r in baseline.get('results', [])}
+    problems = []
+    for result in results:
+        before = previous.get(result['scenario'])
+        if before is None:
+            continue
+        if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            problems.append(f"{result['scenario']}: p95 {result['p95_ms']} ms vs {before['p95_ms']} ms baseline")
+        if (before.get('queries_per_request') is not None and result.get('queries_per_request') is not None
+                and result['queries_per_request'] > before['queries_per_request']):
+            problems.append(f"{result['scenario']}: {result['queries_per_request']} queries/request "
+                            f"vs {before['queries_per_request']} baseline")
+        if result['errors'] > before.get('errors', 0):
+            problems.append(f"{result['scenario']}: {result['errors']} errors vs {before.get('errors', 0)} baseline")
+    return problems
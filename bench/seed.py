@@ -0,0 +1,135 @@
+import random
+from psycopg2.extras import execute_values
+
+from db.counters import reconcile_counters
+from db.home_feed import refresh_feed_posts
+from db.trending import rebuild_trending
+from utils.markdown_renderer import render_for_storage, summarize
+from utils.passwords import hash_password
+
+# Every seeded account is bench_user_<n>@bench.invalid with this password,
+# and every seeded tag starts with a prefix no real tag would use. reset()
+# only removes rows carrying these markers.
+BENCH_PASSWORD = 'bench-password'
+BENCH_PREFIX = 'bench_user_'
+BENCH_EMAIL_DOMAIN = 'bench.invalid'
+BENCH_TAG_PREFIX = '~bench-'
+
+_WORDS = (
+    'python flask postgres index query cache latency throughput cursor page '
+    'render template markdown image upload variant search rank token tag '
+    'comment like feed profile session worker pool thread lock batch stream '
+    'the a of and to in is for on with as by at from that this it be are'
+).split()
+
+
+def _sentence(rng, n):
+    words = [rng.choice(_WORDS) for _ in range(n)]
+    return ' '.join(words).capitalize() + '.'
+
+def _body(rng):
+    """A few paragraphs of markdown, sometimes with a heading, list or code block"""
+    parts = []
+    for _ in range(rng.randint(2, 6)):
+        kind = rng.random()
+        if kind < 0.15:
+            parts.append('## ' + _sentence(rng, rng.randint(2, 5)).rstrip('.'))
+        elif kind < 0.25:
+            parts.append('\n'.join(f'- {_sentence(rng, rng.randint(3, 8))}' for _ in range(rng.randint(2, 4))))
+        elif kind < 0.32:
+            parts.append("```python\nprint('hello')\n```")
+        else:
+            parts.append(' '.join(_sentence(rng, rng.randint(6, 16)) for _ in range(rng.randint(2, 5))))
+    return '\n\n'.join(parts)
+
+def reset(conn):
+    """Remove everything a previous seed created (cascades to posts, comments and likes)
+
+    Seeded tags that other posts have picked up are kept.
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM users WHERE starts_with(username, %s) AND split_part(email, '@', 2) = %s",
+                (BENCH_PREFIX, BENCH_EMAIL_DOMAIN))
+    deleted = cur.rowcount
+    cur.execute('''
+        DELETE FROM tags
+        WHERE starts_with(name, %s)
+          AND NOT EXISTS (SELECT 1 FROM post_tags WHERE post_tags.tag_id = tags.id)
+    ''', (BENCH_TAG_PREFIX,))
+    reconcile_counters(cur)
+    conn.commit()
+    cur.close()
+    return deleted
+
+def seed(conn, users=200, posts=2000, comments=5000, likes=10000, tags=50, seed=1):
+    """Insert a reproducible data set; the same arguments always give the same rows
+
+    Returns {table: rows_inserted}. Counters and trending scores are
+    recomputed and the new posts' feed rows built at the end so the
+    denormalized data matches.
+    """
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    # One hash for every account: bcrypt per user would dominate seeding time
+    password_hash = hash_password(BENCH_PASSWORD)
+
+    cur.execute("SELECT COALESCE(MAX(substring(username from %s)::int), 0) AS n FROM users WHERE starts_with(username, %s)",
+                (f'^{BENCH_PREFIX}(\\d+)$', BENCH_PREFIX))
+    first = cur.fetchone()['n'] + 1
+    rows = [(f'{BENCH_PREFIX}{n}', f'{BENCH_PREFIX}{n}@{BENCH_EMAIL_DOMAIN}', password_hash)
+            for n in range(first, first + users)]
+    user_ids = [r['id'] for r in execute_values(
+        cur, 'INSERT INTO users (username, email, password_hash) VALUES %s RETURNING id', rows, fetch=True)]
+
+    tag_names = [f'{BENCH_TAG_PREFIX}{n}' for n in range(tags)]
+    execute_values(cur, 'INSERT INTO tags (name) VALUES %s ON CONFLICT (name) DO NOTHING', [(n,) for n in tag_names])
+    cur.execute('SELECT id FROM tags WHERE name = ANY(%s) ORDER BY id', (tag_names,))
+    tag_ids = [r['id'] for r in cur.fetchall()]
+
+    # Spread creation times over the last year so keyset pages look realistic
+    post_rows = []
+    for _ in range(posts):
+        content = _body(rng)
+        html, digest = render_for_storage(content)
+        summary = summarize(html)
+        post_rows.append((
+            rng.choice(user_ids), _sentence(rng, rng.randint(3, 8)).rstrip('.'), content, html, digest,
+            summary['excerpt'], summary['excerpt_html'], summary['word_count'], summary['reading_time'],
+            rng.randint(0, 365 * 24 * 3600),
+        ))
+    post_ids = [r['id'] for r in execute_values(cur, '''
+        INSERT INTO posts (user_id, title, content, content_html, content_hash, excerpt, excerpt_html,
+                           word_count, reading_time, created_at)
+        VALUES %s RETURNING id
+    ''', post_rows, template='(%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW() - make_interval(secs => %s))',
+        fetch=True, page_size=500)]
+    cur.execute('UPDATE posts SET updated_at = created_at WHERE id = ANY(%s)', (post_ids,))
+
+    links = set()
+    for post_id in post_ids:
+        for tag_id in rng.sample(tag_ids, min(len(tag_ids), rng.randint(0, 4))):
+            links.add((post_id, tag_id))
+    execute_values(cur, 'INSERT INTO post_tags (post_id, tag_id) VALUES %s ON CONFLICT DO NOTHING', sorted(links))
+
+    comment_rows = [(rng.choice(post_ids), rng.choice(user_ids), _sentence(rng, rng.randint(4, 20)))
+                    for _ in range(comments)]
+    execute_values(cur, 'INSERT INTO comments (post_id, user_id, content) VALUES %s', comment_rows, page_size=1000)
+
+    # Skew likes towards a few popular posts, like real traffic
+    like_pairs = set()
+    hot = post_ids[:max(1, len(post_ids) // 50)]
+    for _ in range(likes):
+        post_id = rng.choice(hot) if rng.random() < 0.3 else rng.choice(post_ids)
+        like_pairs.add((rng.choice(user_ids), post_id))
+    execute_values(cur, 'INSERT INTO likes (user_id, post_id) VALUES %s ON CONFLICT DO NOTHING',
+                   sorted(like_pairs), page_size=1000)
+
+    reconcile_counters(cur)
+    rebuild_trending(cur)
+    refresh_feed_posts(cur, post_ids)
+    conn.commit()
+    cur.close()
+    return {
+        'users': len(user_ids), 'tags': len(tag_ids), 'posts': len(post_ids),
+        'post_tags': len(links), 'comments': len(comment_rows), 'likes': len(like_pairs),
+    }
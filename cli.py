@@ -0,0 +1,259 @@
+import json
+import click
+from flask.cli import AppGroup
+
+from db.connection import get_db_connection
+from db.counters import reconcile_counters
+from db.explain import check_queries
+from db.home_feed import rebuild_feed
+from db.trending import rebuild_trending
+from db import migrate
+from utils.image_handler import generate_variants, record_variants, rehash_existing_images, VARIANT_COLUMNS
+from utils.markdown_renderer import backfill_post_html
+
+db_cli = AppGroup('db', help='Schema migrations and query checks.')
+bench_cli = AppGroup('bench', help='Seed benchmark data and run the load tests.')
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, default=None, help='Stop after this migration version.')
+def db_upgrade(target):
+    """Apply pending migrations"""
+    conn = get_db_connection()
+    applied = migrate.upgrade(conn, target)
+    conn.close()
+    if not applied:
+        print("✓ Database already up to date")
+    for version in applied:
+        print(f"✓ Applied migration {version:04d}")
+
+@db_cli.command('downgrade')
+@click.option('--steps', type=int, default=1, show_default=True, help='How many migrations to revert.')
+def db_downgrade(steps):
+    """Revert the most recent migrations"""
+    conn = get_db_connection()
+    reverted = migrate.downgrade(conn, steps)
+    conn.close()
+    if not reverted:
+        print("Nothing to revert")
+    for version in reverted:
+        print(f"✓ Reverted migration {version:04d}")
+
+@db_cli.command('status')
+def db_status():
+    """Show which migrations have been applied"""
+    conn = get_db_connection()
+    rows = migrate.status(conn)
+    conn.close()
+    for version, name, applied_at in rows:
+        state = f"applied {applied_at:%Y-%m-%d %H:%M}" if applied_at else "pending"
+        print(f"{version:04d}  {name:<28} {state}")
+
+@db_cli.command('check-queries')
+def db_check_queries():
+    """EXPLAIN the registered hot queries and flag any that need a seq scan"""
+    conn = get_db_connection()
+    problems = check_queries(conn)
+    conn.close()
+    if not problems:
+        print("✓ All registered queries can use an index")
+        return
+    for name, tables in problems.items():
+        print(f"✗ {name}: sequential scan on {', '.join(tables)}")
+    raise SystemExit(1)
+
+@bench_cli.command('seed')
+@click.option('--users', default=200, show_default=True)
+@click.option('--posts', default=2000, show_default=True)
+@click.option('--comments', default=5000, show_default=True)
+@click.option('--likes', default=10000, show_default=True)
+@click.option('--tags', default=50, show_default=True)
+@click.option('--seed', 'seed_value', default=1, show_default=True, help='Random seed; same seed, same data.')
+@click.option('--reset', is_flag=True, help='Delete earlier benchmark data first.')
+def bench_seed(users, posts, comments, likes, tags, seed_value, reset):
+    """Fill the database with reproducible benchmark data"""
+    from bench.seed import seed, reset as reset_seed
+
+    conn = get_db_connection()
+    if reset:
+        print(f"✓ Removed {reset_seed(conn)} benchmark user(s) and their content")
+    counts = seed(conn, users=users, posts=posts, comments=comments, likes=likes, tags=tags, seed=seed_value)
+    conn.close()
+    print("✓ Seeded " + ', '.join(f"{n} {table}" for table, n in counts.items()))
+
+@bench_cli.command('run')
+@click.option('--mode', type=click.Choice(['client', 'server', 'asgi']), default='client', show_default=True,
+              help='In-process test client, HTTP against a threaded WSGI server, or asgi.py under uvicorn.')
+@click.option('--scenario', 'scenarios', multiple=True, help='Run only these scenarios (repeatable).')
+@click.option('--reads', is_flag=True, help='Run only the read endpoints asgi.py serves natively.')
+@click.option('--requests', 'count', default=200, show_default=True, help='Requests per scenario.')
+@click.option('--threads', default=8, show_default=True, help='Client threads in server mode.')
+@click.option('--seed', 'seed_value', default=1, show_default=True)
+@click.option('--baseline', type=click.Path(), help='Compare against this results file.')
+@click.option('--save', type=click.Path(), help='Write the results here (e.g. to use as a baseline).')
+@click.option('--tolerance', default=0.2, show_default=True, help='Allowed p95 growth before flagging.')
+def bench_run(mode, scenarios, reads, count, threads, seed_value, baseline, save, tolerance):
+    """Measure latency percentiles, throughput and queries per request"""
+    from flask import current_app
+    from bench.runner import READ_SCENARIOS, run_benchmarks, compare, peak_rss_mb
+
+    if reads:
+        scenarios = READ_SCENARIOS
+    conn = get_db_connection()
+    results = run_benchmarks(current_app._get_current_object(), conn, scenarios=scenarios or None,
+                             requests=count, threads=threads, mode=mode, seed=seed_value)
+    conn.close()
+
+    print(f"{'scenario':<20} {'reqs':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'queries':>8}")
+    for r in results:
+        queries = '-' if r['queries_per_request'] is None else r['queries_per_request']
+        print(f"{r['scenario']:<20} {r['requests']:>5} {r['errors']:>4} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r['throughput_rps']:>8} {queries:>8}")
+    rss = peak_rss_mb()
+    print(f"Peak RSS: {rss} MB")
+
+    if save:
+        with open(save, 'w', encoding='utf-8') as f:
+            json.dump({'mode': mode, 'requests': count, 'threads': threads, 'peak_rss_mb': rss,
+                       'results': results}, f, indent=2)
+        print(f"✓ Results saved to {save}")
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('mode') != mode:
+            raise click.ClickException(f"Baseline was recorded in {previous.get('mode')} mode, not {mode}")
+        problems = compare(results, previous, tolerance)
+        if problems:
+            for problem in problems:
+                print(f"✗ {problem}")
+            raise SystemExit(1)
+        print("✓ No regressions against the baseline")
+
+@bench_cli.command('compare-async')
+@click.option('--requests', 'count', default=500, show_default=True, help='Requests per scenario.')
+@click.option('--threads', default=32, show_default=True, help='Concurrent client threads.')
+def bench_compare_async(count, threads):
+    """Read endpoints under uvicorn, sync (WSGI on threads) vs async views
+
+    Each side runs in a fresh process with the same server, the same pool
+    size and the same client load, so throughput and peak RSS compare
+    like for like.
+    """
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    from flask import current_app
+
+    runs = {}
+    for label, flag in (('sync', '0'), ('async', '1')):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            subprocess.run(
+                [sys.executable, '-m', 'flask', '--app', current_app.import_name, 'bench', 'run', '--mode', 'asgi',
+                 '--reads', '--requests', str(count), '--threads', str(threads), '--save', path],
+                env={**os.environ, 'ASYNC_READS': flag}, check=True, stdout=subprocess.DEVNULL,
+            )
+            with open(path, encoding='utf-8') as f:
+                runs[label] = json.load(f)
+        finally:
+            os.unlink(path)
+
+    print(f"{'scenario':<20} {'sync req/s':>11} {'async req/s':>12} {'sync p95':>9} {'async p95':>10}")
+    for sync, async_ in zip(runs['sync']['results'], runs['async']['results']):
+        print(f"{sync['scenario']:<20} {sync['throughput_rps']:>11} {async_['throughput_rps']:>12} "
+              f"{sync['p95_ms']:>9} {async_['p95_ms']:>10}")
+    print(f"Peak RSS: sync {runs['sync']['peak_rss_mb']} MB, async {runs['async']['peak_rss_mb']} MB")
+
+@click.command('backfill-markdown')
+def backfill_markdown_command():
+    """Pre-render HTML for posts that don't have an up-to-date copy stored"""
+    conn = get_db_connection()
+    updated = backfill_post_html(conn)
+    if updated:
+        _rebuild_feed(conn)
+    conn.close()
+    print(f"✓ Rendered markdown for {updated} post(s)")
+
+@click.command('image-variants')
+def image_variants_command():
+    """Build responsive variants for existing images that don't have them"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    generated = 0
+    for kind, (table, image_column, variants_column) in VARIANT_COLUMNS.items():
+        cur.execute(
+            f'SELECT DISTINCT {image_column} AS path FROM {table} '
+            f'WHERE {image_column} IS NOT NULL AND {variants_column} IS NULL'
+        )
+        for row in cur.fetchall():
+            try:
+                record_variants(row['path'], kind, generate_variants(row['path'], kind))
+                generated += 1
+            except Exception as e:
+                print(f"Skipping {row['path']}: {e}")
+
+    cur.close()
+    conn.close()
+    print(f"✓ Generated variants for {generated} image(s)")
+
+@click.command('rehash-images')
+def rehash_images_command():
+    """Move existing uploads to content-addressed paths and rebuild refcounts"""
+    conn = get_db_connection()
+    moved = rehash_existing_images(conn)
+    if moved:
+        _rebuild_feed(conn)
+    conn.close()
+    print(f"✓ Moved {moved} image(s) to content-addressed storage")
+
+@click.command('reconcile-counters')
+def reconcile_counters_command():
+    """Repair like/comment/post counters that drifted"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    fixed = reconcile_counters(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+    for label, rows in fixed.items():
+        print(f"✓ {label}: {rows} row(s) corrected")
+
+def _rebuild_feed(conn):
+    cur = conn.cursor()
+    rows = rebuild_feed(cur)
+    conn.commit()
+    cur.close()
+    return rows
+
+@click.command('rebuild-feed')
+def rebuild_feed_command():
+    """Recompute the precomputed home page rows from the source tables"""
+    conn = get_db_connection()
+    rows = _rebuild_feed(conn)
+    conn.close()
+    print(f"✓ Rebuilt {rows} feed row(s)")
+
+@click.command('rebuild-trending')
+def rebuild_trending_command():
+    """Recompute trending scores from every like and comment"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    ranked = rebuild_trending(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"✓ {ranked} post(s) trending")
+
+def init_app(app):
+    """Register the CLI commands on the Flask app"""
+    app.cli.add_command(db_cli)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(backfill_markdown_command)
+    app.cli.add_command(image_variants_command)
+    app.cli.add_command(rehash_images_command)
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(rebuild_feed_command)
+    app.cli.add_command(rebuild_trending_command)
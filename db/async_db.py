@@ -0,0 +1,96 @@
+import os
+from dotenv import load_dotenv
+from flask import g, has_app_context
+
+from db.connection import choose_replica
+
+try:
+    from psycopg import OperationalError
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool, PoolTimeout
+except ImportError:
+    AsyncConnectionPool = None
+
+load_dotenv()
+
+# Connections for the async read views served by asgi.py. Every statement
+# checks out its own connection, so the independent queries behind a page
+# run at the same time instead of one after another.
+ASYNC_POOL_MIN_SIZE = int(os.getenv('ASYNC_DB_POOL_MIN_SIZE', 1))
+ASYNC_POOL_MAX_SIZE = int(os.getenv('ASYNC_DB_POOL_MAX_SIZE', os.getenv('DB_POOL_MAX_SIZE', 10)))
+ASYNC_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+
+# One pool for the primary (None) and one per replica URL, opened on first use
+_pools = {}
+
+
+async def _open(url, min_size):
+    if AsyncConnectionPool is None:
+        raise RuntimeError("Async mode needs the psycopg and psycopg-pool packages "
+                           "(pip install 'psycopg[binary]' psycopg-pool)")
+    pool = AsyncConnectionPool(
+        url or os.getenv('DATABASE_URL'),
+        min_size=min_size,
+        max_size=ASYNC_POOL_MAX_SIZE,
+        timeout=ASYNC_POOL_TIMEOUT,
+        # Read-only statements, so no transaction to hold open between them
+        kwargs={'row_factory': dict_row, 'autocommit': True},
+        open=False,
+    )
+    await pool.open()
+    return pool
+
+async def _get_pool(url=None):
+    pool = _pools.get(url)
+    if pool is None:
+        # Replica pools start empty so one that's down doesn't block startup
+        pool = _pools[url] = await _open(url, ASYNC_POOL_MIN_SIZE if url is None else 0)
+    return pool
+
+async def open_pool():
+    """Create and fill the primary's async pool; call from the event loop that will use it"""
+    return await _get_pool()
+
+async def close_pool():
+    while _pools:
+        _, pool = _pools.popitem()
+        await pool.close()
+
+async def _execute(query, params, fetch):
+    # Same routing as get_read_connection(): a healthy replica unless this
+    # session is pinned to the primary after its own write
+    replica = choose_replica()
+    if replica is not None:
+        try:
+            pool = await _get_pool(replica.url)
+            async with pool.connection() as conn:
+                cur = await conn.execute(query, params)
+                rows = await fetch(cur)
+            if has_app_context():
+                g.read_from_replica = True
+            return rows
+        except (OperationalError, PoolTimeout) as e:
+            replica.mark_down(e)
+
+    pool = await _get_pool()
+    async with pool.connection() as conn:
+        cur = await conn.execute(query, params)
+        return await fetch(cur)
+
+async def fetch_all(query, params=()):
+    """Run one statement on a pooled connection and return all rows as dicts"""
+    return await _execute(query, params, lambda cur: cur.fetchall())
+
+async def fetch_one(query, params=()):
+    """Run one statement on a pooled connection and return the first row, or None"""
+    return await _execute(query, params, lambda cur: cur.fetchone())
+
+def get_async_pool_stats():
+    """Async pool usage numbers, or None outside async mode"""
+    if None not in _pools:
+        return None
+    stats = _pools[None].get_stats()
+    replicas = {url: pool.get_stats() for url, pool in _pools.items() if url is not None}
+    if replicas:
+        stats['replicas'] = list(replicas.values())
+    return stats
@@ -1,11 +1,172 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import threading
+import time
+from flask import g, has_app_context, has_request_context, request, session
 import os
 from dotenv import load_dotenv
 
+from db.pool import ConnectionPool
+from db.query_counter import CountingCursor
+from db.replicas import REPLICA_URLS, ReplicaSet
+
 load_dotenv()
 
+# After a request that wrote through the primary, that session reads from
+# the primary for this many seconds so the user sees their own change even
+# if the replicas are behind. Keep it above REPLICA_MAX_LAG.
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 10))
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_pool = None
+_pool_lock = threading.Lock()
+_replicas = None
+_replicas_lock = threading.Lock()
+
+def _pool_settings():
+    return {
+        'max_size': int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+        'max_lifetime': float(os.getenv("DB_POOL_MAX_LIFETIME", 3600)),
+        'max_idle': float(os.getenv("DB_POOL_MAX_IDLE", 300)),
+        'timeout': float(os.getenv("DB_POOL_TIMEOUT", 30)),
+    }
+
+def get_pool():
+    """Return the shared connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.getenv("DATABASE_URL"),
+                    min_size=int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+                    cursor_factory=CountingCursor,
+                    **_pool_settings(),
+                )
+    return _pool
+
+def get_replicas():
+    """The health-checked ReplicaSet, or None when no replicas are configured"""
+    global _replicas
+    if not REPLICA_URLS:
+        return None
+    if _replicas is None:
+        with _replicas_lock:
+            if _replicas is None:
+                replicas = ReplicaSet(REPLICA_URLS, get_pool(), **_pool_settings())
+                replicas.start()
+                _replicas = replicas
+    return _replicas
+
+def _held(key):
+    """The app context's connection under key, if this context's checkout of it is still open
+
+    Handlers close() connections themselves, after which the pool may hand
+    the same object to another thread, so being checked out isn't enough:
+    the lease has to be the one this context got.
+    """
+    held = g.get(key)
+    if held is None:
+        return None
+    conn, lease = held
+    if conn._checked_out and conn._lease == lease:
+        return conn
+    g.pop(key)
+    return None
+
 def get_db_connection():
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-    return conn
\ No newline at end of file
+    """Get a pooled connection to the primary, shared for the rest of the app context
+
+    Use this for anything that writes. Calling close() on the connection
+    hands it back to the pool. Anything still checked out when the app
+    context ends is returned on teardown.
+    """
+    if not has_app_context():
+        return get_pool().getconn()
+
+    g.used_primary = True
+    conn = _held('db_conn')
+    if conn is None:
+        conn = get_pool().getconn()
+        g.db_conn = (conn, conn._lease)
+    return conn
+
+def is_pinned_to_primary():
+    """Whether this session wrote recently enough that it must read from the primary"""
+    return has_request_context() and session.get('primary_until', 0) > time.time()
+
+def choose_replica():
+    """The replica this request should read from, or None for the primary"""
+    replicas = get_replicas()
+    if replicas is None or not has_app_context():
+        return None
+    # Reads after a write in the same request must see it too
+    if g.get('used_primary') or is_pinned_to_primary():
+        return None
+    return replicas.pick()
+
+def get_read_connection():
+    """A connection for read-only queries: a healthy replica when there is one
+
+    Falls back to the primary connection (see get_db_connection) when no
+    replicas are configured or healthy, and while the session is pinned to
+    the primary after its own write.
+    """
+    if has_app_context():
+        conn = _held('read_conn')
+        if conn is not None and not g.get('used_primary'):
+            return conn
+
+    replica = choose_replica()
+    if replica is not None:
+        conn = replica.getconn()
+        if conn is not None:
+            g.read_conn = (conn, conn._lease)
+            g.read_from_replica = True
+            return conn
+    return get_db_connection()
+
+def checkout_read_connection():
+    """A read connection of the caller's own, picked like get_read_connection()
+
+    Not shared with the app context: the caller closes it, and nothing else
+    in the request can close or reuse it meanwhile. For reads that outlive
+    the handler, like a streamed response.
+    """
+    replica = choose_replica()
+    if replica is not None:
+        conn = replica.getconn()
+        if conn is not None:
+            g.read_from_replica = True
+            return conn
+    return get_pool().getconn()
+
+def close_db_connection(exception=None):
+    """Return the app context's connections to their pools"""
+    for key in ('db_conn', 'read_conn'):
+        # Only ones this context still holds; anything closed earlier may be someone else's now
+        conn = _held(key)
+        g.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+def _pin_after_write(response):
+    if (REPLICA_URLS and request.method in WRITE_METHODS
+            and g.get('used_primary') and response.status_code < 400):
+        session['primary_until'] = time.time() + REPLICA_STICKY_SECONDS
+    return response
+
+def get_pool_stats():
+    """Pool usage numbers, or None if the pool hasn't been created yet"""
+    if _pool is None:
+        return None
+    return _pool.stats()
+
+def get_replica_stats():
+    """Health, lag and pool usage per replica, or None without replicas"""
+    if _replicas is None:
+        return None
+    return _replicas.stats()
+
+def init_app(app):
+    """Hook connection cleanup and read-your-writes pinning into the Flask app"""
+    app.after_request(_pin_after_write)
+    app.teardown_appcontext(close_db_connection)
@@ -0,0 +1,75 @@
+# Denormalized counters. Handlers bump these in the same transaction as the
+# row they add or remove, so list pages read a column instead of COUNT()ing
+# a join. reconcile_counters() repairs any drift. Columns come from
+# migration 0005.
+
+# (label, UPDATE that sets the counter from the source table wherever it differs)
+RECONCILE_QUERIES = [
+    ('posts.like_count', '''
+        UPDATE posts SET like_count = actual.n
+        FROM (
+            SELECT posts.id, COUNT(likes.post_id) AS n
+            FROM posts LEFT JOIN likes ON likes.post_id = posts.id
+            GROUP BY posts.id
+        ) AS actual
+        WHERE posts.id = actual.id AND posts.like_count IS DISTINCT FROM actual.n
+    '''),
+    ('posts.comment_count', '''
+        UPDATE posts SET comment_count = actual.n
+        FROM (
+            SELECT posts.id, COUNT(comments.id) AS n
+            FROM posts LEFT JOIN comments ON comments.post_id = posts.id
+            GROUP BY posts.id
+        ) AS actual
+        WHERE posts.id = actual.id AND posts.comment_count IS DISTINCT FROM actual.n
+    '''),
+    ('tags.post_count', '''
+        UPDATE tags SET post_count = actual.n
+        FROM (
+            SELECT tags.id, COUNT(post_tags.post_id) AS n
+            FROM tags LEFT JOIN post_tags ON post_tags.tag_id = tags.id
+            GROUP BY tags.id
+        ) AS actual
+        WHERE tags.id = actual.id AND tags.post_count IS DISTINCT FROM actual.n
+    '''),
+    ('users.post_count', '''
+        UPDATE users SET post_count = actual.n
+        FROM (
+            SELECT users.id, COUNT(posts.id) AS n
+            FROM users LEFT JOIN posts ON posts.user_id = users.id
+            GROUP BY users.id
+        ) AS actual
+        WHERE users.id = actual.id AND users.post_count IS DISTINCT FROM actual.n
+    '''),
+    # After the post counters above: the front page (migration 0008) shows its own copy
+    ('feed_items counts', '''
+        UPDATE feed_items SET like_count = posts.like_count, comment_count = posts.comment_count, refreshed_at = NOW()
+        FROM posts
+        WHERE posts.id = feed_items.post_id
+          AND (feed_items.like_count <> posts.like_count OR feed_items.comment_count <> posts.comment_count)
+    '''),
+]
+
+
+def release_post_tags(cur, post_id):
+    """Unlink all tags from a post and decrement their post counts"""
+    cur.execute('DELETE FROM post_tags WHERE post_id = %s RETURNING tag_id', (post_id,))
+    tag_ids = [row['tag_id'] for row in cur.fetchall()]
+    if tag_ids:
+        cur.execute(
+            'UPDATE tags SET post_count = GREATEST(post_count - 1, 0) WHERE id = ANY(%s)',
+            (tag_ids,)
+        )
+    return tag_ids
+
+def reconcile_counters(cur):
+    """Recompute every counter from its source table
+
+    Returns {counter: rows_fixed}; anything non-zero means the counters
+    had drifted.
+    """
+    fixed = {}
+    for label, query in RECONCILE_QUERIES:
+        cur.execute(query)
+        fixed[label] = cur.rowcount
+    return fixed
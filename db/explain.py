@@ -0,0 +1,120 @@
+import json
+from datetime import datetime
+
+# Representative versions of the hot queries, with sample parameters. Add
+# new list/lookup queries here so `flask db check-queries` covers them.
+_FAR_FUTURE = datetime(9999, 1, 1)
+
+REGISTERED_QUERIES = {
+    'feed page': ('''
+        SELECT posts.id, posts.title, posts.created_at, users.username, posts.like_count
+        FROM posts JOIN users ON posts.user_id = users.id
+        WHERE (posts.created_at, posts.id) < (%s, %s)
+        ORDER BY posts.created_at DESC, posts.id DESC
+        LIMIT 21
+    ''', (_FAR_FUTURE, 0)),
+    'home feed rows': ('''
+        SELECT post_id, title, created_at, username, like_count, comment_count, tags, comments
+        FROM feed_items
+        WHERE (created_at, post_id) < (%s, %s)
+        ORDER BY created_at DESC, post_id DESC
+        LIMIT 21
+    ''', (_FAR_FUTURE, 0)),
+    'trending page': ('''
+        SELECT posts.id, posts.title, posts.trending_score
+        FROM posts
+        WHERE posts.trending_score IS NOT NULL AND (posts.trending_score, posts.id) < (%s, %s)
+        ORDER BY posts.trending_score DESC, posts.id DESC
+        LIMIT 21
+    ''', (float('inf'), 0)),
+    'user profile posts': ('''
+        SELECT posts.id, posts.title, posts.created_at, posts.comment_count
+        FROM posts
+        WHERE posts.user_id = %s AND (posts.created_at, posts.id) < (%s, %s)
+        ORDER BY posts.created_at DESC, posts.id DESC
+        LIMIT 21
+    ''', (1, _FAR_FUTURE, 0)),
+    'user by username': (
+        'SELECT id, username FROM users WHERE username = %s', ('someone',)
+    ),
+    'users page': ('''
+        SELECT id, username, created_at FROM users
+        WHERE (created_at, id) < (%s, %s)
+        ORDER BY created_at DESC, id DESC
+        LIMIT 21
+    ''', (_FAR_FUTURE, 0)),
+    'post comments': ('''
+        SELECT comments.id, comments.content, comments.created_at
+        FROM comments
+        WHERE comments.post_id = %s AND (comments.created_at, comments.id) > (%s, %s)
+        ORDER BY comments.created_at ASC, comments.id ASC
+        LIMIT 21
+    ''', (1, datetime(1970, 1, 1), 0)),
+    'feed comments batch': (
+        'SELECT id, post_id FROM comments WHERE post_id = ANY(%s)', ([1, 2, 3],)
+    ),
+    'feed tags batch': (
+        'SELECT post_id, tag_id FROM post_tags WHERE post_id = ANY(%s)', ([1, 2, 3],)
+    ),
+    'like lookup': (
+        'SELECT 1 FROM likes WHERE user_id = %s AND post_id = %s', (1, 1)
+    ),
+    'post likes': (
+        'SELECT user_id FROM likes WHERE post_id = %s', (1,)
+    ),
+    'liked posts page': ('''
+        SELECT likes.post_id, likes.created_at FROM likes
+        WHERE likes.user_id = %s AND (likes.created_at, likes.post_id) < (%s, %s)
+        ORDER BY likes.created_at DESC, likes.post_id DESC
+        LIMIT 21
+    ''', (1, _FAR_FUTURE, 0)),
+    'posts for tag': ('''
+        SELECT post_id FROM post_tags WHERE tag_id = %s
+    ''', (1,)),
+    'tag by name': (
+        'SELECT id FROM tags WHERE name = %s', ('python',)
+    ),
+    'tag listing': (
+        'SELECT id, name, post_count FROM tags ORDER BY post_count DESC, name ASC LIMIT 50', ()
+    ),
+    'full-text search': ('''
+        SELECT id FROM posts WHERE search_vector @@ to_tsquery('english', %s)
+    ''', ('python:*',)),
+}
+
+
+def _seq_scans(plan):
+    """Tables hit by a Seq Scan anywhere in an EXPLAIN (FORMAT JSON) plan"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found.extend(_seq_scans(child))
+    return found
+
+def check_queries(conn, queries=None):
+    """EXPLAIN each registered query and report the ones that need a seq scan
+
+    Sequential scans are disabled for the check, so the planner only falls
+    back to one when no usable index exists - which is what this is looking
+    for, whatever the current table sizes are. Returns {name: [tables]}
+    for the offending queries.
+    """
+    queries = queries if queries is not None else REGISTERED_QUERIES
+    problems = {}
+    cur = conn.cursor()
+    try:
+        cur.execute('SET LOCAL enable_seqscan = off')
+        for name, (sql, params) in queries.items():
+            cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            raw = cur.fetchone()
+            plan = list(raw.values())[0] if isinstance(raw, dict) else raw[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = _seq_scans(plan[0]['Plan'])
+            if tables:
+                problems[name] = tables
+    finally:
+        conn.rollback()
+        cur.close()
+    return problems
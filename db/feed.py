@@ -0,0 +1,68 @@
+# Batched loaders for the data hanging off a page of posts. Each loader runs
+# a single query for the whole page instead of one query per post.
+
+COMMENTS_SQL = '''
+    SELECT
+        comments.id,
+        comments.post_id,
+        comments.content,
+        comments.created_at,
+        users.username
+    FROM comments
+    JOIN users ON comments.user_id = users.id
+    WHERE comments.post_id = ANY(%s)
+    ORDER BY comments.post_id, comments.created_at ASC
+'''
+
+TAGS_SQL = '''
+    SELECT post_tags.post_id,
+           tags.id,
+           tags.name
+    FROM post_tags
+    JOIN tags ON tags.id = post_tags.tag_id
+    WHERE post_tags.post_id = ANY(%s)
+    ORDER BY tags.name ASC
+'''
+
+
+def _group_comments(rows, post_ids):
+    comments = {post_id: [] for post_id in post_ids}
+    for row in rows:
+        comments[row['post_id']].append(row)
+    return comments
+
+def _group_tags(rows, post_ids):
+    tags = {post_id: [] for post_id in post_ids}
+    for row in rows:
+        tags[row['post_id']].append({'id': row['id'], 'name': row['name']})
+    return tags
+
+def load_comments(cur, post_ids):
+    """Return {post_id: [comment, ...]} for every post in post_ids"""
+    if not post_ids:
+        return {}
+    cur.execute(COMMENTS_SQL, (list(post_ids),))
+    return _group_comments(cur.fetchall(), post_ids)
+
+def load_tags(cur, post_ids):
+    """Return {post_id: [tag, ...]} for every post in post_ids"""
+    if not post_ids:
+        return {}
+    cur.execute(TAGS_SQL, (list(post_ids),))
+    return _group_tags(cur.fetchall(), post_ids)
+
+def attach_feed_data(cur, posts, comments=True, tags=True):
+    """Stitch comments and/or tags onto a list of post dicts in place"""
+    post_ids = [post['id'] for post in posts]
+
+    if comments:
+        comments_by_post = load_comments(cur, post_ids)
+        for post in posts:
+            post['comments'] = comments_by_post[post['id']]
+
+    if tags:
+        tags_by_post = load_tags(cur, post_ids)
+        for post in posts:
+            post['tags'] = tags_by_post[post['id']]
+
+    return posts
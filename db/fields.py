@@ -0,0 +1,51 @@
+from flask import request
+
+# Fields list endpoints can return via ?fields=; the full body is opt-in
+POST_LIST_FIELDS = {
+    'id': 'posts.id',
+    'title': 'posts.title',
+    'excerpt': 'posts.excerpt',
+    'excerpt_html': 'posts.excerpt_html',
+    'word_count': 'posts.word_count',
+    'reading_time': 'posts.reading_time',
+    'content': 'posts.content',
+    'cover_image': 'posts.cover_image',
+    'created_at': 'posts.created_at',
+    'updated_at': 'posts.updated_at',
+    'comment_count': 'posts.comment_count',
+    'like_count': 'posts.like_count',
+    'username': 'users.username',
+    'user_id': 'users.id',
+}
+DEFAULT_POST_FIELDS = (
+    'title', 'excerpt', 'excerpt_html', 'word_count', 'reading_time',
+    'cover_image', 'created_at', 'updated_at', 'username', 'user_id',
+)
+# Liked-posts listings add when the like happened
+LIKED_POST_FIELDS = {**POST_LIST_FIELDS, 'liked_at': 'likes.created_at'}
+DEFAULT_LIKED_POST_FIELDS = (
+    'title', 'excerpt', 'excerpt_html', 'word_count', 'reading_time',
+    'created_at', 'liked_at', 'username', 'user_id', 'comment_count', 'like_count',
+)
+
+
+def select_fields(available, default, required=('id',)):
+    """SQL select list for the ?fields= sparse fieldset on list endpoints
+
+    available maps each public field name to its SQL expression; default is
+    used when the parameter is absent. Fields in required (the id and
+    whatever the pagination sorts on) are always included. Raises
+    ValueError on unknown fields.
+    """
+    requested = request.args.get('fields')
+    if requested:
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+    else:
+        names = list(default)
+
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+    names = list(dict.fromkeys([*required, *names]))
+    return ', '.join(f'{available[name]} AS {name}' for name in names)
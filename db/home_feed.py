@@ -0,0 +1,152 @@
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Ready-to-render front page rows (feed_items, migration 0008): one per post
+# with its author, counts, tags and a preview of the latest comments, so
+# the home page is one range read on (created_at, post_id). Write paths
+# refresh the rows they touch in the same transaction as their change;
+# rebuild_feed() recomputes the whole table.
+FEED_COMMENT_PREVIEW = int(os.getenv('FEED_COMMENT_PREVIEW', 5))
+
+FEED_COLUMNS = '''
+    post_id, created_at, user_id, username, profile_image, title, content, content_html, content_hash,
+    cover_image, cover_image_variants, like_count, comment_count, tags, comments
+'''
+
+# Everything a feed row holds, computed from the source tables; {where} picks the posts
+FEED_ROWS_SQL = '''
+    SELECT
+        posts.id,
+        posts.created_at,
+        posts.user_id,
+        users.username,
+        users.profile_image,
+        posts.title,
+        posts.content,
+        posts.content_html,
+        posts.content_hash,
+        posts.cover_image,
+        posts.cover_image_variants,
+        posts.like_count,
+        posts.comment_count,
+        COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('id', tags.id, 'name', tags.name) ORDER BY tags.name)
+            FROM post_tags
+            JOIN tags ON tags.id = post_tags.tag_id
+            WHERE post_tags.post_id = posts.id
+        ), '[]'::jsonb),
+        COALESCE((
+            -- The newest comments, stored oldest first like the full list
+            SELECT jsonb_agg(to_jsonb(latest) ORDER BY latest.created_at, latest.id)
+            FROM (
+                SELECT comments.id, comments.content, comments.created_at, commenters.username
+                FROM comments
+                JOIN users AS commenters ON commenters.id = comments.user_id
+                WHERE comments.post_id = posts.id
+                ORDER BY comments.created_at DESC, comments.id DESC
+                LIMIT %(preview)s
+            ) AS latest
+        ), '[]'::jsonb)
+    FROM posts
+    JOIN users ON users.id = posts.user_id
+    {where}
+'''
+
+UPSERT_SQL = f'''
+    INSERT INTO feed_items ({FEED_COLUMNS})
+    {FEED_ROWS_SQL}
+    ON CONFLICT (post_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        profile_image = EXCLUDED.profile_image,
+        title = EXCLUDED.title,
+        content = EXCLUDED.content,
+        content_html = EXCLUDED.content_html,
+        content_hash = EXCLUDED.content_hash,
+        cover_image = EXCLUDED.cover_image,
+        cover_image_variants = EXCLUDED.cover_image_variants,
+        like_count = EXCLUDED.like_count,
+        comment_count = EXCLUDED.comment_count,
+        tags = EXCLUDED.tags,
+        comments = EXCLUDED.comments,
+        refreshed_at = NOW()
+'''
+
+# A page of the front page; {after} is the keyset condition on (created_at, post_id)
+FEED_PAGE_SQL = '''
+    SELECT
+        post_id AS id,
+        title,
+        content,
+        content_html,
+        content_hash,
+        cover_image,
+        cover_image_variants,
+        created_at,
+        username,
+        user_id,
+        profile_image,
+        like_count,
+        comment_count,
+        tags,
+        comments
+    FROM feed_items
+    WHERE {after}
+    ORDER BY created_at DESC, post_id DESC
+    LIMIT %s
+'''
+
+
+def refresh_feed_posts(cur, post_ids):
+    """Recompute the feed rows for these posts; the caller commits"""
+    if not post_ids:
+        return
+    cur.execute(
+        UPSERT_SQL.format(where='WHERE posts.id = ANY(%(post_ids)s)'),
+        {'preview': FEED_COMMENT_PREVIEW, 'post_ids': sorted(set(post_ids))}
+    )
+
+def sync_feed_likes(cur, post_ids):
+    """Copy posts.like_count onto the feed rows for these posts; the caller commits"""
+    if not post_ids:
+        return
+    cur.execute('''
+        UPDATE feed_items SET like_count = posts.like_count, refreshed_at = NOW()
+        FROM posts
+        WHERE posts.id = feed_items.post_id AND posts.id = ANY(%s)
+          AND feed_items.like_count <> posts.like_count
+    ''', (sorted(set(post_ids)),))
+
+def sync_feed_author(cur, user_id):
+    """Copy a user's name and profile image onto their feed rows; the caller commits"""
+    cur.execute('''
+        UPDATE feed_items SET username = users.username, profile_image = users.profile_image, refreshed_at = NOW()
+        FROM users
+        WHERE users.id = feed_items.user_id AND users.id = %s
+    ''', (user_id,))
+
+def sync_feed_cover(cur, image_path):
+    """Copy cover image variants onto the feed rows of posts using image_path; the caller commits"""
+    cur.execute('''
+        UPDATE feed_items SET cover_image_variants = posts.cover_image_variants, refreshed_at = NOW()
+        FROM posts
+        WHERE posts.id = feed_items.post_id AND posts.cover_image = %s
+          AND feed_items.cover_image_variants IS DISTINCT FROM posts.cover_image_variants
+    ''', (image_path,))
+    return cur.rowcount
+
+def rebuild_feed(cur):
+    """Recompute every feed row from the source tables; returns the row count. The caller commits"""
+    cur.execute('DELETE FROM feed_items')
+    cur.execute(UPSERT_SQL.format(where=''), {'preview': FEED_COMMENT_PREVIEW})
+    return cur.rowcount
+
+def decode_feed_rows(rows):
+    """Turn the JSON comment timestamps back into datetimes for the templates"""
+    for row in rows:
+        for comment in row['comments']:
+            if isinstance(comment['created_at'], str):
+                comment['created_at'] = datetime.fromisoformat(comment['created_at'])
+    return rows
@@ -0,0 +1,271 @@
+import atexit
+import os
+import threading
+
+from db.connection import get_pool
+from db.home_feed import sync_feed_likes
+from db.trending import like_mass, like_x, log_add, log_subtract
+from utils.page_cache import invalidate_pages
+
+# Buffer like/unlike clicks in memory and write them in batches. Off by
+# default: with it on, other pages can lag the real state by up to
+# LIKE_BUFFER_INTERVAL seconds, and a crash loses whatever is unflushed.
+LIKE_BUFFER_ENABLED = os.getenv('LIKE_BUFFER', '0') == '1'
+LIKE_BUFFER_INTERVAL = float(os.getenv('LIKE_BUFFER_INTERVAL', 1.0))
+LIKE_BUFFER_MAX = int(os.getenv('LIKE_BUFFER_MAX', 500))
+
+# Deletes the like if there is one, otherwise inserts it, and moves the
+# counter by the net change - all in one round trip. `liked` is true
+# whenever the like exists afterwards, including when a concurrent click
+# inserted it first (ON CONFLICT), which doesn't move the counter twice.
+# The post's feed row and trending score follow in the same statement; an
+# unlike takes back the like's trending weight as of when it was made.
+_ADDED_X = f'(SELECT {like_x("LOCALTIMESTAMP")} FROM added)'
+_REMOVED_X = f'(SELECT {like_x("removed.created_at")} FROM removed)'
+TOGGLE_SQL = f'''
+    WITH post AS (
+        SELECT id FROM posts WHERE id = %(post_id)s
+    ),
+    removed AS (
+        DELETE FROM likes WHERE user_id = %(user_id)s AND post_id = %(post_id)s
+        RETURNING post_id, created_at
+    ),
+    added AS (
+        INSERT INTO likes (user_id, post_id)
+        SELECT %(user_id)s, id FROM post WHERE NOT EXISTS (SELECT 1 FROM removed)
+        ON CONFLICT DO NOTHING
+        RETURNING post_id
+    ),
+    counted AS (
+        UPDATE posts
+        SET like_count = GREATEST(like_count + (SELECT COUNT(*) FROM added) - (SELECT COUNT(*) FROM removed), 0),
+            trending_score = {log_subtract(log_add('trending_score', _ADDED_X), _REMOVED_X)}
+        WHERE id = %(post_id)s
+        RETURNING id, like_count
+    ),
+    feed AS (
+        UPDATE feed_items SET like_count = counted.like_count
+        FROM counted
+        WHERE feed_items.post_id = counted.id
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM post) AS found,
+        NOT EXISTS (SELECT 1 FROM removed) AS liked,
+        (SELECT like_count FROM counted) AS like_count
+'''
+
+
+def toggle_like(cur, user_id, post_id):
+    """Flip a user's like on a post
+
+    Returns (liked, like_count), or None if the post doesn't exist. The
+    caller commits.
+    """
+    cur.execute(TOGGLE_SQL, {'user_id': user_id, 'post_id': post_id})
+    row = cur.fetchone()
+    if not row['found']:
+        return None
+    return row['liked'], row['like_count']
+
+
+class LikeBuffer:
+    """Coalesces like/unlike clicks per (user, post) and flushes them in batches
+
+    Only the last state per pair is written, so a user hammering the button
+    costs one indexed read per click and at most one write, and a popular
+    post gets one counter UPDATE per flush rather than one per click.
+    """
+
+    def __init__(self, interval=LIKE_BUFFER_INTERVAL, max_pending=LIKE_BUFFER_MAX):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # (user_id, post_id) -> [liked_in_db, liked_now]
+        self._deltas = {}   # post_id -> net like_count change not yet written
+        # The batch a flush is writing, still counted until it commits
+        self._inflight = {}
+        self._inflight_deltas = {}
+        # Bumped whenever a flush commits, so a toggle can tell its read is stale
+        self._generation = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def toggle(self, cur, user_id, post_id):
+        """Buffer a toggle, returning (liked, like_count) or None if the post doesn't exist"""
+        while True:
+            with self._lock:
+                generation = self._generation
+            # One read, no writes: the stored count plus the stored like state,
+            # which only matters on the first click since the last flush
+            cur.execute('''
+                SELECT like_count,
+                       EXISTS (SELECT 1 FROM likes WHERE user_id = %s AND post_id = %s) AS liked
+                FROM posts WHERE id = %s
+            ''', (user_id, post_id, post_id))
+            row = cur.fetchone()
+            if row is None:
+                return None
+
+            with self._lock:
+                if self._generation != generation:
+                    # A flush committed since the read, which may or may not include it
+                    continue
+                entry = self._pending.get((user_id, post_id))
+                if entry is None:
+                    inflight = self._inflight.get((user_id, post_id))
+                    liked = inflight[1] if inflight is not None else row['liked']
+                    entry = self._pending[(user_id, post_id)] = [liked, liked]
+                entry[1] = not entry[1]
+                self._deltas[post_id] = self._deltas.get(post_id, 0) + (1 if entry[1] else -1)
+                delta = self._deltas[post_id] + self._inflight_deltas.get(post_id, 0)
+                liked = entry[1]
+                full = len(self._pending) >= self.max_pending
+            break
+
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+        return liked, max(row['like_count'] + delta, 0)
+
+    def overlay(self, user_id, posts):
+        """Apply unflushed clicks to posts carrying like_count / liked_by_user"""
+        with self._lock:
+            if not self._pending and not self._inflight:
+                return
+            for post in posts:
+                delta = self._deltas.get(post['id'], 0) + self._inflight_deltas.get(post['id'], 0)
+                post['like_count'] = max(post['like_count'] + delta, 0)
+                entry = self._pending.get((user_id, post['id'])) or self._inflight.get((user_id, post['id']))
+                if entry is not None:
+                    post['liked_by_user'] = entry[1]
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of pairs written"""
+        with self._flush_lock:
+            with self._lock:
+                self._inflight, self._pending = self._pending, {}
+                self._inflight_deltas, self._deltas = self._deltas, {}
+                batch = self._inflight
+            # Pairs that were toggled back to where they started need no write
+            adds = [key for key, (was, now) in batch.items() if now and not was]
+            removes = [key for key, (was, now) in batch.items() if was and not now]
+            if not adds and not removes:
+                with self._lock:
+                    self._settle(written=False)
+                return 0
+
+            conn = cur = None
+            try:
+                conn = get_pool().getconn()
+                cur = conn.cursor()
+                added = {}    # post_id -> likes inserted
+                removed = {}  # post_id -> created_at of each like deleted
+                if adds:
+                    # Posts deleted since the click are skipped rather than failing the batch
+                    cur.execute('''
+                        INSERT INTO likes (user_id, post_id)
+                        SELECT pairs.user_id, pairs.post_id
+                        FROM unnest(%s::int[], %s::int[]) AS pairs(user_id, post_id)
+                        JOIN posts ON posts.id = pairs.post_id
+                        ON CONFLICT DO NOTHING
+                        RETURNING post_id
+                    ''', ([u for u, _ in adds], [p for _, p in adds]))
+                    for row in cur.fetchall():
+                        added[row['post_id']] = added.get(row['post_id'], 0) + 1
+                if removes:
+                    cur.execute('''
+                        DELETE FROM likes
+                        USING unnest(%s::int[], %s::int[]) AS pairs(user_id, post_id)
+                        WHERE likes.user_id = pairs.user_id AND likes.post_id = pairs.post_id
+                        RETURNING likes.post_id, likes.created_at
+                    ''', ([u for u, _ in removes], [p for _, p in removes]))
+                    for row in cur.fetchall():
+                        removed.setdefault(row['post_id'], []).append(row['created_at'])
+
+                post_ids = sorted(set(added) | set(removed))
+                if post_ids:
+                    # One counter UPDATE for all touched posts, in id order to avoid deadlocks.
+                    # Trending gains the new likes now and loses the removed ones at their own weight.
+                    trending = log_subtract(log_add('posts.trending_score', like_x('LOCALTIMESTAMP', 'NULLIF(d.added, 0)')),
+                                            'd.removed_x')
+                    cur.execute(f'''
+                        UPDATE posts SET like_count = GREATEST(posts.like_count + d.added - d.removed, 0),
+                                         trending_score = {trending}
+                        FROM unnest(%s::int[], %s::int[], %s::int[], %s::float8[]) AS d(post_id, added, removed, removed_x)
+                        WHERE posts.id = d.post_id
+                    ''', (post_ids, [added.get(p, 0) for p in post_ids], [len(removed.get(p, ())) for p in post_ids],
+                          [like_mass(removed.get(p)) for p in post_ids]))
+                    sync_feed_likes(cur, post_ids)
+                # Toggles see either the batch in flight or its committed rows, never both
+                with self._lock:
+                    conn.commit()
+                    self._settle()
+            except Exception as e:
+                with self._lock:
+                    self._requeue()
+                print(f"Like buffer flush failed, keeping {len(adds) + len(removes)} change(s) for the next one: {e}")
+                if conn is not None:
+                    conn.rollback()
+                return 0
+            finally:
+                if cur is not None:
+                    cur.close()
+                if conn is not None:
+                    conn.close()
+            invalidate_pages('likes')
+            return len(adds) + len(removes)
+
+    def _settle(self, written=True):
+        """Forget the batch in flight once it's in the database; call with _lock held"""
+        self._inflight = {}
+        self._inflight_deltas = {}
+        if written:
+            self._generation += 1
+
+    def _requeue(self):
+        """Put an unwritten batch back in front of the clicks that came after it; call with _lock held"""
+        for key, (was, now) in self._inflight.items():
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [was, now]
+            else:
+                entry[0] = was
+        for post_id, delta in self._inflight_deltas.items():
+            self._deltas[post_id] = self._deltas.get(post_id, 0) + delta
+        self._inflight = {}
+        self._inflight_deltas = {}
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # The batch is already requeued; keep the thread for the next try
+                print(f"Like buffer flush failed: {e}")
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_like_buffer():
+    """The shared LikeBuffer, or None when LIKE_BUFFER is off"""
+    global _buffer
+    if not LIKE_BUFFER_ENABLED:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = LikeBuffer()
+                atexit.register(_buffer.flush)
+    return _buffer
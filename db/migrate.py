@@ -0,0 +1,113 @@
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+_FILENAME_RE = re.compile(r'^(\d+)_(\w+)\.(up|down)\.sql$')
+# Arbitrary key for pg_advisory_xact_lock so two deploys can't migrate at once
+_LOCK_KEY = 7412650
+
+
+def discover():
+    """All migrations on disk as [(version, name, up_path, down_path)] in order"""
+    found = {}
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = _FILENAME_RE.match(filename)
+        if not match:
+            continue
+        version, name, direction = int(match.group(1)), match.group(2), match.group(3)
+        entry = found.setdefault(version, {'name': name})
+        entry[direction] = os.path.join(MIGRATIONS_DIR, filename)
+
+    migrations = []
+    for version in sorted(found):
+        entry = found[version]
+        if 'up' not in entry:
+            raise RuntimeError(f"Migration {version:04d} has no .up.sql file")
+        migrations.append((version, entry['name'], entry['up'], entry.get('down')))
+    return migrations
+
+def _ensure_table(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _applied(cur):
+    cur.execute('SELECT version, applied_at FROM schema_migrations ORDER BY version')
+    return {row['version']: row['applied_at'] for row in cur.fetchall()}
+
+def _run_file(cur, path):
+    with open(path, encoding='utf-8') as f:
+        cur.execute(f.read())
+
+def status(conn):
+    """[(version, name, applied_at or None)] for every migration on disk"""
+    cur = conn.cursor()
+    _ensure_table(cur)
+    applied = _applied(cur)
+    conn.commit()
+    cur.close()
+    return [(version, name, applied.get(version)) for version, name, _, _ in discover()]
+
+def upgrade(conn, target=None):
+    """Apply pending migrations up to target (default: latest)
+
+    Each migration runs in its own transaction. Returns the versions applied.
+    """
+    done = []
+    for version, name, up_path, _ in discover():
+        if target is not None and version > target:
+            break
+
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (_LOCK_KEY,))
+            _ensure_table(cur)
+            if version in _applied(cur):
+                conn.rollback()
+                continue
+
+            _run_file(cur, up_path)
+            cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (version, name))
+            conn.commit()
+            done.append(version)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    return done
+
+def downgrade(conn, steps=1):
+    """Revert the most recently applied migrations. Returns the versions reverted."""
+    migrations = {version: (name, down_path) for version, name, _, down_path in discover()}
+    done = []
+
+    for _ in range(steps):
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (_LOCK_KEY,))
+            _ensure_table(cur)
+            applied = _applied(cur)
+            if not applied:
+                conn.rollback()
+                break
+
+            version = max(applied)
+            name, down_path = migrations.get(version, (None, None))
+            if not down_path:
+                raise RuntimeError(f"Migration {version:04d} can't be reverted (no .down.sql file)")
+
+            _run_file(cur, down_path)
+            cur.execute('DELETE FROM schema_migrations WHERE version = %s', (version,))
+            conn.commit()
+            done.append(version)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    return done
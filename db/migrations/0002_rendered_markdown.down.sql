@@ -0,0 +1,2 @@
+ALTER TABLE posts DROP COLUMN IF EXISTS content_hash;
+ALTER TABLE posts DROP COLUMN IF EXISTS content_html;
@@ -0,0 +1,4 @@
+-- Pre-rendered post HTML (utils/markdown_renderer.py). Fill existing rows
+-- with `flask backfill-markdown`.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS content_html TEXT;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS idx_posts_search_vector;
+ALTER TABLE posts DROP COLUMN IF EXISTS search_vector;
@@ -0,0 +1,3 @@
+DROP TABLE IF EXISTS images;
+ALTER TABLE users DROP COLUMN IF EXISTS profile_image_variants;
+ALTER TABLE posts DROP COLUMN IF EXISTS cover_image_variants;
@@ -0,0 +1,14 @@
+-- Responsive variants and content-addressed uploads (utils/image_handler.py).
+-- Move existing files with `flask rehash-images`, then build variants with
+-- `flask image-variants`.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS cover_image_variants JSONB;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_image_variants JSONB;
+
+CREATE TABLE IF NOT EXISTS images (
+    path VARCHAR(255) PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL,
+    sha256 CHAR(64),
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    variants JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,4 @@
+ALTER TABLE users DROP COLUMN IF EXISTS post_count;
+ALTER TABLE tags DROP COLUMN IF EXISTS post_count;
+ALTER TABLE posts DROP COLUMN IF EXISTS comment_count;
+ALTER TABLE posts DROP COLUMN IF EXISTS like_count;
@@ -0,0 +1,6 @@
+-- Denormalized counters (db/counters.py). Populate existing rows with
+-- `flask reconcile-counters`.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tags ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,12 @@
+DROP INDEX IF EXISTS idx_users_profile_image;
+DROP INDEX IF EXISTS idx_posts_cover_image;
+DROP INDEX IF EXISTS idx_tags_post_count;
+DROP INDEX IF EXISTS idx_post_tags_tag;
+DROP INDEX IF EXISTS idx_likes_user_created;
+DROP INDEX IF EXISTS idx_likes_post;
+DROP INDEX IF EXISTS idx_comments_post_created_id;
+DROP INDEX IF EXISTS idx_users_created_id;
+DROP INDEX IF EXISTS idx_posts_user_created_id;
+DROP INDEX IF EXISTS idx_posts_created_id;
+-- The unique indexes are left alone: on most databases they back the
+-- constraints created in 0001.
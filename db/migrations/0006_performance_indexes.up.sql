@@ -0,0 +1,30 @@
+-- Indexes behind the hot queries. `flask db check-queries` verifies that
+-- every query in db/explain.py can use one of these instead of a seq scan.
+
+-- Unique lookups (no-ops where 0001 already created the constraint)
+CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON users (username);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_key ON users (email);
+CREATE UNIQUE INDEX IF NOT EXISTS tags_name_key ON tags (name);
+CREATE UNIQUE INDEX IF NOT EXISTS likes_pkey ON likes (user_id, post_id);
+
+-- Feed, profile and /api/users keyset pagination on (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_posts_created_id ON posts (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_user_created_id ON posts (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_users_created_id ON users (created_at DESC, id DESC);
+
+-- Comments for a post, oldest first
+CREATE INDEX IF NOT EXISTS idx_comments_post_created_id ON comments (post_id, created_at, id);
+
+-- Likes: who liked a post, and a user's liked posts newest first
+CREATE INDEX IF NOT EXISTS idx_likes_post ON likes (post_id);
+CREATE INDEX IF NOT EXISTS idx_likes_user_created ON likes (user_id, created_at DESC, post_id DESC);
+
+-- Posts for a tag (the primary key only covers post_id-first lookups)
+CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags (tag_id, post_id);
+
+-- Tag listing ordered by popularity
+CREATE INDEX IF NOT EXISTS idx_tags_post_count ON tags (post_count DESC, name);
+
+-- Image workers match rows by path when recording variants
+CREATE INDEX IF NOT EXISTS idx_posts_cover_image ON posts (cover_image) WHERE cover_image IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_users_profile_image ON users (profile_image) WHERE profile_image IS NOT NULL;
@@ -0,0 +1,4 @@
+ALTER TABLE posts DROP COLUMN IF EXISTS reading_time;
+ALTER TABLE posts DROP COLUMN IF EXISTS word_count;
+ALTER TABLE posts DROP COLUMN IF EXISTS excerpt_html;
+ALTER TABLE posts DROP COLUMN IF EXISTS excerpt;
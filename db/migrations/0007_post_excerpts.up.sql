@@ -0,0 +1,7 @@
+-- Preview fields for list pages (utils/markdown_renderer.summarize), so
+-- listings don't have to select the full body. Fill existing rows with
+-- `flask backfill-markdown`.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS excerpt TEXT;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS excerpt_html TEXT;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS word_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS reading_time INTEGER NOT NULL DEFAULT 1;
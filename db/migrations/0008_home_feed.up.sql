@@ -0,0 +1,67 @@
+-- Precomputed front page rows (db/home_feed.py), kept current by the write
+-- paths. Existing posts are copied in below with the default five comment
+-- preview; after changing FEED_COMMENT_PREVIEW run `flask rebuild-feed`.
+CREATE TABLE IF NOT EXISTS feed_items (
+    post_id INTEGER PRIMARY KEY REFERENCES posts(id) ON DELETE CASCADE,
+    created_at TIMESTAMP,
+    user_id INTEGER NOT NULL,
+    username VARCHAR(50) NOT NULL,
+    profile_image VARCHAR(255),
+    title VARCHAR(200) NOT NULL,
+    content TEXT,
+    content_html TEXT,
+    content_hash CHAR(64),
+    cover_image VARCHAR(255),
+    cover_image_variants JSONB,
+    like_count INTEGER NOT NULL DEFAULT 0,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    tags JSONB NOT NULL DEFAULT '[]',
+    comments JSONB NOT NULL DEFAULT '[]',
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- The home page reads a keyset range of this and nothing else
+CREATE INDEX IF NOT EXISTS idx_feed_items_created_post ON feed_items (created_at DESC, post_id DESC);
+
+-- Author renames and profile image changes fan out to their rows
+CREATE INDEX IF NOT EXISTS idx_feed_items_user ON feed_items (user_id);
+
+-- The same rows FEED_ROWS_SQL computes, so the front page isn't empty until a rebuild
+INSERT INTO feed_items (
+    post_id, created_at, user_id, username, profile_image, title, content, content_html, content_hash,
+    cover_image, cover_image_variants, like_count, comment_count, tags, comments
+)
+SELECT
+    posts.id,
+    posts.created_at,
+    posts.user_id,
+    users.username,
+    users.profile_image,
+    posts.title,
+    posts.content,
+    posts.content_html,
+    posts.content_hash,
+    posts.cover_image,
+    posts.cover_image_variants,
+    posts.like_count,
+    posts.comment_count,
+    COALESCE((
+        SELECT jsonb_agg(jsonb_build_object('id', tags.id, 'name', tags.name) ORDER BY tags.name)
+        FROM post_tags
+        JOIN tags ON tags.id = post_tags.tag_id
+        WHERE post_tags.post_id = posts.id
+    ), '[]'::jsonb),
+    COALESCE((
+        SELECT jsonb_agg(to_jsonb(latest) ORDER BY latest.created_at, latest.id)
+        FROM (
+            SELECT comments.id, comments.content, comments.created_at, commenters.username
+            FROM comments
+            JOIN users AS commenters ON commenters.id = comments.user_id
+            WHERE comments.post_id = posts.id
+            ORDER BY comments.created_at DESC, comments.id DESC
+            LIMIT 5
+        ) AS latest
+    ), '[]'::jsonb)
+FROM posts
+JOIN users ON users.id = posts.user_id
+ON CONFLICT (post_id) DO NOTHING;
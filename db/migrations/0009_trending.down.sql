@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS idx_posts_trending;
+ALTER TABLE posts DROP COLUMN IF EXISTS trending_score;
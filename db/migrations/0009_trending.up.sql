@@ -0,0 +1,7 @@
+-- Time-decayed popularity (db/trending.py), bumped by each like and
+-- comment. NULL means not trending. Populate with `flask rebuild-trending`.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS trending_score DOUBLE PRECISION;
+
+-- Top-N and keyset pages of the ranking, and pruning from the low end
+CREATE INDEX IF NOT EXISTS idx_posts_trending ON posts (trending_score DESC, id DESC)
+    WHERE trending_score IS NOT NULL;
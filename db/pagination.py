@@ -0,0 +1,71 @@
+import base64
+import json
+import os
+from datetime import datetime
+from flask import request
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 20))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+
+
+def encode_cursor(sort_key, row_id):
+    """Turn a (sort_key, id) position into an opaque cursor string
+
+    sort_key is normally created_at, but numeric keys (e.g. a search rank)
+    work too.
+    """
+    if isinstance(sort_key, datetime):
+        key = {'t': sort_key.isoformat()}
+    else:
+        key = {'k': sort_key}
+    payload = json.dumps({**key, 'id': row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into (sort_key, id), raising ValueError if it's bad"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if 't' in payload:
+            sort_key = datetime.fromisoformat(payload['t'])
+        else:
+            sort_key = float(payload['k'])
+        return sort_key, int(payload['id'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def get_page_args():
+    """Read ?cursor= and ?limit= from the request
+
+    Returns (position, limit) where position is None for the first page.
+    Raises ValueError on a malformed cursor or limit.
+    """
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', PAGE_SIZE)
+
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    position = decode_cursor(cursor) if cursor else None
+    return position, limit
+
+def keyset_clause(position, created_col, id_col, descending=True):
+    """SQL condition and params selecting rows after `position`
+
+    Returns ('TRUE', ()) for the first page so callers can always AND it in.
+    """
+    if position is None:
+        return 'TRUE', ()
+    op = '<' if descending else '>'
+    return f'({created_col}, {id_col}) {op} (%s, %s)', position
+
+def paginate(rows, limit, created_key='created_at', id_key='id'):
+    """Split a LIMIT limit + 1 result into (page, next_cursor)"""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(last[created_key], last[id_key])
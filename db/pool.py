@@ -0,0 +1,225 @@
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection that goes back to its pool when closed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._created_at = time.monotonic()
+        self._last_used = self._created_at
+        self._checked_out = False
+        # Bumped on every checkout, so a holder can tell whether the
+        # connection is still theirs or has since gone to someone else
+        self._lease = 0
+
+    def close(self):
+        # Handlers call conn.close() when they are done, so hand the
+        # connection back to the pool instead of tearing down the socket
+        if self._pool is not None and self._checked_out:
+            self._pool.putconn(self)
+        elif self._pool is None:
+            super().close()
+
+
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections
+
+    Connections are health checked when checked out, recycled after
+    max_lifetime seconds and evicted after sitting idle for max_idle seconds.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, max_lifetime=3600,
+                 max_idle=300, timeout=30, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (min_size, max_size))
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {'created': 0, 'recycled': 0, 'waiting': 0, 'checkouts': 0, 'timeouts': 0}
+
+        with self._cond:
+            for _ in range(min_size):
+                self._idle.append(self._connect())
+                self._size += 1
+                self._stats['created'] += 1
+
+    def _connect(self):
+        """Open a new connection; the caller accounts for it in _size"""
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection, **self.connect_kwargs)
+        conn._pool = self
+        return conn
+
+    def _discard(self, conn):
+        """Really close a connection and forget about it (caller must hold the lock)"""
+        self._size -= 1
+        self._stats['recycled'] += 1
+        conn._checked_out = False
+        try:
+            extensions.connection.close(conn)
+        except Exception:
+            pass
+
+    def _is_expired(self, conn, now):
+        if conn.closed:
+            return True
+        if self.max_lifetime and now - conn._created_at > self.max_lifetime:
+            return True
+        if self.max_idle and now - conn._last_used > self.max_idle and self._size > self.min_size:
+            return True
+        return False
+
+    def _is_healthy(self, conn):
+        """Make sure a pooled connection still talks to the server"""
+        try:
+            cur = extensions.cursor(conn)
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Check a connection out of the pool, waiting up to timeout seconds
+
+        Connecting and health checks happen outside the lock, so one slow
+        round trip doesn't hold up every other checkout and return.
+        """
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError('connection pool is closed')
+
+                    now = time.monotonic()
+
+                    # Take an idle connection, dropping any that are past their limits
+                    while self._idle:
+                        conn = self._idle.pop()
+                        if not self._is_expired(conn, now):
+                            break
+                        self._discard(conn)
+                        conn = None
+                    if conn is not None:
+                        break
+
+                    # Reserve room for a new connection
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+
+                    # Otherwise wait for someone to give one back
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolError('timed out waiting for a database connection')
+
+                    self._stats['waiting'] += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._stats['waiting'] -= 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats['created'] += 1
+                    return self._checkout(conn)
+
+            if self._is_healthy(conn):
+                with self._cond:
+                    return self._checkout(conn)
+
+            # Dead idle connection: free its slot and try again
+            with self._cond:
+                self._discard(conn)
+                self._cond.notify()
+
+    def _checkout(self, conn):
+        conn._checked_out = True
+        conn._lease += 1
+        self._stats['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection to the pool"""
+        with self._cond:
+            if not conn._checked_out:
+                return
+            conn._checked_out = False
+
+            # Never hand out a connection with an open transaction
+            if not conn.closed and conn.status != extensions.STATUS_READY:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+
+            now = time.monotonic()
+            conn._last_used = now
+
+            if (self._closed or conn.closed
+                    or (self.max_lifetime and now - conn._created_at > self.max_lifetime)):
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+
+            self._cond.notify()
+
+    def evict_idle(self):
+        """Close idle connections that are past their lifetime or idle limit"""
+        with self._cond:
+            now = time.monotonic()
+            keep = []
+            for conn in self._idle:
+                if self._is_expired(conn, now):
+                    self._discard(conn)
+                else:
+                    keep.append(conn)
+            self._idle = keep
+
+    def closeall(self):
+        """Close every idle connection and refuse new checkouts"""
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        """Snapshot of pool usage for monitoring"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self._stats,
+            }
@@ -0,0 +1,69 @@
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2.extras import RealDictCursor
+
+_local = threading.local()
+
+
+class CountingCursor(RealDictCursor):
+    """RealDictCursor that records each statement while a counter is active
+
+    When a query listener is set on this thread (see set_query_listener),
+    each statement is also timed and reported to it.
+    """
+
+    def _run(self, run, query):
+        counters = getattr(_local, 'counters', None)
+        if counters:
+            for counter in counters:
+                counter.append(query)
+        listener = getattr(_local, 'listener', None)
+        if listener is None:
+            return run()
+        start = time.perf_counter()
+        try:
+            return run()
+        finally:
+            listener.add_query(query, time.perf_counter() - start)
+
+    def execute(self, query, vars=None):
+        return self._run(lambda: super(CountingCursor, self).execute(query, vars), query)
+
+    def executemany(self, query, vars_list):
+        return self._run(lambda: super(CountingCursor, self).executemany(query, vars_list), query)
+
+
+def set_query_listener(listener):
+    """Report every statement on this thread to listener.add_query(sql, seconds); None to stop"""
+    _local.listener = listener
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements run on this thread inside the block
+
+        with count_queries() as queries:
+            client.get('/')
+        print(len(queries))
+    """
+    queries = []
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    _local.counters.append(queries)
+    try:
+        yield queries
+    finally:
+        _local.counters.remove(queries)
+
+
+@contextmanager
+def assert_num_queries(expected):
+    """Fail if the block runs more than `expected` statements"""
+    with count_queries() as queries:
+        yield queries
+    if len(queries) > expected:
+        listing = '\n'.join(' '.join(q.split())[:120] for q in queries)
+        raise AssertionError(
+            f'Expected at most {expected} queries, got {len(queries)}:\n{listing}'
+        )
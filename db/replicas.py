@@ -0,0 +1,142 @@
+import itertools
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+from db.pool import ConnectionPool
+from db.query_counter import CountingCursor
+
+load_dotenv()
+
+# Comma-separated standby URLs for read-only queries. Empty means every
+# query goes to DATABASE_URL, exactly as before.
+REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# A replica further behind the primary than this many seconds is taken out
+# of rotation until it catches up
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 5))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', 2))
+
+# Lag is zero once the replica has replayed everything the primary had
+# written at check time; otherwise it's the age of the last replayed commit.
+# A server that isn't in recovery (e.g. the primary itself, in development)
+# counts as caught up.
+LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_wal_lsn_diff(%s::pg_lsn, pg_last_wal_replay_lsn()) <= 0 THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+    END AS lag
+'''
+
+
+class Replica:
+    """One standby: its own connection pool plus the last health check result"""
+
+    def __init__(self, name, url, pool_kwargs):
+        self.name = name
+        self.url = url
+        # min_size=0 so a replica that's down at startup doesn't stop the app
+        self.pool = ConnectionPool(url, min_size=0, connect_timeout=REPLICA_CONNECT_TIMEOUT,
+                                   cursor_factory=CountingCursor, **pool_kwargs)
+        self.healthy = False
+        self.lag = None
+        self.error = 'not checked yet'
+        self.checked_at = None
+
+    def mark_down(self, error):
+        """Take the replica out of rotation until the next check says otherwise"""
+        if self.healthy:
+            print(f"Replica {self.name} taken out of rotation: {error}")
+        self.healthy = False
+        self.error = str(error)
+
+    def getconn(self):
+        """A connection from this replica's pool, or None if it can't give one"""
+        try:
+            return self.pool.getconn()
+        except Exception as e:
+            self.mark_down(e)
+            return None
+
+
+class ReplicaSet:
+    """Round-robins reads over the replicas that passed their last health check"""
+
+    def __init__(self, urls, primary_pool, **pool_kwargs):
+        self.primary_pool = primary_pool
+        self.replicas = [Replica(f'replica{i + 1}', url, pool_kwargs) for i, url in enumerate(urls)]
+        self._turn = itertools.count()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def check(self):
+        """Measure every replica's lag against the primary's current WAL position"""
+        conn = self.primary_pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT pg_current_wal_lsn()::text AS lsn')
+            primary_lsn = cur.fetchone()['lsn']
+            cur.close()
+        finally:
+            conn.close()
+
+        for replica in self.replicas:
+            conn = replica.getconn()
+            if conn is None:
+                replica.checked_at = time.time()
+                continue
+            try:
+                cur = conn.cursor()
+                cur.execute(LAG_SQL, (primary_lsn,))
+                lag = float(cur.fetchone()['lag'])
+                cur.close()
+            except Exception as e:
+                replica.mark_down(e)
+                continue
+            finally:
+                conn.close()
+                replica.checked_at = time.time()
+
+            replica.lag = lag
+            if lag > REPLICA_MAX_LAG:
+                replica.mark_down(f'{lag:.1f}s behind the primary')
+            else:
+                if not replica.healthy:
+                    print(f"✓ Replica {replica.name} in rotation ({lag:.1f}s behind)")
+                replica.healthy = True
+                replica.error = None
+
+    def start(self):
+        """Check once now, then keep checking on a daemon thread"""
+        try:
+            self.check()
+        except Exception as e:
+            print(f"Replica health check failed: {e}")
+        self._thread = threading.Thread(target=self._run, name='replica-health', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(REPLICA_CHECK_INTERVAL):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Replica health check failed: {e}")
+
+    def pick(self):
+        """The next healthy replica, or None when there isn't one"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def stats(self):
+        return [{
+            'name': replica.name,
+            'healthy': replica.healthy,
+            'lag': replica.lag,
+            'error': replica.error,
+            'checked_at': replica.checked_at,
+            'pool': replica.pool.stats(),
+        } for replica in self.replicas]
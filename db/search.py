@@ -0,0 +1,276 @@
+import bisect
+import os
+import re
+import threading
+from markupsafe import Markup, escape
+
+from db.pagination import paginate
+
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", 1000))
+SNIPPET_WORDS = 30
+
+# Markers used to highlight matches before the snippet is HTML-escaped
+_HL_START = '\x02'
+_HL_STOP = '\x03'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Lowercase word tokens of a piece of text"""
+    return _TOKEN_RE.findall((text or '').lower())
+
+def _finish_snippet(text):
+    """Escape a snippet and turn the highlight markers into <mark> tags"""
+    html = str(escape(text))
+    return Markup(html.replace(_HL_START, '<mark>').replace(_HL_STOP, '</mark>'))
+
+
+class PostgresSearchBackend:
+    """Full-text search over the posts.search_vector tsvector column
+
+    search_vector is a generated column (migration 0003) so PostgreSQL keeps
+    it current on every insert/update; there's nothing to do at write time.
+    """
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def _tsquery(self, terms):
+        # Every term has to match, each one as a word prefix
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def match(self, cur, terms, limit, position):
+        """Return up to limit + 1 [{'id', 'rank'}] ordered by rank"""
+        after = 'TRUE'
+        params = [self._tsquery(terms), SEARCH_MAX_CANDIDATES]
+        if position is not None:
+            after = '(rank, id) < (%s, %s)'
+            params.extend(position)
+        params.append(limit + 1)
+
+        # Rank only the most recent SEARCH_MAX_CANDIDATES matches so broad
+        # queries stay cheap however big the table gets
+        cur.execute(f'''
+            WITH q AS (SELECT to_tsquery('english', %s) AS query),
+            candidates AS (
+                SELECT posts.id, ts_rank_cd(posts.search_vector, q.query)::float8 AS rank
+                FROM posts, q
+                WHERE posts.search_vector @@ q.query
+                ORDER BY posts.created_at DESC
+                LIMIT %s
+            )
+            SELECT id, rank FROM candidates
+            WHERE {after}
+            ORDER BY rank DESC, id DESC
+            LIMIT %s
+        ''', params)
+        return cur.fetchall()
+
+    def add_snippets(self, cur, terms, posts):
+        if not posts:
+            return
+        cur.execute(f'''
+            SELECT posts.id,
+                   ts_headline('english', coalesce(posts.content, ''), to_tsquery('english', %s),
+                               'StartSel={_HL_START}, StopSel={_HL_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=10') AS snippet
+            FROM posts
+            WHERE posts.id = ANY(%s)
+        ''', (self._tsquery(terms), [post['id'] for post in posts]))
+        snippets = {row['id']: row['snippet'] for row in cur.fetchall()}
+        for post in posts:
+            post['snippet'] = _finish_snippet(snippets.get(post['id'], ''))
+
+
+class InMemorySearchBackend:
+    """In-process inverted index, for tests and small deployments
+
+    Nothing in the database keeps this index up to date: get_search_backend()
+    fills it with rebuild() on first use, and the write paths feed it
+    index_post() / remove_post() from then on. Each process has its own copy.
+    """
+
+    TITLE_WEIGHT = 2.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}   # term -> {post_id: weight}
+        self._terms = []      # sorted vocabulary for prefix lookups
+        self._docs = {}       # post_id -> (title, content, terms)
+
+    def rebuild(self, cur):
+        """Index every post currently in the database"""
+        cur.execute('SELECT id, title, content FROM posts')
+        rows = cur.fetchall()
+        with self._lock:
+            self._postings, self._terms, self._docs = {}, [], {}
+        for row in rows:
+            self.index_post(row)
+
+    def index_post(self, post):
+        post_id = post['id']
+        weights = {}
+        for term in tokenize(post.get('title')):
+            weights[term] = weights.get(term, 0) + self.TITLE_WEIGHT
+        for term in tokenize(post.get('content')):
+            weights[term] = weights.get(term, 0) + 1.0
+
+        with self._lock:
+            self._remove_locked(post_id)
+            for term, weight in weights.items():
+                if term not in self._postings:
+                    self._postings[term] = {}
+                    bisect.insort(self._terms, term)
+                self._postings[term][post_id] = weight
+            self._docs[post_id] = (post.get('title') or '', post.get('content') or '', set(weights))
+
+    def remove_post(self, post_id):
+        with self._lock:
+            self._remove_locked(post_id)
+
+    def _remove_locked(self, post_id):
+        doc = self._docs.pop(post_id, None)
+        if doc is None:
+            return
+        for term in doc[2]:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(post_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _expand(self, prefix):
+        """All indexed terms starting with prefix"""
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + '\uffff')
+        return self._terms[start:end]
+
+    def match(self, cur, terms, limit, position):
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for word in self._expand(term):
+                    for post_id, weight in self._postings[word].items():
+                        term_scores[post_id] = term_scores.get(post_id, 0) + weight
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: scores[pid] + s for pid, s in term_scores.items() if pid in scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(((rank, post_id) for post_id, rank in scores.items()), reverse=True)
+        if position is not None:
+            ranked = [r for r in ranked if r < tuple(position)]
+        return [{'id': post_id, 'rank': rank} for rank, post_id in ranked[:limit + 1]]
+
+    def add_snippets(self, cur, terms, posts):
+        # Snippets come from the indexed copy; search results don't carry the body
+        with self._lock:
+            contents = {post['id']: self._docs.get(post['id'], ('', ''))[1] for post in posts}
+        for post in posts:
+            post['snippet'] = _finish_snippet(self._snippet(contents[post['id']], terms))
+
+    def _snippet(self, content, terms):
+        words = content.split()
+        hit = None
+        for i, word in enumerate(words):
+            lowered = word.lower()
+            if any(tok.startswith(term) for tok in tokenize(lowered) for term in terms):
+                if hit is None:
+                    hit = i
+                words[i] = f'{_HL_START}{word}{_HL_STOP}'
+        start = max(0, (hit or 0) - SNIPPET_WORDS // 3)
+        return ' '.join(words[start:start + SNIPPET_WORDS])
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def _build_memory_backend():
+    """An InMemorySearchBackend holding every post, from a connection of its own
+
+    Runs under _backend_lock, so a post committed after the rebuild's read
+    is indexed by its write path once the backend is published.
+    """
+    # Imported here so the search helpers stay usable without a database
+    from db.connection import get_pool
+    backend = InMemorySearchBackend()
+    conn = get_pool().getconn()
+    cur = conn.cursor()
+    try:
+        backend.rebuild(cur)
+    finally:
+        cur.close()
+        conn.rollback()
+        conn.close()
+    return backend
+
+def get_search_backend():
+    """Backend chosen by SEARCH_BACKEND ('postgres' by default, or 'memory')"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if os.getenv('SEARCH_BACKEND', 'postgres') == 'memory':
+                    _backend = _build_memory_backend()
+                else:
+                    _backend = PostgresSearchBackend()
+    return _backend
+
+def set_search_backend(backend):
+    """Swap the active backend (e.g. an InMemorySearchBackend in tests)"""
+    global _backend
+    _backend = backend
+
+def search_posts(cur, query, limit, position=None):
+    """Search posts, returning (posts, next_cursor)
+
+    Posts are ordered by relevance and each one carries 'rank' and an
+    HTML-safe 'snippet' with the matching words wrapped in <mark>.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return [], None
+
+    backend = get_search_backend()
+    matches = backend.match(cur, terms, limit, position)
+    if not matches:
+        return [], None
+
+    matches, next_cursor = paginate(matches, limit, created_key='rank')
+    ranks = {m['id']: m['rank'] for m in matches}
+
+    cur.execute('''
+        SELECT
+            posts.id,
+            posts.title,
+            posts.excerpt,
+            posts.word_count,
+            posts.reading_time,
+            posts.created_at,
+            posts.updated_at,
+            users.username,
+            users.id as user_id,
+            posts.comment_count
+        FROM posts
+        JOIN users ON posts.user_id = users.id
+        WHERE posts.id = ANY(%s)
+    ''', (list(ranks),))
+    rows = {row['id']: row for row in cur.fetchall()}
+
+    posts = []
+    for post_id, rank in ranks.items():
+        post = rows.get(post_id)
+        if post is not None:
+            post['rank'] = rank
+            posts.append(post)
+
+    backend.add_snippets(cur, terms, posts)
+    return posts, next_cursor
@@ -0,0 +1,74 @@
+import os
+import uuid
+from flask import Response, current_app, request, stream_with_context
+
+from db.connection import checkout_read_connection
+
+# Rows fetched from the server-side cursor (and encoded) per round trip
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 500))
+
+
+def wants_stream():
+    """Whether the client asked for the whole collection with ?stream=1"""
+    return request.args.get('stream') == '1'
+
+def iter_query(query, params=(), chunk_size=STREAM_CHUNK_SIZE):
+    """Yield rows from a named (server-side) cursor, chunk_size at a time
+
+    Only one chunk is ever held in memory. The stream checks out a connection
+    of its own, which it keeps until the generator is exhausted or closed.
+    """
+    conn = checkout_read_connection()
+    cur = conn.cursor(name=f'stream_{uuid.uuid4().hex}')
+    cur.itersize = chunk_size
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cur.close()
+        # Read-only, but the named cursor lived in a transaction
+        conn.rollback()
+        conn.close()
+
+def _chunks(encoded, chunk_size):
+    """Group encoded rows so each write to the socket carries many of them"""
+    batch = []
+    for item in encoded:
+        batch.append(item)
+        if len(batch) >= chunk_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+def stream_collection(key, rows, extra=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Stream rows as {**extra, key: [...], "count": n}, or as NDJSON
+
+    Clients sending Accept: application/x-ndjson get one JSON object per
+    line instead. Rows are encoded with the app's JSON provider, so values
+    look exactly like they do in jsonify() responses.
+    """
+    dumps = current_app.json.dumps
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate_ndjson():
+            yield from _chunks((dumps(row) + '\n' for row in rows), chunk_size)
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+    def generate_json():
+        head = dumps(extra or {})[:-1]
+        yield (head + ',' if len(head) > 1 else head) + f'{dumps(key)}:['
+        count = 0
+        def encoded():
+            nonlocal count
+            for row in rows:
+                yield (',' if count else '') + dumps(row)
+                count += 1
+        yield from _chunks(encoded(), chunk_size)
+        yield f'],"count":{count}}}'
+
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
@@ -0,0 +1,104 @@
+import bisect
+import hashlib
+import heapq
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Every tag name in a sorted array, for prefix suggestions and the tag cloud
+# without touching the database. This process's own tag changes are applied
+# as they commit; other processes' changes arrive with the periodic reload.
+TAG_INDEX_TTL = float(os.getenv('TAG_INDEX_TTL', 60))
+TAG_SUGGEST_LIMIT = int(os.getenv('TAG_SUGGEST_LIMIT', 10))
+
+TAG_INDEX_SQL = 'SELECT id, name, post_count FROM tags'
+
+
+class TagIndex:
+    """Tags by name (sorted, for bisecting a prefix range) with their post counts"""
+
+    def __init__(self, ttl=TAG_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._names = []   # sorted tag names
+        self._tags = {}    # name -> {'id', 'name', 'post_count'}
+        self._by_id = {}   # id -> the same dict
+        self._ranked = None
+        self._version = None
+        self._loaded_at = None
+
+    def is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def load(self, rows):
+        """Replace the contents with rows of (id, name, post_count)"""
+        tags = {row['name']: {'id': row['id'], 'name': row['name'], 'post_count': row['post_count']}
+                for row in rows}
+        with self._lock:
+            self._tags = tags
+            self._by_id = {tag['id']: tag for tag in tags.values()}
+            self._names = sorted(tags)
+            self._ranked = None
+            self._loaded_at = time.monotonic()
+
+    def refresh(self, cur):
+        """Reload from the tags table if the copy is older than the TTL"""
+        if self.is_stale():
+            cur.execute(TAG_INDEX_SQL)
+            self.load(cur.fetchall())
+
+    def apply(self, added=None, removed=()):
+        """Record committed tag links: added is {tag_id: name}, removed a list of tag ids
+
+        Each added link is +1 on its tag's post count (a new tag is added to
+        the index) and each removed one is -1.
+        """
+        with self._lock:
+            for tag_id, name in (added or {}).items():
+                tag = self._by_id.get(tag_id)
+                if tag is None:
+                    tag = {'id': tag_id, 'name': name, 'post_count': 0}
+                    self._tags[name] = self._by_id[tag_id] = tag
+                    bisect.insort(self._names, name)
+                tag['post_count'] += 1
+            for tag_id in removed:
+                tag = self._by_id.get(tag_id)
+                if tag is not None:
+                    tag['post_count'] = max(tag['post_count'] - 1, 0)
+            self._ranked = None
+
+    def suggest(self, prefix, limit=TAG_SUGGEST_LIMIT):
+        """The most used tags whose names start with prefix"""
+        with self._lock:
+            start = bisect.bisect_left(self._names, prefix)
+            end = bisect.bisect_left(self._names, prefix + '\uffff')
+            matches = [self._tags[name] for name in self._names[start:end]]
+            matches = [dict(tag) for tag in matches if tag['post_count'] > 0]
+        return heapq.nsmallest(limit, matches, key=lambda tag: (-tag['post_count'], tag['name']))
+
+    def ranked(self):
+        """(tags by post count then name, a fingerprint of their ids and counts)"""
+        with self._lock:
+            if self._ranked is None:
+                self._ranked = sorted((dict(tag) for tag in self._tags.values()),
+                                      key=lambda tag: (-tag['post_count'], tag['name']))
+                fingerprint = ','.join(f"{tag['id']}:{tag['post_count']}" for tag in
+                                       sorted(self._ranked, key=lambda tag: tag['id']))
+                self._version = hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+            return self._ranked, self._version
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_tag_index():
+    """The process-wide TagIndex (call refresh() before reading from it)"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = TagIndex()
+    return _index
@@ -0,0 +1,94 @@
+MAX_TAG_LENGTH = 50  # tags.name is VARCHAR(50)
+
+
+def normalize_tags(tags):
+    """Lowercase, strip and dedupe tag names, keeping their order
+
+    Accepts a list or a comma-separated string. Raises ValueError for a
+    name that won't fit the column.
+    """
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    names = []
+    for tag in tags or []:
+        name = str(tag).strip().lower()
+        if not name:
+            continue
+        if len(name) > MAX_TAG_LENGTH:
+            raise ValueError(f'Tags can be at most {MAX_TAG_LENGTH} characters')
+        names.append(name)
+    return list(dict.fromkeys(names))
+
+def upsert_tags(cur, names):
+    """Create any missing tags and return {name: id} for all of them"""
+    if not names:
+        return {}
+
+    ids = {}
+    # Two passes at most: if another transaction creates one of the tags
+    # concurrently, ON CONFLICT waits for it but this statement's snapshot
+    # can't see the row, so it's picked up by the second pass
+    for _ in range(2):
+        missing = [name for name in names if name not in ids]
+        if not missing:
+            break
+        cur.execute('''
+            WITH input AS (
+                SELECT unnest(%s::text[]) AS name
+            ),
+            created AS (
+                INSERT INTO tags (name)
+                SELECT name FROM input
+                ON CONFLICT (name) DO NOTHING
+                RETURNING id, name
+            )
+            SELECT id, name FROM created
+            UNION ALL
+            SELECT tags.id, tags.name FROM tags JOIN input ON input.name = tags.name
+        ''', (missing,))
+        ids.update({row['name']: row['id'] for row in cur.fetchall()})
+
+    if len(ids) < len(names):
+        raise RuntimeError('Could not resolve tag ids')
+    return ids
+
+def set_post_tags(cur, post_id, names):
+    """Make a post's tags exactly `names`, touching only the associations that change
+
+    Tag post counts move for the added and removed links only. Returns
+    ({tag_id: name} added, {tag_id: name} removed). The caller commits.
+    """
+    tag_ids = list(upsert_tags(cur, names).values())
+    cur.execute('''
+        WITH wanted AS (
+            SELECT unnest(%(tag_ids)s::int[]) AS tag_id
+        ),
+        removed AS (
+            DELETE FROM post_tags
+            WHERE post_id = %(post_id)s AND tag_id NOT IN (SELECT tag_id FROM wanted)
+            RETURNING tag_id
+        ),
+        added AS (
+            INSERT INTO post_tags (post_id, tag_id)
+            SELECT %(post_id)s, tag_id FROM wanted
+            ON CONFLICT DO NOTHING
+            RETURNING tag_id
+        ),
+        changes AS (
+            SELECT tag_id, 1 AS delta FROM added
+            UNION ALL
+            SELECT tag_id, -1 AS delta FROM removed
+        ),
+        counted AS (
+            UPDATE tags SET post_count = GREATEST(tags.post_count + changes.delta, 0)
+            FROM changes
+            WHERE tags.id = changes.tag_id
+        )
+        SELECT changes.tag_id, tags.name, changes.delta
+        FROM changes
+        JOIN tags ON tags.id = changes.tag_id
+    ''', {'post_id': post_id, 'tag_ids': tag_ids})
+    rows = cur.fetchall()
+    added = {row['tag_id']: row['name'] for row in rows if row['delta'] > 0}
+    removed = {row['tag_id']: row['name'] for row in rows if row['delta'] < 0}
+    return added, removed
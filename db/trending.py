@@ -0,0 +1,200 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+from db.connection import get_pool
+from utils.page_cache import invalidate_pages
+
+load_dotenv()
+
+# Trending scores (posts.trending_score, migration 0009). Every like and
+# comment adds its weight, decaying exponentially with the given half-life.
+#
+# Scores are stored on a log scale relative to a fixed epoch:
+#     trending_score = ln(sum(weight * exp((event_time - epoch) / lifetime)))
+# Decaying every post by the same factor doesn't change their order, so an
+# event only touches its own post's row, the ranking is a plain index scan,
+# and nothing has to be re-decayed for reads to be right. The value grows
+# by one per lifetime, so it never overflows. The current decayed score is
+# exp(trending_score - now_on_the_same_scale).
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 24))
+# Weights must be positive
+TRENDING_LIKE_WEIGHT = float(os.getenv('TRENDING_LIKE_WEIGHT', 1))
+TRENDING_COMMENT_WEIGHT = float(os.getenv('TRENDING_COMMENT_WEIGHT', 2))
+# Posts whose decayed score drops below this leave the ranking (score NULL)
+TRENDING_MIN_SCORE = float(os.getenv('TRENDING_MIN_SCORE', 0.05))
+TRENDING_PRUNE_INTERVAL = float(os.getenv('TRENDING_PRUNE_INTERVAL', 600))
+
+TRENDING_EPOCH = '2024-01-01 00:00:00'
+_EPOCH = datetime.fromisoformat(TRENDING_EPOCH)
+_LIFETIME = TRENDING_HALF_LIFE_HOURS * 3600 / math.log(2)
+
+# The current time on the score scale; LOCALTIMESTAMP to match the TIMESTAMP columns
+NOW_SQL = f"(EXTRACT(EPOCH FROM LOCALTIMESTAMP - TIMESTAMP '{TRENDING_EPOCH}')::float8 / {_LIFETIME})"
+
+# exp() raises on underflow, and past this the smaller term is lost anyway
+_MAX_GAP = 50
+
+
+def _event_sql(time_column, weight):
+    return f"(ln({weight}::float8) + EXTRACT(EPOCH FROM {time_column} - TIMESTAMP '{TRENDING_EPOCH}')::float8 / {_LIFETIME})"
+
+def log_add(score, x):
+    """SQL expression for `score` plus an event worth `x` on the score scale (NULL x adds nothing)"""
+    return f'''CASE
+        WHEN {x} IS NULL THEN {score}
+        WHEN {score} IS NULL THEN {x}
+        ELSE GREATEST({score}, {x}) + ln(1 + exp(-LEAST(abs({score} - {x}), {_MAX_GAP})))
+    END'''
+
+def log_subtract(score, x):
+    """SQL expression for `score` with an earlier event worth `x` taken back (NULL x takes nothing)
+
+    A post left with (next to) nothing leaves the ranking.
+    """
+    return f'''CASE
+        WHEN {x} IS NULL THEN {score}
+        WHEN {score} - {x} > 1e-6 THEN {score} + ln(1 - exp(GREATEST({x} - {score}, -{_MAX_GAP})))
+    END'''
+
+def like_x(time_column, count='1'):
+    """SQL for `count` likes made at `time_column` on the score scale (NULL when count is NULL)"""
+    return _event_sql(time_column, f'{TRENDING_LIKE_WEIGHT} * ({count})')
+
+def like_mass(times):
+    """A set of likes made at `times` on the score scale, or None for no likes
+
+    Mirrors like_x() for likes that are taken back together, so each one
+    is removed at the weight it was added with.
+    """
+    if not times:
+        return None
+    xs = [math.log(TRENDING_LIKE_WEIGHT) + (t - _EPOCH).total_seconds() / _LIFETIME for t in times]
+    peak = max(xs)
+    return peak + math.log(sum(math.exp(x - peak) for x in xs))
+
+def comment_bump(score):
+    """SQL expression for `score` after one new comment"""
+    return log_add(score, _event_sql('LOCALTIMESTAMP', TRENDING_COMMENT_WEIGHT))
+
+def current_score_sql(score):
+    """SQL expression for a stored score decayed to now"""
+    return f'exp(GREATEST({score} - {NOW_SQL}, -700))'
+
+# Posts ranked by score; {columns} and {after} (keyset on trending_key, id) are filled in by the caller
+TRENDING_PAGE_SQL = f'''
+    SELECT {{columns}},
+           posts.trending_score AS trending_key,
+           {current_score_sql('posts.trending_score')} AS trending
+    FROM posts
+    JOIN users ON posts.user_id = users.id
+    WHERE posts.trending_score IS NOT NULL AND {{after}}
+    ORDER BY posts.trending_score DESC, posts.id DESC
+'''
+
+# The same ranking over the precomputed front page rows, for the HTML view
+TRENDING_FEED_SQL = '''
+    SELECT
+        feed_items.post_id AS id,
+        feed_items.title,
+        feed_items.content,
+        feed_items.content_html,
+        feed_items.content_hash,
+        feed_items.cover_image,
+        feed_items.cover_image_variants,
+        feed_items.created_at,
+        feed_items.username,
+        feed_items.user_id,
+        feed_items.profile_image,
+        feed_items.like_count,
+        feed_items.comment_count,
+        feed_items.tags,
+        feed_items.comments,
+        posts.trending_score AS trending_key
+    FROM posts
+    JOIN feed_items ON feed_items.post_id = posts.id
+    WHERE posts.trending_score IS NOT NULL AND {after}
+    ORDER BY posts.trending_score DESC, posts.id DESC
+    LIMIT %s
+'''
+
+# Below this stored value the decayed score is under TRENDING_MIN_SCORE
+_CUTOFF_SQL = f'({NOW_SQL} + ln({TRENDING_MIN_SCORE}::float8))'
+
+REBUILD_SQL = f'''
+    WITH events AS (
+        SELECT post_id, {_event_sql('created_at', TRENDING_LIKE_WEIGHT)} AS x FROM likes
+        UNION ALL
+        SELECT post_id, {_event_sql('created_at', TRENDING_COMMENT_WEIGHT)} AS x FROM comments
+    ),
+    peaks AS (
+        SELECT post_id, MAX(x) AS peak FROM events GROUP BY post_id
+    ),
+    scores AS (
+        -- log-sum-exp, shifted by the largest term so exp() stays in range
+        SELECT events.post_id, peaks.peak + ln(SUM(exp(GREATEST(events.x - peaks.peak, -700)))) AS score
+        FROM events
+        JOIN peaks ON peaks.post_id = events.post_id
+        GROUP BY events.post_id, peaks.peak
+    )
+    UPDATE posts SET trending_score = scores.score
+    FROM scores
+    WHERE posts.id = scores.post_id AND scores.score >= {_CUTOFF_SQL}
+'''
+
+
+def prune_trending(cur):
+    """Drop posts whose score has decayed below TRENDING_MIN_SCORE; the caller commits"""
+    cur.execute(f'UPDATE posts SET trending_score = NULL WHERE trending_score < {_CUTOFF_SQL}')
+    return cur.rowcount
+
+def rebuild_trending(cur):
+    """Recompute every score from the likes and comments tables; the caller commits
+
+    Returns the number of posts in the ranking afterwards.
+    """
+    cur.execute('UPDATE posts SET trending_score = NULL WHERE trending_score IS NOT NULL')
+    cur.execute(REBUILD_SQL)
+    return cur.rowcount
+
+
+_pruner = None
+_pruner_lock = threading.Lock()
+
+def _prune_loop():
+    while True:
+        # A failed pass, including one that couldn't get a connection, is
+        # logged and retried next interval; the thread is only started once
+        try:
+            _prune_once()
+        except Exception as e:
+            print(f"Trending prune failed: {e}")
+        time.sleep(TRENDING_PRUNE_INTERVAL)
+
+def _prune_once():
+    conn = get_pool().getconn()
+    cur = conn.cursor()
+    try:
+        pruned = prune_trending(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    if pruned:
+        invalidate_pages('posts')
+
+def ensure_pruner():
+    """Start the background pass that keeps the ranking to posts still trending (once per process)"""
+    global _pruner
+    if _pruner is not None:
+        return
+    with _pruner_lock:
+        if _pruner is None:
+            _pruner = threading.Thread(target=_prune_loop, name='trending-prune', daemon=True)
+            _pruner.start()
@@ -1,8 +1,40 @@
+import asyncio
 from flask import Blueprint, request, jsonify, session
-from db.connection import get_db_connection
+from db.async_db import fetch_all, fetch_one
+from db.connection import get_db_connection, get_read_connection
+from db.home_feed import refresh_feed_posts
+from db.trending import comment_bump
+from db.pagination import get_page_args, keyset_clause, paginate
+from utils.page_cache import invalidate_pages
+from utils.conditional import conditional
+from utils.async_views import async_twin
 
 comments_bp = Blueprint('comments', __name__)
 
+COMMENTS_VERSION_SQL = '''
+    SELECT posts.comment_count,
+           (SELECT MAX(created_at) FROM comments WHERE post_id = posts.id) AS newest
+    FROM posts WHERE posts.id = %s
+'''
+
+# Oldest first; {after} is the keyset condition
+COMMENTS_PAGE_SQL = '''
+    SELECT comments.id, comments.content, comments.created_at, users.username, users.id AS user_id
+    FROM comments
+    JOIN users ON comments.user_id = users.id
+    WHERE comments.post_id = %s AND {after}
+    ORDER BY comments.created_at ASC, comments.id ASC
+    LIMIT %s
+'''
+
+def _comments_list(comments):
+    return [{
+        'id': comment['id'],
+        'content': comment['content'],
+        'created_at': comment['created_at'],
+        'username': comment['username']
+    } for comment in comments]
+
 @comments_bp.route('/posts/<int:post_id>/comments', methods=['POST'])
 def create_comment(post_id):
     # Check if user is logged in
@@ -36,6 +68,11 @@ def create_comment(post_id):
         )
         
         comment = cur.fetchone()
+        cur.execute(
+            f'UPDATE posts SET comment_count = comment_count + 1, trending_score = {comment_bump("trending_score")} WHERE id = %s',
+            (post_id,)
+        )
+        refresh_feed_posts(cur, [post_id])
         
         # Get username for response
         cur.execute('SELECT username FROM users WHERE id = %s', (user_id,))
@@ -44,6 +81,7 @@ def create_comment(post_id):
         conn.commit()
         cur.close()
         conn.close()
+        invalidate_pages('comments')
         
         return jsonify({'message': 'Comment created successfully', 'comment': {
             'id': comment['id'],
@@ -57,10 +95,30 @@ def create_comment(post_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
     
+def comments_version(cur, post_id):
+    """Comments are only ever added, so the count and newest time pin them down"""
+    cur.execute(COMMENTS_VERSION_SQL, (post_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return f"{row['comment_count']}@{row['newest']}", row['newest']
+
+async def comments_version_async(post_id):
+    row = await fetch_one(COMMENTS_VERSION_SQL, (post_id,))
+    if row is None:
+        return None
+    return f"{row['comment_count']}@{row['newest']}", row['newest']
+
 @comments_bp.route('/posts/<int:post_id>/comments', methods=['GET'])
+@conditional(comments_version)
 def get_comments(post_id):
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        conn = get_read_connection()
         cur = conn.cursor()
         
         # Check if post exists
@@ -70,30 +128,39 @@ def get_comments(post_id):
             conn.close()
             return jsonify({'error': 'Post not found'}), 404
         
-        # Retrieve comments for the post
-        cur.execute(
-            '''
-            SELECT comments.id, comments.content, comments.created_at, users.username, users.id AS user_id
-            FROM comments
-            JOIN users ON comments.user_id = users.id
-            WHERE comments.post_id = %s
-            ORDER BY comments.created_at ASC
-            ''',
-            (post_id,)
-        )
+        # Retrieve a page of comments for the post, oldest first
+        after, after_params = keyset_clause(position, 'comments.created_at', 'comments.id', descending=False)
+        cur.execute(COMMENTS_PAGE_SQL.format(after=after), (post_id, *after_params, limit + 1))
         
-        comments = cur.fetchall()
+        comments, next_cursor = paginate(cur.fetchall(), limit)
         cur.close()
         conn.close()
         
-        comments_list = [{
-            'id': comment['id'],
-            'content': comment['content'],
-            'created_at': comment['created_at'],
-            'username': comment['username']
-        } for comment in comments]
-        
-        return jsonify({'comments': comments_list}), 200
+        return jsonify({'comments': _comments_list(comments), 'next_cursor': next_cursor}), 200
         
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@async_twin('comments.get_comments')
+@conditional(comments_version_async)
+async def get_comments_async(post_id):
+    try:
+        position, limit = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # The existence check and the page don't depend on each other
+        after, after_params = keyset_clause(position, 'comments.created_at', 'comments.id', descending=False)
+        post, rows = await asyncio.gather(
+            fetch_one('SELECT id FROM posts WHERE id = %s', (post_id,)),
+            fetch_all(COMMENTS_PAGE_SQL.format(after=after), (post_id, *after_params, limit + 1)),
+        )
+        if not post:
+            return jsonify({'error': 'Post not found'}), 404
+
+        comments, next_cursor = paginate(rows, limit)
+        return jsonify({'comments': _comments_list(comments), 'next_cursor': next_cursor}), 200
+
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
\ No newline at end of file
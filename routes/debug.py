@@ -0,0 +1,20 @@
+from flask import Blueprint, current_app, jsonify, request, abort
+from utils.profiling import stats, PROFILING_ENABLED
+
+debug_bp = Blueprint('debug', __name__)
+
+@debug_bp.route('/profile', methods=['GET'])
+def profile():
+    """Per-route timings and the slowest statements seen since startup"""
+    # Hidden entirely unless PROFILE_ENDPOINT is switched on
+    if not current_app.config.get('PROFILE_ENDPOINT'):
+        abort(404)
+    if not PROFILING_ENABLED:
+        return jsonify({'error': 'Profiling is off; set PROFILING=1'}), 503
+
+    top = request.args.get('top', 20, type=int)
+    if request.args.get('reset') == '1':
+        snapshot = stats.snapshot(top)
+        stats.reset()
+        return jsonify(snapshot)
+    return jsonify(stats.snapshot(top))
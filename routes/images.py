@@ -0,0 +1,24 @@
+from flask import Blueprint, request, jsonify
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.image_handler import get_image_status
+
+images_bp = Blueprint('images', __name__)
+
+@images_bp.route('/images/status', methods=['GET'])
+def image_status():
+    """Background processing status of an uploaded image"""
+    image_path = request.args.get('path', '').lstrip('/')
+    if image_path.startswith('static/'):
+        image_path = image_path[len('static/'):]
+    
+    if not image_path:
+        return jsonify({'error': 'path is required'}), 400
+    
+    job = get_image_status(image_path)
+    if job is None:
+        # Not tracked by this process (already done and forgotten, or never queued)
+        return jsonify({'path': image_path, 'status': 'unknown'}), 200
+    
+    return jsonify({'path': image_path, 'status': job['status'], 'error': job['error']}), 200
@@ -1,8 +1,30 @@
 from flask import Blueprint, request, jsonify, session
-from db.connection import get_db_connection
+from db.async_db import fetch_all, fetch_one
+from db.connection import get_db_connection, get_read_connection
+from db.likes import get_like_buffer, toggle_like
+from utils.page_cache import invalidate_pages
+from utils.conditional import conditional
+from db.pagination import get_page_args, keyset_clause, paginate
+from db.streaming import wants_stream, iter_query, stream_collection
+from db.fields import select_fields, LIKED_POST_FIELDS, DEFAULT_LIKED_POST_FIELDS
+from utils.async_views import async_twin
 
 likes_bp = Blueprint('likes', __name__)
 
+POST_LIKES_VERSION_SQL = '''
+    SELECT posts.like_count,
+           (SELECT MAX(created_at) FROM likes WHERE post_id = posts.id) AS newest
+    FROM posts WHERE posts.id = %s
+'''
+
+POST_LIKES_SQL = '''
+    SELECT users.id, users.username, likes.created_at
+    FROM likes
+    JOIN users ON likes.user_id = users.id
+    WHERE likes.post_id = %s
+    ORDER BY likes.created_at DESC
+'''
+
 @likes_bp.route('/posts/<int:post_id>/like', methods=['POST'])
 def like_post(post_id):
     """Like or unlike a post."""
@@ -15,53 +37,55 @@ def like_post(post_id):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        # Check if the post exists
-        cur.execute('SELECT * FROM posts WHERE id = %s', (post_id,))
-        if not cur.fetchone():
-            cur.close()
-            conn.close()
-            return jsonify({'error': 'Post not found'}), 404
-        
-        # Check if the user has already liked the post
-        cur.execute('SELECT * FROM likes WHERE user_id = %s AND post_id = %s', (user_id, post_id))
-        existing_like = cur.fetchone()
 
-        if existing_like:
-            # User has already liked the post, so unlike it
-            cur.execute('DELETE FROM likes WHERE user_id = %s AND post_id = %s', (user_id, post_id))
-            action = 'unliked'
+        # Either coalesce the click in memory or flip it in a single statement
+        buffer = get_like_buffer()
+        if buffer is not None:
+            result = buffer.toggle(cur, user_id, post_id)
         else:
-            # User has not liked the post yet, so like it
-            cur.execute('INSERT INTO likes (user_id, post_id) VALUES (%s, %s)', (user_id, post_id))
-            action = 'liked'
-            
-            # Get updated like count
-            cur.execute('SELECT COUNT(*) FROM likes WHERE post_id = %s', (post_id,))
-            like_count = cur.fetchone()['count']
-            
-            conn.commit()
+            result = toggle_like(cur, user_id, post_id)
+
+        if result is None:
+            conn.rollback()
             cur.close()
             conn.close()
-            return jsonify({'message': f'Post {action} successfully', 'action': action, 'like_count': like_count, 'liked': action == 'liked'}), 200
+            return jsonify({'error': 'Post not found'}), 404
+
+        liked, like_count = result
+        action = 'liked' if liked else 'unliked'
+        conn.commit()
+        cur.close()
+        conn.close()
+        invalidate_pages('likes')
+        return jsonify({'message': f'Post {action} successfully', 'action': action, 'like_count': like_count, 'liked': liked}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+def post_likes_version(cur, post_id):
+    """A like always becomes the newest and an unlike lowers the count, so the pair catches both"""
+    cur.execute(POST_LIKES_VERSION_SQL, (post_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    # Unlikes don't move the newest timestamp, so no Last-Modified
+    return f"{row['like_count']}@{row['newest']}", None
+
+async def post_likes_version_async(post_id):
+    row = await fetch_one(POST_LIKES_VERSION_SQL, (post_id,))
+    if row is None:
+        return None
+    return f"{row['like_count']}@{row['newest']}", None
+
 @likes_bp.route('/posts/<int:post_id>/likes', methods=['GET'])
+@conditional(post_likes_version)
 def get_post_likes(post_id):
     """Get all users who liked a post."""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
 
-        cur.execute('''
-            SELECT users.id, users.username, likes.created_at
-            FROM likes
-            JOIN users ON likes.user_id = users.id
-            WHERE likes.post_id = %s
-            ORDER BY likes.created_at DESC
-        ''', (post_id,))
+        cur.execute(POST_LIKES_SQL, (post_id,))
         
         likes = cur.fetchall()
         cur.close()
@@ -72,40 +96,50 @@ def get_post_likes(post_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@async_twin('likes.get_post_likes')
+@conditional(post_likes_version_async)
+async def get_post_likes_async(post_id):
+    try:
+        likes = await fetch_all(POST_LIKES_SQL, (post_id,))
+        return jsonify({'likes': likes, 'count': len(likes)}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @likes_bp.route('/users/<int:user_id>/liked-posts', methods=['GET'])
 def get_user_liked_posts(user_id):
-    """Get all posts a user has liked."""
+    """Get a page of posts a user has liked, most recently liked first."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        position, limit = get_page_args()
+        columns = select_fields(LIKED_POST_FIELDS, DEFAULT_LIKED_POST_FIELDS, required=('id', 'liked_at'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        cur.execute('''
-            SELECT 
-                posts.id,
-                posts.title,
-                posts.content,
-                posts.created_at,
-                users.username,
-                users.id as user_id,
-                COUNT(DISTINCT comments.id) as comment_count,
-                COUNT(DISTINCT post_likes.user_id) as like_count
+    try:
+        after, after_params = keyset_clause(position, 'likes.created_at', 'posts.id')
+        query = f'''
+            SELECT {columns}
             FROM likes
             JOIN posts ON likes.post_id = posts.id
             JOIN users ON posts.user_id = users.id
-            LEFT JOIN comments ON posts.id = comments.post_id
-            LEFT JOIN likes as post_likes ON posts.id = post_likes.post_id
-            WHERE likes.user_id = %s
-            GROUP BY posts.id, posts.title, posts.content, posts.created_at, users.username, users.id
-            ORDER BY likes.created_at DESC
-        ''', (user_id,))
+            WHERE likes.user_id = %s AND {after}
+            ORDER BY likes.created_at DESC, posts.id DESC
+        '''
+        if wants_stream():
+            return stream_collection('posts', iter_query(query, (user_id, *after_params)))
+        
+        conn = get_read_connection()
+        cur = conn.cursor()
+        cur.execute(query + ' LIMIT %s', (user_id, *after_params, limit + 1))
         
-        posts = cur.fetchall()
+        posts, next_cursor = paginate(cur.fetchall(), limit, created_key='liked_at')
         cur.close()
         conn.close()
         
         return jsonify({
             'posts': posts,
-            'count': len(posts)
+            'count': len(posts),
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
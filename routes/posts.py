@@ -1,64 +1,164 @@
 from flask import Blueprint, request, jsonify, session
-from db.connection import get_db_connection
+from db.async_db import fetch_all, fetch_one
+from db.connection import get_db_connection, get_read_connection
+from db.pagination import get_page_args, keyset_clause, paginate
+from db.search import get_search_backend, search_posts as run_search
+from db.counters import release_post_tags
+from db.home_feed import refresh_feed_posts
+from db.tag_index import get_tag_index
+from db.tags import normalize_tags, set_post_tags
+from db.trending import TRENDING_PAGE_SQL, ensure_pruner
+from db.streaming import wants_stream, iter_query, stream_collection
+from db.fields import select_fields, POST_LIST_FIELDS, DEFAULT_POST_FIELDS
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.image_handler import save_post_image, delete_image
+from utils.image_handler import save_post_image, delete_image, get_image_status, sync_image_variants
+from utils.markdown_renderer import render_for_storage, summarize
+from utils.page_cache import invalidate_pages
+from utils.conditional import conditional
+from utils.async_views import async_twin
 
 posts_bp = Blueprint('posts', __name__)
 
+# Same index walk as the page itself, but no join and no content
+PAGE_VERSION_SQL = '''
+    SELECT md5(string_agg(concat_ws('@', id, updated_at, like_count, comment_count), ',')) AS token
+    FROM (
+        SELECT id, updated_at, like_count, comment_count FROM posts
+        WHERE {after}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    ) AS page
+'''
+
+POSTS_PAGE_SQL = '''
+    SELECT {columns}
+    FROM posts
+    JOIN users ON posts.user_id = users.id
+    WHERE {after}
+    ORDER BY posts.created_at DESC, posts.id DESC
+'''
+
+POST_SQL = '''
+    SELECT 
+        posts.id,
+        posts.title,
+        posts.content,
+        posts.created_at,
+        posts.updated_at,
+        users.username,
+        users.id as user_id
+    FROM posts
+    JOIN users ON posts.user_id = users.id
+    WHERE posts.id = %s
+'''
+
+def _page_query(columns, position):
+    """(query, keyset params, cursor key) for ?sort=recent (the default) or ?sort=trending
+
+    Raises ValueError for any other sort.
+    """
+    sort = request.args.get('sort', 'recent')
+    if sort == 'recent':
+        after, after_params = keyset_clause(position, 'posts.created_at', 'posts.id')
+        return POSTS_PAGE_SQL.format(columns=columns, after=after), after_params, 'created_at'
+    if sort == 'trending':
+        after, after_params = keyset_clause(position, 'posts.trending_score', 'posts.id')
+        return TRENDING_PAGE_SQL.format(columns=columns, after=after), after_params, 'trending_key'
+    raise ValueError("Invalid sort: use 'recent' or 'trending'")
+
+def _posts_page(rows, limit, cursor_key):
+    posts, next_cursor = paginate(rows, limit, created_key=cursor_key)
+    for post in posts:
+        post.pop('trending_key', None)
+    return jsonify({'posts': posts, 'count': len(posts), 'next_cursor': next_cursor})
+
+def posts_page_version(cur):
+    """Fingerprint of the ids, edit times and counters on the requested page"""
+    # Trending scores decay with time, so those pages have no stable version
+    if wants_stream() or request.args.get('sort', 'recent') != 'recent':
+        return None
+    try:
+        position, limit = get_page_args()
+    except ValueError:
+        return None
+    after, after_params = keyset_clause(position, 'created_at', 'id')
+    cur.execute(PAGE_VERSION_SQL.format(after=after), (*after_params, limit + 1))
+    # Deleting a post doesn't move any timestamp, so no Last-Modified
+    return cur.fetchone()['token'], None
+
+async def posts_page_version_async():
+    if request.args.get('sort', 'recent') != 'recent':
+        return None
+    try:
+        position, limit = get_page_args()
+    except ValueError:
+        return None
+    after, after_params = keyset_clause(position, 'created_at', 'id')
+    row = await fetch_one(PAGE_VERSION_SQL.format(after=after), (*after_params, limit + 1))
+    return row['token'], None
+
 @posts_bp.route('/posts', methods=['GET'])
+@conditional(posts_page_version)
 def get_posts():
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+        columns = select_fields(POST_LIST_FIELDS, DEFAULT_POST_FIELDS, required=('id', 'created_at'))
+        query, after_params, cursor_key = _page_query(columns, position)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        if cursor_key == 'trending_key':
+            # A ranking rather than the whole collection, so ?stream=1 doesn't apply
+            ensure_pruner()
+        # ?stream=1 sends every post from the cursor on, a chunk at a time
+        elif wants_stream():
+            return stream_collection('posts', iter_query(query, after_params))
+        
+        # Get a page of posts with user information
+        conn = get_read_connection()
         cur = conn.cursor()
-        
-        # Get all posts with user information
-        cur.execute('''
-            SELECT 
-                posts.id,
-                posts.title,
-                posts.content,
-                posts.cover_image,
-                posts.created_at,
-                posts.updated_at,
-                users.username,
-                users.id as user_id
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            ORDER BY posts.created_at DESC
-        ''')
-        
-        posts = cur.fetchall()
+        cur.execute(query + ' LIMIT %s', (*after_params, limit + 1))
+        rows = cur.fetchall()
         cur.close()
         conn.close()
         
-        return jsonify({'posts': posts, 'count': len(posts)})
+        return _posts_page(rows, limit, cursor_key)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@async_twin('posts.get_posts')
+@conditional(posts_page_version_async)
+async def get_posts_async():
+    """get_posts() for asgi.py (?stream=1 requests are still served by get_posts)"""
+    try:
+        position, limit = get_page_args()
+        columns = select_fields(POST_LIST_FIELDS, DEFAULT_POST_FIELDS, required=('id', 'created_at'))
+        query, after_params, cursor_key = _page_query(columns, position)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        if cursor_key == 'trending_key':
+            ensure_pruner()
+        rows = await fetch_all(query + ' LIMIT %s', (*after_params, limit + 1))
+        return _posts_page(rows, limit, cursor_key)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
     
 @posts_bp.route('/posts/<int:post_id>', methods=['GET'])
 def get_post(post_id):
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
         
         # Get post by id with user information
-        cur.execute('''
-            SELECT 
-                posts.id,
-                posts.title,
-                posts.content,
-                posts.created_at,
-                posts.updated_at,
-                users.username,
-                users.id as user_id
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            WHERE posts.id = %s
-        ''', (post_id,))
+        cur.execute(POST_SQL, (post_id,))
         
         post = cur.fetchone()
         cur.close()
@@ -71,39 +171,39 @@ def get_post(post_id):
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@async_twin('posts.get_post')
+async def get_post_async(post_id):
+    try:
+        post = await fetch_one(POST_SQL, (post_id,))
+        if post is None:
+            return jsonify({'error': 'Post not found'}), 404
+        return jsonify({'post': post})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
 @posts_bp.route('/posts/search', methods=['GET'])
 def search_posts():
     query = request.args.get('q', '').strip()
     if not query:
-        return jsonify({'posts': [], 'count': 0, query: ''})
+        return jsonify({'posts': [], 'count': 0, 'query': '', 'next_cursor': None})
     
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        conn = get_read_connection()
         cur = conn.cursor()
         
-        # Search posts by title or content
-        search_query = f"%{query}%"
-        cur.execute('''
-            SELECT 
-                posts.id,
-                posts.title,
-                posts.content,
-                posts.created_at,
-                posts.updated_at,
-                users.username,
-                users.id as user_id
-            FROM posts
-            JOIN users ON posts.user_id = users.id
-            WHERE posts.title ILIKE %s OR posts.content ILIKE %s
-            ORDER BY posts.created_at DESC
-        ''', (search_query, search_query))
-        
-        posts = cur.fetchall()
+        # Full-text search, ranked by relevance with highlighted snippets
+        posts, next_cursor = run_search(cur, query, limit, position)
         cur.close()
         conn.close()
         
-        return jsonify({'posts': posts, 'count': len(posts), 'query': query})
+        return jsonify({'posts': posts, 'count': len(posts), 'query': query, 'next_cursor': next_cursor})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -140,6 +240,10 @@ def create_post():
     # Validate input (works for both multipart and JSON)
     if not title:
         return jsonify({'error': 'Title is required'}), 400
+    try:
+        tags = normalize_tags(tags)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     user_id = session['user_id']
     cover_image_path = None
@@ -154,60 +258,70 @@ def create_post():
         conn = get_db_connection()
         cur = conn.cursor()
         
+        # Render markdown and the list preview once here instead of on every page view
+        content_html, content_hash = render_for_storage(content)
+        summary = summarize(content_html)
+        
         # Insert post (with cover image path if available)
         cur.execute(
-            'INSERT INTO posts (user_id, title, content, cover_image) VALUES (%s, %s, %s, %s) RETURNING id, user_id, title, content, cover_image, created_at, updated_at',
-            (user_id, title, content, cover_image_path)
+            '''INSERT INTO posts (user_id, title, content, content_html, content_hash, excerpt, excerpt_html, word_count, reading_time, cover_image)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+               RETURNING id, user_id, title, content, cover_image, created_at, updated_at''',
+            (user_id, title, content, content_html, content_hash, summary['excerpt'], summary['excerpt_html'],
+             summary['word_count'], summary['reading_time'], cover_image_path)
         )
         
         post = cur.fetchone()
         post_id = post['id']
         
-        # Handle tags
-        if tags:
-            for tag_name in tags:
-                tag_name = tag_name.strip().lower()
-                if not tag_name:
-                    continue
-                
-                # Check if tag exists, if not, create it
-                cur.execute('SELECT id FROM tags WHERE name = %s', (tag_name,))
-                tag = cur.fetchone()
-                
-                if tag:
-                    tag_id = tag['id']
-                else:
-                    # Insert new tag
-                    cur.execute('INSERT INTO tags (name) VALUES (%s) RETURNING id', (tag_name,))
-                    tag_id = cur.fetchone()['id']
-                
-                # Associate tag with post
-                cur.execute('INSERT INTO post_tags (post_id, tag_id) VALUES (%s, %s) ON CONFLICT DO NOTHING', (post_id, tag_id))
+        # Create missing tags and link them all in a fixed number of statements
+        added_tags, _ = set_post_tags(cur, post_id, tags)
+        
+        # Keep the author's post count current
+        cur.execute('UPDATE users SET post_count = post_count + 1 WHERE id = %s', (user_id,))
+        
+        # Add it to the precomputed front page
+        refresh_feed_posts(cur, [post_id])
                 
         conn.commit()
         cur.close()
         conn.close()
         
-        return jsonify({
-            'message': 'Post created successfully',
-            'post': {
-                'id': post['id'],
-                'user_id': post['user_id'],
-                'title': post['title'],
-                'content': post['content'],
-                'cover_image': post['cover_image'],
-                'created_at': str(post['created_at']),
-                'updated_at': str(post['updated_at']),
-                'tags': tags
-            }
-        }), 201
-        
     except Exception as e:
         # Delete saved cover image if post creation fails
         if cover_image_path:
             delete_image(cover_image_path)
         return jsonify({'error': str(e)}), 500
     
+    # The post is saved from here on, so a failure below is only logged
+    try:
+        invalidate_pages('posts', 'tags')
+        get_tag_index().apply(added_tags)
+        
+        get_search_backend().index_post(post)
+        
+        # Record responsive variants if the worker already finished them
+        if cover_image_path:
+            sync_image_variants(cover_image_path, 'posts')
+    except Exception as e:
+        print(f" Error updating caches for post {post_id}: {e}")
+    
+    return jsonify({
+        'message': 'Post created successfully',
+        'post': {
+            'id': post['id'],
+            'user_id': post['user_id'],
+            'title': post['title'],
+            'content': post['content'],
+            'cover_image': post['cover_image'],
+            # Cover images are resized in the background; poll /api/images/status
+            'cover_image_status': (get_image_status(cover_image_path) or {}).get('status') if cover_image_path else None,
+            'created_at': str(post['created_at']),
+            'updated_at': str(post['updated_at']),
+            'tags': tags
+        }
+    }), 201
+    
 @posts_bp.route('/posts/<int:post_id>', methods=['PUT'])
 def update_post(post_id):
     # Check if user is authenticated
@@ -222,7 +336,10 @@ def update_post(post_id):
     
     title = data['title']
     content = data.get('content', '') # Content is optional
-    tags = data.get('tags', []) # Get tags from request
+    try:
+        tags = normalize_tags(data.get('tags', []))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
         conn = get_db_connection()
@@ -244,55 +361,54 @@ def update_post(post_id):
             conn.close()
             return jsonify({'error': 'You can only edit your own posts'}), 403
         
-        # Update post
+        # Update post, its pre-rendered HTML and its list preview
+        content_html, content_hash = render_for_storage(content)
+        summary = summarize(content_html)
         cur.execute(
-            'UPDATE posts SET title = %s, content = %s, updated_at = NOW() WHERE id = %s RETURNING id, user_id, title, content, created_at, updated_at',
-            (title, content, post_id)
+            '''UPDATE posts
+               SET title = %s, content = %s, content_html = %s, content_hash = %s, excerpt = %s, excerpt_html = %s,
+                   word_count = %s, reading_time = %s, updated_at = NOW()
+               WHERE id = %s
+               RETURNING id, user_id, title, content, created_at, updated_at''',
+            (title, content, content_html, content_hash, summary['excerpt'], summary['excerpt_html'],
+             summary['word_count'], summary['reading_time'], post_id)
         )
         
         updated_post = cur.fetchone()
         
-        # Update tags - clear existing and add new
-        cur.execute('DELETE FROM post_tags WHERE post_id = %s', (post_id,))
-        if tags:
-            for tag_name in tags:
-                tag_name = tag_name.strip().lower()
-                if not tag_name:
-                    continue
-                
-                # Check if tag exists, if not, create it
-                cur.execute('SELECT id FROM tags WHERE name = %s', (tag_name,))
-                tag = cur.fetchone()
-                
-                if tag:
-                    tag_id = tag['id']
-                else:
-                    # Insert new tag
-                    cur.execute('INSERT INTO tags (name) VALUES (%s) RETURNING id', (tag_name,))
-                    tag_id = cur.fetchone()['id']
-                
-                # Link post with tag
-                cur.execute('INSERT INTO post_tags (post_id, tag_id) VALUES (%s, %s) ON CONFLICT DO NOTHING', (post_id, tag_id))
-                
+        # Apply only the tag links that changed
+        added_tags, removed_tags = set_post_tags(cur, post_id, tags)
+        
+        refresh_feed_posts(cur, [post_id])
+        
         conn.commit()
         cur.close()
         conn.close()
         
-        return jsonify({
-            'message': 'Post updated successfully',
-            'post': {
-                'id': updated_post['id'],
-                'user_id': updated_post['user_id'],
-                'title': updated_post['title'],
-                'content': updated_post['content'],
-                'updated_at': str(updated_post['updated_at']),
-                'tags': tags
-            }
-        }), 200
-        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+    # The update is saved from here on, so a failure below is only logged
+    try:
+        invalidate_pages('posts', 'tags')
+        get_tag_index().apply(added_tags, removed_tags)
+        
+        get_search_backend().index_post(updated_post)
+    except Exception as e:
+        print(f" Error updating caches for post {post_id}: {e}")
+    
+    return jsonify({
+        'message': 'Post updated successfully',
+        'post': {
+            'id': updated_post['id'],
+            'user_id': updated_post['user_id'],
+            'title': updated_post['title'],
+            'content': updated_post['content'],
+            'updated_at': str(updated_post['updated_at']),
+            'tags': tags
+        }
+    }), 200
+    
 @posts_bp.route('/posts/<int:post_id>', methods=['DELETE'])
 def delete_post(post_id):
     # Check if user is authenticated
@@ -319,17 +435,28 @@ def delete_post(post_id):
             conn.close()
             return jsonify({'error': 'You can only delete your own posts'}), 403
         
-        # Delete post
+        # Delete post, releasing its tag and author counts first
+        released_tags = release_post_tags(cur, post_id)
         cur.execute('DELETE FROM posts WHERE id = %s', (post_id,))
+        cur.execute('UPDATE users SET post_count = GREATEST(post_count - 1, 0) WHERE id = %s', (user_id,))
         conn.commit()
         cur.close()
         conn.close()
         
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    # The post is gone from here on, so a failure below is only logged
+    try:
+        invalidate_pages('posts', 'tags')
+        get_tag_index().apply(removed=released_tags)
+        
+        get_search_backend().remove_post(post_id)
+        
         # Delete cover image if exists
         if post['cover_image']:
             delete_image(post['cover_image'])
-        
-        return jsonify({'message': 'Post deleted successfully'}), 200
-        
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        print(f" Error updating caches for post {post_id}: {e}")
+    
+    return jsonify({'message': 'Post deleted successfully'}), 200
\ No newline at end of file
@@ -1,27 +1,53 @@
 from flask import Blueprint, request, jsonify, session
-from db.connection import get_db_connection
+from db.async_db import fetch_all
+from db.connection import get_read_connection
+from db.pagination import get_page_args, keyset_clause, paginate, MAX_PAGE_SIZE
+from db.tag_index import TAG_INDEX_SQL, TAG_SUGGEST_LIMIT, get_tag_index
+from db.streaming import wants_stream, iter_query, stream_collection
+from db.fields import select_fields, POST_LIST_FIELDS, DEFAULT_POST_FIELDS
+from utils.conditional import conditional
+from utils.async_views import async_twin
 
 tags_bp = Blueprint('tags', __name__)
 
+def _tag_index(cur):
+    """The in-memory tag index, reloaded first if it's out of date"""
+    index = get_tag_index()
+    index.refresh(cur)
+    return index
+
+async def _tag_index_async():
+    index = get_tag_index()
+    if index.is_stale():
+        index.load(await fetch_all(TAG_INDEX_SQL))
+    return index
+
+def _suggest_args():
+    """(prefix, limit) from ?prefix= and ?limit=, raising ValueError for a bad limit"""
+    prefix = request.args.get('prefix', '').strip().lower()
+    try:
+        limit = int(request.args.get('limit', TAG_SUGGEST_LIMIT))
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return prefix, max(1, min(limit, MAX_PAGE_SIZE))
+
+def tags_version(cur):
+    """Fingerprint of every tag's count, from the tag index"""
+    return _tag_index(cur).ranked()[1], None
+
+async def tags_version_async():
+    return (await _tag_index_async()).ranked()[1], None
+
 @tags_bp.route('/tags', methods=['GET'])
+@conditional(tags_version)
 def get_tags():
     """Get all tags with post counts"""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
         
-        cur.execute('''
-            SELECT
-                tags.id,
-                tags.name,
-                COUNT(post_tags.post_id) AS post_count
-            FROM tags
-            LEFT JOIN post_tags ON tags.id = post_tags.tag_id
-            GROUP BY tags.id, tags.name
-            ORDER BY post_count DESC, tags.name ASC
-        ''')
-        
-        tags = cur.fetchall()
+        # Most used first, straight from the in-memory index
+        tags, _ = _tag_index(cur).ranked()
         
         cur.close()
         conn.close()
@@ -30,12 +56,62 @@ def get_tags():
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@async_twin('tags.get_tags')
+@conditional(tags_version_async)
+async def get_tags_async():
+    try:
+        tags, _ = (await _tag_index_async()).ranked()
+        return jsonify({'tags': tags, 'count': len(tags)}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@tags_bp.route('/tags/suggest', methods=['GET'])
+def suggest_tags():
+    """Tags starting with ?prefix=, most used first, for autocomplete"""
+    try:
+        prefix, limit = _suggest_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        tags = _tag_index(cur).suggest(prefix, limit)
+        cur.close()
+        conn.close()
+
+        return jsonify({'tags': tags, 'count': len(tags)}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@async_twin('tags.suggest_tags')
+async def suggest_tags_async():
+    try:
+        prefix, limit = _suggest_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        tags = (await _tag_index_async()).suggest(prefix, limit)
+        return jsonify({'tags': tags, 'count': len(tags)}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
 @tags_bp.route('/tags/<int:tag_id>/posts', methods=['GET'])
 def get_posts_by_tag(tag_id):
-    """Get all posts associated with a specific tag"""
+    """Get a page of posts associated with a specific tag"""
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+        columns = select_fields(POST_LIST_FIELDS, DEFAULT_POST_FIELDS, required=('id', 'created_at'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        conn = get_read_connection()
         cur = conn.cursor()
         
         # Get tag info
@@ -48,26 +124,27 @@ def get_posts_by_tag(tag_id):
             return jsonify({'error': 'Tag not found'}), 404
         
         # Get posts for the tag
-        cur.execute('''
-            SELECT
-                posts.id,
-                posts.user_id,
-                posts.title,
-                posts.content,
-                posts.created_at,
-                posts.updated_at
+        after, after_params = keyset_clause(position, 'posts.created_at', 'posts.id')
+        query = f'''
+            SELECT {columns}
             FROM posts
             JOIN post_tags ON posts.id = post_tags.post_id
             JOIN users ON posts.user_id = users.id
-            WHERE post_tags.tag_id = %s
-            ORDER BY posts.created_at DESC
-        ''', (tag_id,))
+            WHERE post_tags.tag_id = %s AND {after}
+            ORDER BY posts.created_at DESC, posts.id DESC
+        '''
+        if wants_stream():
+            cur.close()
+            conn.close()
+            return stream_collection('posts', iter_query(query, (tag_id, *after_params)), extra={'tag': tag})
+        
+        cur.execute(query + ' LIMIT %s', (tag_id, *after_params, limit + 1))
         
-        posts = cur.fetchall()
+        posts, next_cursor = paginate(cur.fetchall(), limit)
         cur.close()
         conn.close()
         
-        return jsonify({'tag': tag, 'posts': posts, 'count': len(posts)}), 200
+        return jsonify({'tag': tag, 'posts': posts, 'count': len(posts), 'next_cursor': next_cursor}), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -1,13 +1,21 @@
 from flask import Blueprint, request, jsonify, session
-from db.connection import get_db_connection
-import bcrypt
+from db.connection import get_db_connection, get_read_connection
+from db.home_feed import sync_feed_author
+from db.pagination import get_page_args, keyset_clause, paginate
+from db.streaming import wants_stream, iter_query, stream_collection
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.image_handler import save_profile_image, delete_image
+from utils.image_handler import save_profile_image, delete_image, get_image_status, sync_image_variants
+from utils.current_user import load_current_user, invalidate_user
+from utils.passwords import hash_password, check_password, needs_rehash, PasswordBusyError, ip_limiter, user_limiter
+from utils.page_cache import invalidate_pages
 
 users_bp = Blueprint('users', __name__)
 
+def _too_many_attempts(retry_after):
+    return jsonify({'error': 'Too many attempts, try again later'}), 429, {'Retry-After': str(retry_after)}
+
 @users_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -20,8 +28,17 @@ def register():
     email = data['email']
     password = data['password']
     
-    # Hash password
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    # Hashing is deliberately expensive, so cap how often one client can ask for it
+    ip = request.remote_addr
+    retry_after = ip_limiter.retry_after(ip)
+    if retry_after:
+        return _too_many_attempts(retry_after)
+    ip_limiter.hit(ip)
+    
+    try:
+        password_hash = hash_password(password)
+    except PasswordBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     
     try:
         conn = get_db_connection()
@@ -62,6 +79,13 @@ def login():
     username = data['username']
     password = data['password']
     
+    # Refuse before doing any hash work once the IP or account is over its limit
+    ip = request.remote_addr
+    retry_after = max(ip_limiter.retry_after(ip), user_limiter.retry_after(username))
+    if retry_after:
+        return _too_many_attempts(retry_after)
+    ip_limiter.hit(ip)
+    
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -69,21 +93,34 @@ def login():
         # Find user by username
         cur.execute('SELECT id, username, password_hash FROM users WHERE username = %s', (username,))
         user = cur.fetchone()
+        
+        # Hand the connection back before bcrypt so slow hashing can't drain the pool
         cur.close()
         conn.close()
         
         # Check if user exists and password matches
-        if not user:
+        if not user or not check_password(password, user['password_hash']):
+            user_limiter.hit(username)
             return jsonify({'error': 'Invalid username or password'}), 401
         
-        # Verify password and store session
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            return jsonify({'message': 'Login successful'}), 200
-        else:
-            return jsonify({'error': 'Invalid username or password'}), 401
-            
+        # Bring hashes made with an older work factor up to the current one
+        if needs_rehash(user['password_hash']):
+            new_hash = hash_password(password)
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute('UPDATE users SET password_hash = %s WHERE id = %s', (new_hash, user['id']))
+            conn.commit()
+            cur.close()
+            conn.close()
+        
+        # Store session
+        user_limiter.reset(username)
+        session['user_id'] = user['id']
+        session['username'] = user['username']
+        return jsonify({'message': 'Login successful'}), 200
+    
+    except PasswordBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
@@ -98,17 +135,16 @@ def get_current_user():
         return jsonify({'error': 'Not logged in'}), 401
     
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT id, username, email, profile_image, created_at FROM users WHERE id = %s', (session['user_id'],))
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
-        
+        # Served from the per-request user cache rather than a fresh query
+        user = load_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'user': user}), 200
+        response = jsonify({'user': user})
+        # Private to this user, but revalidating costs nothing thanks to the ETag
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.add_etag()
+        return response.make_conditional(request)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -117,14 +153,24 @@ def get_current_user():
 @users_bp.route('/users', methods=['GET'])
 def get_users():
     try:
-        conn = get_db_connection()
+        position, limit = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        after, after_params = keyset_clause(position, 'created_at', 'id')
+        query = f'SELECT id, username, email, profile_image, created_at FROM users WHERE {after} ORDER BY created_at DESC, id DESC'
+        if wants_stream():
+            return stream_collection('users', iter_query(query, after_params))
+        
+        conn = get_read_connection()
         cur = conn.cursor()
-        cur.execute('SELECT id, username, email, profile_image, created_at FROM users ORDER BY created_at DESC')
-        users = cur.fetchall()
+        cur.execute(query + ' LIMIT %s', (*after_params, limit + 1))
+        users, next_cursor = paginate(cur.fetchall(), limit)
         cur.close()
         conn.close()
         
-        return jsonify({'users': users})
+        return jsonify({'users': users, 'next_cursor': next_cursor})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -155,6 +201,14 @@ def upload_profile_image():
     user_id = session['user_id']
     
     try:
+        # Save new profile image before checking out a connection: storing it
+        # takes one of its own for the refcount, and holding both at once can
+        # drain the pool under concurrent uploads
+        image_path = save_profile_image(file)
+        
+        if not image_path:
+            return jsonify({'error': 'Failed to save image. Please check file format and try again.'}), 400
+        
         conn = get_db_connection()
         cur = conn.cursor()
         
@@ -163,33 +217,16 @@ def upload_profile_image():
         user = cur.fetchone()
         old_profile_image = user['profile_image'] if user else None
         
-        # Save new profile image
-        image_path = save_profile_image(file)
-        
-        if not image_path:
-            cur.close()
-            conn.close()
-            return jsonify({'error': 'Failed to save image. Please check file format and try again.'}), 400
-        
         # Update user's profile_image in database
         cur.execute(
-            'UPDATE users SET profile_image = %s WHERE id = %s',
+            'UPDATE users SET profile_image = %s, profile_image_variants = NULL WHERE id = %s',
             (image_path, user_id)
         )
+        sync_feed_author(cur, user_id)
         conn.commit()
-        
-        # Delete old image AFTER successful database update
-        if old_profile_image:
-            delete_image(old_profile_image)
-        
         cur.close()
         conn.close()
         
-        return jsonify({
-            'message': 'Profile image updated successfully',
-            'image_path': image_path
-        }), 200
-        
     except Exception as e:
         print(f" Error uploading profile image: {e}")
         import traceback
@@ -200,6 +237,27 @@ def upload_profile_image():
             delete_image(image_path)
         
         return jsonify({'error': 'Server error occurred. Please try again.'}), 500
+    
+    # The new image is saved from here on, so a failure below is only logged
+    try:
+        invalidate_user(user_id)
+        invalidate_pages('users')
+        
+        # Delete old image AFTER successful database update, with the request's connection returned
+        if old_profile_image:
+            delete_image(old_profile_image)
+        
+        # Record responsive variants if the worker already finished them
+        sync_image_variants(image_path, 'profiles')
+    except Exception as e:
+        print(f" Error updating caches for user {user_id}: {e}")
+    
+    return jsonify({
+        'message': 'Profile image updated successfully',
+        'image_path': image_path,
+        # Cropping/resizing happens in the background; poll /api/images/status
+        'image_status': (get_image_status(image_path) or {}).get('status')
+    }), 200
 
 # @users_bp.route('/me', methods=['GET'])
 # def get_current_user():
@@ -0,0 +1,12 @@
+# Async twins of read-heavy views, keyed by the Flask endpoint they stand in
+# for. asgi.py serves these endpoints natively on the event loop; every other
+# request still goes to the WSGI app.
+ASYNC_VIEWS = {}
+
+
+def async_twin(endpoint):
+    """Register an async view to answer for a Flask endpoint under asgi.py"""
+    def decorator(view):
+        ASYNC_VIEWS[endpoint] = view
+        return view
+    return decorator
@@ -0,0 +1,106 @@
+import functools
+import hashlib
+import inspect
+from datetime import timezone
+from flask import make_response, request
+
+from db.connection import get_read_connection
+
+
+def _make_etag(token):
+    """ETag for a version token, scoped to the endpoint and its arguments"""
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    raw = f'{request.endpoint}|{sorted((request.view_args or {}).items())}|{args}|{token}'
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _http_date(value):
+    """Timestamps are stored without a zone; HTTP dates are whole seconds in UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+def _not_modified(etag, last_modified):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+def _validators(version):
+    token, last_modified = version
+    if last_modified is not None:
+        last_modified = _http_date(last_modified)
+    return _make_etag(token), last_modified
+
+def _with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Clients may keep the body but must revalidate before using it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def conditional(version_fn):
+    """Answer conditional GETs with 304 before the view runs
+
+    version_fn(cur, *view_args) runs a cheap query and returns
+    (token, last_modified) where token changes whenever the response body
+    would; last_modified may be None when the data can't provide one (e.g.
+    deletions that don't move any timestamp). Returning None skips the
+    check and runs the view as normal - for a missing row or bad arguments,
+    so the view produces its usual error.
+
+    Async views take an async version_fn(*view_args) that queries through
+    db.async_db instead of a cursor.
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(*args, **kwargs)
+
+                try:
+                    version = await version_fn(*args, **kwargs)
+                except Exception as e:
+                    print(f"Version check for {request.endpoint} failed: {e}")
+                    version = None
+                if version is None:
+                    return await view(*args, **kwargs)
+
+                etag, last_modified = _validators(version)
+                if _not_modified(etag, last_modified):
+                    return _with_validators(make_response('', 304), etag, last_modified)
+                response = make_response(await view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                return _with_validators(response, etag, last_modified)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            try:
+                # The same app-context connection the view will reuse
+                cur = get_read_connection().cursor()
+                version = version_fn(cur, *args, **kwargs)
+                cur.close()
+            except Exception as e:
+                print(f"Version check for {request.endpoint} failed: {e}")
+                version = None
+            if version is None:
+                return view(*args, **kwargs)
+
+            etag, last_modified = _validators(version)
+            if _not_modified(etag, last_modified):
+                # Skips the main query and the JSON encoding entirely
+                return _with_validators(make_response('', 304), etag, last_modified)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            return _with_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
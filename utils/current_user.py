@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from flask import g, session
+
+from db.async_db import fetch_one
+from db.connection import get_read_connection
+
+# How long a loaded user row is reused across requests. Profile changes
+# made through this app invalidate it straight away; the TTL only bounds
+# staleness from changes made elsewhere (other workers, manual SQL).
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 30))
+USER_CACHE_MAX = int(os.getenv('USER_CACHE_MAX', 10000))
+
+USER_SQL = 'SELECT id, username, email, profile_image, created_at FROM users WHERE id = %s'
+
+_cache = {}  # user_id -> (expires_at, user dict)
+_cache_lock = threading.Lock()
+
+
+def _fetch_user(user_id):
+    conn = get_read_connection()
+    cur = conn.cursor()
+    cur.execute(USER_SQL, (user_id,))
+    user = cur.fetchone()
+    cur.close()
+    conn.close()
+    return dict(user) if user else None
+
+def _fresh_entry(user_id):
+    with _cache_lock:
+        entry = _cache.get(user_id)
+    if entry and entry[0] > time.monotonic():
+        return entry
+    return None
+
+def _remember(user_id, user):
+    now = time.monotonic()
+    with _cache_lock:
+        if len(_cache) >= USER_CACHE_MAX:
+            # Drop expired entries first, then the oldest if still full
+            for key in [k for k, (expires, _) in _cache.items() if expires <= now]:
+                del _cache[key]
+            if len(_cache) >= USER_CACHE_MAX:
+                del _cache[min(_cache, key=lambda k: _cache[k][0])]
+        _cache[user_id] = (now + USER_CACHE_TTL, user)
+    return user
+
+def get_cached_user(user_id):
+    """The user row for user_id, from the cache while it's fresh"""
+    entry = _fresh_entry(user_id)
+    if entry:
+        return entry[1]
+    return _remember(user_id, _fetch_user(user_id))
+
+def invalidate_user(user_id):
+    """Forget the cached row after the user's details change"""
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+def load_current_user():
+    """The logged-in user's row, or None; loaded at most once per request"""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = get_cached_user(user_id) if user_id is not None else None
+    return g.current_user
+
+async def load_current_user_async():
+    """load_current_user for async views; a cache miss doesn't block the event loop"""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        user = None
+        if user_id is not None:
+            entry = _fresh_entry(user_id)
+            if entry:
+                user = entry[1]
+            else:
+                user = _remember(user_id, await fetch_one(USER_SQL, (user_id,)))
+        g.current_user = user
+    return g.current_user
+
+def init_app(app):
+    """Make current_user available to every template"""
+    @app.context_processor
+    def inject_current_user():
+        return {'current_user': load_current_user()}
@@ -1,11 +1,55 @@
+import glob
+import hashlib
 import os
+import time
+import threading
 import uuid
-from PIL import Image, ImageOps
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, features
+from psycopg2.extras import Json
+from db.home_feed import sync_feed_cover
+from utils.page_cache import invalidate_pages
+from utils.profiling import timed
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 UPLOAD_FOLDER = 'static/uploads'
 MAX_IMAGE_SIZE = (1200, 1200)
 PROFILE_IMAGE_SIZE = (400, 400)
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+def _parse_variants(spec):
+    """'thumb:320,card:640' -> {'thumb': 320, 'card': 640}"""
+    variants = {}
+    for item in spec.split(','):
+        name, _, width = item.strip().partition(':')
+        if name and width:
+            variants[name] = int(width)
+    return variants
+
+# Responsive sizes generated for each upload, smallest first
+IMAGE_VARIANTS = {
+    'posts': _parse_variants(os.getenv('POST_IMAGE_VARIANTS', 'thumb:320,card:640,full:1200')),
+    'profiles': _parse_variants(os.getenv('PROFILE_IMAGE_VARIANTS', 'thumb:64,card:150,full:400')),
+}
+# Modern formats to encode each variant in (skipping any this Pillow can't write)
+IMAGE_VARIANT_FORMATS = [
+    fmt for fmt in os.getenv('IMAGE_VARIANT_FORMATS', 'avif,webp').split(',')
+    if fmt and features.check(fmt)
+]
+VARIANT_QUALITY = {'avif': 60, 'webp': 80}
+# Which column records the variants for each kind of upload
+VARIANT_COLUMNS = {
+    'posts': ('posts', 'cover_image', 'cover_image_variants'),
+    'profiles': ('users', 'profile_image', 'profile_image_variants'),
+}
+# Extension each stored image gets, based on its real format rather than its filename
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+# Background pool that does the Pillow work so requests don't wait on it
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image-worker')
+_jobs = {}  # image_path -> {'status', 'error', 'updated_at'}
+_jobs_lock = threading.Lock()
+JOB_HISTORY_SECONDS = 3600
 
 # Initialize upload directories
 def init_upload_folders():
@@ -19,118 +63,410 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_profile_image(file):
-    """Save and process profile picture"""
-    if not file or not allowed_file(file.filename):
-        return None
+def _to_rgb(img):
+    """Flatten transparency onto white and convert to RGB"""
+    if img.mode == 'RGB':
+        return img
+    if img.mode == 'RGBA':
+        # Create white background for transparency
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
+        return background
+    # For other modes (LA, P, etc.), convert directly
+    return img.convert('RGB')
+
+def _set_status(image_path, status, error=None):
+    with _jobs_lock:
+        job = _jobs.get(image_path)
+        if job is None or job['status'] == 'cancelled':
+            return False
+        job['status'] = status
+        job['error'] = error
+        job['updated_at'] = time.time()
+        return True
+
+def _prune_jobs():
+    """Forget finished jobs after a while (caller must hold the lock)"""
+    cutoff = time.time() - JOB_HISTORY_SECONDS
+    for path in [p for p, job in _jobs.items()
+                 if job['status'] in ('done', 'failed', 'cancelled') and job['updated_at'] < cutoff]:
+        del _jobs[path]
+
+def _variant_path(filepath, name, fmt):
+    base = os.path.splitext(filepath)[0]
+    return f"{base}-{name}.{fmt}"
+
+def _remove_variants(filepath):
+    """Delete every variant file generated for an image"""
+    base = os.path.splitext(filepath)[0]
+    for path in glob.glob(f"{glob.escape(base)}-*"):
+        os.remove(path)
 
+def _write_variants(img, filepath, kind):
+    """Encode the configured sizes/formats of img; returns the variant manifest
+
+    The manifest maps sizes to real pixel widths and formats to static paths:
+        {'widths': {'thumb': 320, ...}, 'formats': {'webp': {'thumb': 'uploads/...', ...}}}
+    """
+    manifest = {'widths': {}, 'formats': {fmt: {} for fmt in IMAGE_VARIANT_FORMATS}}
+    seen_widths = set()
+
+    for name, width in sorted(IMAGE_VARIANTS[kind].items(), key=lambda item: item[1]):
+        resized = img
+        if width < img.width:
+            resized = img.resize((width, round(img.height * width / img.width)), Image.Resampling.LANCZOS)
+
+        # Don't upscale, and don't emit two srcset entries with the same width
+        if resized.width in seen_widths:
+            continue
+        seen_widths.add(resized.width)
+        manifest['widths'][name] = resized.width
+
+        for fmt in IMAGE_VARIANT_FORMATS:
+            path = _variant_path(filepath, name, fmt)
+            resized.save(path, format=fmt.upper(), quality=VARIANT_QUALITY.get(fmt, 80))
+            manifest['formats'][fmt][name] = os.path.relpath(path, 'static').replace(os.sep, '/')
+
+    return manifest
+
+def _image_db():
+    """Check out a connection of our own for bookkeeping
+
+    These helpers run on worker threads and may be called while a request's
+    connection is still in use, so they don't share the app context one.
+    """
+    # Imported here so the image helpers stay usable without a database
+    from db.connection import get_pool
+    return get_pool().getconn()
+
+def record_variants(image_path, kind, manifest):
+    """Store a variant manifest for image_path and on whichever rows use it"""
+    table, image_column, variants_column = VARIANT_COLUMNS[kind]
+    conn = _image_db()
     try:
-        # Ensure directories exist
-        init_upload_folders()
-        # Generate a unique filename
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{ext}"
-        filepath = os.path.join(UPLOAD_FOLDER, 'profiles', filename)
-        print(f"📁 Saving profile image to: {filepath}")
-        
-        # Open and process the image
-        img = Image.open(file)
-        
-        # Convert to RGB if necessary
-        if img.mode != 'RGB':
-            if img.mode == 'RGBA':
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])
-                img = background
+        cur = conn.cursor()
+        # Two commits on purpose: once images.variants is visible,
+        # sync_image_variants() can cover rows committed after our UPDATE
+        cur.execute('UPDATE images SET variants = %s WHERE path = %s', (Json(manifest), image_path))
+        conn.commit()
+        cur.execute(
+            f'UPDATE {table} SET {variants_column} = %s WHERE {image_column} = %s',
+            (Json(manifest), image_path)
+        )
+        if table == 'posts':
+            sync_feed_cover(cur, image_path)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    invalidate_pages(table)
+
+def sync_image_variants(image_path, kind):
+    """Copy already-built variants onto rows that reference image_path
+
+    Call after committing the row: the worker records variants itself, but
+    if it finished before that commit (or the upload was a duplicate that
+    skipped processing) its UPDATE had nothing to match.
+    """
+    table, image_column, variants_column = VARIANT_COLUMNS[kind]
+    conn = _image_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(f'''
+            UPDATE {table} SET {variants_column} = images.variants
+            FROM images
+            WHERE images.path = %s AND images.variants IS NOT NULL
+              AND {table}.{image_column} = images.path
+              AND {table}.{variants_column} IS NULL
+        ''', (image_path,))
+        synced = cur.rowcount
+        if table == 'posts':
+            synced += sync_feed_cover(cur, image_path)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    if synced:
+        invalidate_pages(table)
+
+def generate_variants(image_path, kind):
+    """Synchronously (re)build the variants of an existing processed image"""
+    filepath = os.path.join('static', image_path)
+    with Image.open(filepath) as img:
+        return _write_variants(_to_rgb(img), filepath, kind)
+
+def _process_image(image_path, kind):
+    """Resize/re-encode an uploaded original in place (runs on the worker pool)"""
+    if not _set_status(image_path, 'processing'):
+        return
+
+    filepath = os.path.join('static', image_path)
+    tmp_path = f"{filepath}.tmp"
+    try:
+        with timed('image'), Image.open(filepath) as img:
+            img = _to_rgb(img)
+
+            if kind == 'profiles':
+                # Center crop and resize to exact dimensions
+                img = ImageOps.fit(img, PROFILE_IMAGE_SIZE, Image.Resampling.LANCZOS)
             else:
-                img = img.convert('RGB')
-        
-        # Center crop and resize to exact dimensions
-        img = ImageOps.fit(img, PROFILE_IMAGE_SIZE, Image.Resampling.LANCZOS)
-        
-        # Save optimized image
-        img.save(filepath, quality=85, optimize=True)
-            
-        # Verify file was created
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            print(f"✓ Profile image saved successfully: {filename} ({file_size} bytes)")
-        else:
-            print(f" File was not created: {filepath}")
-            return None
+                # Resize image maintaining aspect ratio
+                img.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+
+            # Save the optimized image next to the original, then swap it in
+            fmt = Image.registered_extensions().get(os.path.splitext(filepath)[1].lower())
+            img.save(tmp_path, format=fmt, quality=85, optimize=True)
+
+            # Smaller sizes in modern formats for srcset/<picture>
+            manifest = _write_variants(img, filepath, kind)
+
+        with _jobs_lock:
+            cancelled = _jobs.get(image_path, {}).get('status') == 'cancelled'
+        if cancelled:
+            os.remove(tmp_path)
+            _remove_variants(filepath)
+            return
+
+        os.replace(tmp_path, filepath)
+
+        _set_status(image_path, 'done')
+        print(f"✓ Processed {kind} image: {image_path} ({os.path.getsize(filepath)} bytes)")
 
-        
-        return f"uploads/profiles/{filename}"
-    
     except Exception as e:
-        print(f"Error saving profile image: {e}")
-        return None
-    
-def save_post_image(file):
-    """Save and process post image"""
+        print(f"Error processing {kind} image {image_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        _remove_variants(filepath)
+        _set_status(image_path, 'failed', str(e))
+        return
+
+    try:
+        record_variants(image_path, kind, manifest)
+    except Exception as e:
+        print(f"Error recording variants for {image_path}: {e}")
+
+def _acquire_image(image_path, kind, digest):
+    """Add a reference to a stored image; returns the new reference count"""
+    conn = _image_db()
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO images (path, kind, sha256, ref_count)
+            VALUES (%s, %s, %s, 1)
+            ON CONFLICT (path) DO UPDATE SET ref_count = images.ref_count + 1
+            RETURNING ref_count
+        ''', (image_path, kind, digest))
+        ref_count = cur.fetchone()['ref_count']
+        conn.commit()
+        cur.close()
+        return ref_count
+    finally:
+        conn.close()
+
+def _store_original(file, kind):
+    """Store an upload under its content hash and queue it for processing
+
+    Identical uploads share one file (and skip processing entirely); each
+    call adds a reference that delete_image() gives back. Returns the image
+    path right away - it serves the original until the worker swaps in the
+    processed version.
+    """
     if not file or not allowed_file(file.filename):
         print(f" File validation failed: {file.filename if file else 'No file'}")
         return None
-    
+
+    tmp_path = None
     try:
-        # ADDED: Ensure directories exist
+        # Ensure directories exist
         init_upload_folders()
-        
-        # Generate a unique filename
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{ext}"
-        filepath = os.path.join(UPLOAD_FOLDER, 'posts', filename)
-        print(f" Saving post image to: {filepath}")
-        
-        # Open and process the image
-        img = Image.open(file)
-        
-        # Convert RGBA to RGB if necessary
-        if img.mode != 'RGB':
-            if img.mode == 'RGBA':
-                # Create white background for transparency
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
-                img = background
-            else:
-                # For other modes (LA, P, etc.), convert directly
-                img = img.convert('RGB')
-            
-        # Resize image maintaining aspect ratio
-        img.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
-        
-        # Save the optimized image
-        img.save(filepath, optimize=True, quality=85)
-        
-        # ADDED: Verify file was created
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            print(f"✓ Post image saved successfully: {filename} ({file_size} bytes)")
-        else:
-            print(f" File was not created: {filepath}")
+
+        # Cheap sanity check: only reads the header, not the pixel data
+        ext = FORMAT_EXTENSIONS.get(Image.open(file.stream).format)
+        if not ext:
+            print(f" Unsupported image format: {file.filename}")
             return None
-        
-        return f"uploads/posts/{filename}"
-    
+        file.stream.seek(0)
+
+        # Stream to a temp file, hashing as we go
+        sha256 = hashlib.sha256()
+        tmp_path = os.path.join(UPLOAD_FOLDER, kind, f".upload-{uuid.uuid4().hex}")
+        with open(tmp_path, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                sha256.update(chunk)
+                out.write(chunk)
+        digest = sha256.hexdigest()
+
+        image_path = f"uploads/{kind}/{digest[:2]}/{digest}.{ext}"
+        filepath = os.path.join('static', image_path)
+        _acquire_image(image_path, kind, digest)
+
+        if os.path.exists(filepath):
+            os.remove(tmp_path)
+            print(f"✓ Reusing stored {kind} image {image_path}")
+            return image_path
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        os.replace(tmp_path, filepath)
+
+        with _jobs_lock:
+            _prune_jobs()
+            _jobs[image_path] = {'status': 'pending', 'error': None, 'updated_at': time.time()}
+        _executor.submit(_process_image, image_path, kind)
+
+        print(f"📁 Stored {kind} upload {filepath}, processing in background")
+        return image_path
+
     except Exception as e:
-        print(f"Error saving post image: {e}")
+        print(f"Error saving {kind} image: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return None
+
+def save_profile_image(file):
+    """Save profile picture and queue it for cropping/resizing"""
+    with timed('image'):
+        return _store_original(file, 'profiles')
+
+def save_post_image(file):
+    """Save post image and queue it for resizing"""
+    with timed('image'):
+        return _store_original(file, 'posts')
+
+def get_image_status(image_path):
+    """Processing status of an upload: pending, processing, done, failed or None if unknown"""
+    with _jobs_lock:
+        job = _jobs.get(image_path)
+        return dict(job) if job else None
+
+def wait_for_image(image_path, timeout=30):
+    """Block until an upload has finished processing; returns its final status"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = get_image_status(image_path)
+        if job is None or job['status'] in ('done', 'failed', 'cancelled'):
+            return job['status'] if job else None
+        time.sleep(0.05)
+    job = get_image_status(image_path)
+    return job['status'] if job else None
     
+def _unlink_image(image_path):
+    """Remove an image file and all of its variants"""
+    # Stop a pending job from writing the file back after we delete it
+    with _jobs_lock:
+        job = _jobs.get(image_path)
+        if job is not None:
+            job['status'] = 'cancelled'
+
+    full_path = os.path.join('static', image_path)
+    _remove_variants(full_path)
+    if os.path.exists(full_path):
+        os.remove(full_path)
+        print(f"✓ Deleted image: {full_path}")
+    else:
+        print(f" Image not found for deletion: {full_path}")
+
 def delete_image(image_path):
-    """Delete an image file from the server"""
+    """Drop a reference to an image, deleting the files once nothing uses them"""
     
     if not image_path:
         return True
 
     try:
-        full_path = os.path.join('static', image_path)
-        if os.path.exists(full_path):
-            os.remove(full_path)
-            print(f"✓ Deleted image: {full_path}")
-            return True
-        else:
-            print(f" Image not found for deletion: {full_path}")
-            return True  # Consider non-existent file as successfully "deleted"
+        conn = _image_db()
+        try:
+            cur = conn.cursor()
+            # Lock the row so a concurrent upload of the same image waits
+            # until we've decided whether the file goes away
+            cur.execute('SELECT ref_count FROM images WHERE path = %s FOR UPDATE', (image_path,))
+            row = cur.fetchone()
+
+            if row and row['ref_count'] > 1:
+                cur.execute('UPDATE images SET ref_count = ref_count - 1 WHERE path = %s', (image_path,))
+                print(f"✓ Released image reference: {image_path} ({row['ref_count'] - 1} left)")
+            else:
+                # Last reference, or a file from before content addressing
+                cur.execute('DELETE FROM images WHERE path = %s', (image_path,))
+                _unlink_image(image_path)
+
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        return True  # Consider non-existent file as successfully "deleted"
     except Exception as e:
         print(f"Error deleting image: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def rehash_existing_images(conn):
+    """Move pre-existing uploads to content-addressed paths and rebuild refcounts
+
+    For old uploads only the processed file exists, so that's what gets
+    hashed. Rows pointing at byte-identical files end up sharing one path.
+    Returns the number of files moved.
+    """
+    cur = conn.cursor()
+    moved = 0
+
+    for kind, (table, image_column, variants_column) in VARIANT_COLUMNS.items():
+        cur.execute(
+            f'SELECT DISTINCT {image_column} AS path FROM {table} WHERE {image_column} IS NOT NULL'
+        )
+        for row in cur.fetchall():
+            old_path = row['path']
+            old_file = os.path.join('static', old_path)
+            if not os.path.exists(old_file):
+                print(f" Missing file, skipping: {old_file}")
+                continue
+
+            sha256 = hashlib.sha256()
+            with open(old_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+            ext = old_path.rsplit('.', 1)[1].lower()
+            new_path = f"uploads/{kind}/{digest[:2]}/{digest}.{ext}"
+            if new_path == old_path:
+                continue
+
+            new_file = os.path.join('static', new_path)
+            old_base = os.path.splitext(old_path)[0]
+            new_base = os.path.splitext(new_path)[0]
+            os.makedirs(os.path.dirname(new_file), exist_ok=True)
+
+            if os.path.exists(new_file):
+                # Duplicate of something already moved: drop our copy
+                _remove_variants(old_file)
+                os.remove(old_file)
+            else:
+                os.replace(old_file, new_file)
+                for variant in glob.glob(f"{glob.escape(os.path.splitext(old_file)[0])}-*"):
+                    suffix = variant[len(os.path.splitext(old_file)[0]):]
+                    os.replace(variant, os.path.splitext(new_file)[0] + suffix)
+
+            # Point rows (and their variant manifests) at the new location
+            cur.execute(
+                f'''UPDATE {table}
+                    SET {image_column} = %s,
+                        {variants_column} = replace({variants_column}::text, %s, %s)::jsonb
+                    WHERE {image_column} = %s''',
+                (new_path, old_base + '-', new_base + '-', old_path)
+            )
+            moved += 1
+
+        conn.commit()
+
+    # One reference per row that uses each image
+    cur.execute('DELETE FROM images')
+    for kind, (table, image_column, variants_column) in VARIANT_COLUMNS.items():
+        cur.execute(f'''
+            INSERT INTO images (path, kind, sha256, ref_count, variants)
+            SELECT {image_column}, %s, NULLIF(split_part(split_part({image_column}, '/', 4), '.', 1), ''),
+                   COUNT(*), (array_agg({variants_column}::text))[1]::jsonb
+            FROM {table}
+            WHERE {image_column} IS NOT NULL
+            GROUP BY {image_column}
+            ON CONFLICT (path) DO UPDATE SET ref_count = images.ref_count + EXCLUDED.ref_count
+        ''', (kind,))
+    conn.commit()
+    cur.close()
+    return moved
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+import markdown as md
+from markupsafe import Markup, escape
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'codehilite']
+# Bump when the extensions or their options change so stored HTML is re-rendered
+RENDERER_VERSION = '1'
+CACHE_SIZE = 512
+# Length of the stored preview and the reading speed behind reading_time
+EXCERPT_WORDS = int(os.getenv('EXCERPT_WORDS', 40))
+WORDS_PER_MINUTE = 200
+
+_FIRST_PARAGRAPH_RE = re.compile(r'<p>.*?</p>', re.DOTALL)
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def content_hash(text):
+    """Hash of the markdown source plus the renderer settings"""
+    key = f"{RENDERER_VERSION}:{','.join(MARKDOWN_EXTENSIONS)}:{text or ''}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def render_markdown(text):
+    """Convert markdown text to HTML (no caching)"""
+    return md.markdown(text or '', extensions=MARKDOWN_EXTENSIONS)
+
+def render_cached(text):
+    """Render markdown, reusing earlier results for identical content"""
+    digest = content_hash(text)
+
+    with _cache_lock:
+        html = _cache.get(digest)
+        if html is not None:
+            _cache.move_to_end(digest)
+            return html
+
+    html = render_markdown(text)
+
+    with _cache_lock:
+        _cache[digest] = html
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return html
+
+def render_for_storage(text):
+    """Return (html, hash) to store alongside a post's content"""
+    html = render_cached(text)
+    return html, content_hash(text)
+
+def summarize(html):
+    """Preview fields for a post from its rendered HTML
+
+    Returns a dict with excerpt (plain text), excerpt_html, word_count and
+    reading_time (whole minutes, at least 1), matching the posts columns.
+    """
+    words = Markup(html or '').striptags().split()
+    excerpt = ' '.join(words[:EXCERPT_WORDS])
+    if len(words) > EXCERPT_WORDS:
+        excerpt += '…'
+
+    # The first paragraph keeps its inline formatting when it's short enough;
+    # otherwise fall back to the plain-text excerpt
+    first = _FIRST_PARAGRAPH_RE.search(html or '')
+    if first and len(Markup(first.group(0)).striptags().split()) <= EXCERPT_WORDS:
+        excerpt_html = first.group(0)
+    else:
+        excerpt_html = f'<p>{escape(excerpt)}</p>' if excerpt else ''
+
+    return {
+        'excerpt': excerpt,
+        'excerpt_html': excerpt_html,
+        'word_count': len(words),
+        'reading_time': max(1, round(len(words) / WORDS_PER_MINUTE)),
+    }
+
+def post_html(post):
+    """HTML for a post row, using the stored copy when it's still current"""
+    stored = post.get('content_html')
+    if stored is not None and post.get('content_hash') == content_hash(post.get('content')):
+        return stored
+    # Missing or stale (e.g. not backfilled yet) - render lazily
+    return render_cached(post.get('content'))
+
+def backfill_post_html(conn, batch_size=200):
+    """Render and store HTML and preview fields for every post whose stored copy is missing or stale
+
+    Returns the number of posts updated.
+    """
+    cur = conn.cursor()
+    updated = 0
+    last_id = 0
+
+    while True:
+        cur.execute('''
+            SELECT id, content, content_hash, excerpt IS NULL AS missing_excerpt
+            FROM posts
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+        ''', (last_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            break
+
+        for row in rows:
+            digest = content_hash(row['content'])
+            if row['content_hash'] != digest or row['missing_excerpt']:
+                html = render_markdown(row['content'])
+                summary = summarize(html)
+                cur.execute('''
+                    UPDATE posts
+                    SET content_html = %s, content_hash = %s, excerpt = %s, excerpt_html = %s,
+                        word_count = %s, reading_time = %s
+                    WHERE id = %s
+                ''', (html, digest, summary['excerpt'], summary['excerpt_html'],
+                      summary['word_count'], summary['reading_time'], row['id']))
+                updated += 1
+
+        conn.commit()
+        last_id = rows[-1]['id']
+
+    cur.close()
+    return updated
@@ -0,0 +1,297 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import g, make_response, request, session
+
+from db.replicas import REPLICA_MAX_LAG
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Rendered HTML for anonymous visitors. Logged-in pages differ per user
+# (nav, like state, edit buttons) so they always bypass the cache.
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE', '1') == '1'
+PAGE_CACHE_TTL = float(os.getenv('PAGE_CACHE_TTL', 60))
+PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 512))
+# Optional second tier shared between workers, e.g. redis://localhost:6379/0
+PAGE_CACHE_REDIS_URL = os.getenv('PAGE_CACHE_REDIS_URL')
+
+# What a cached page can depend on. Writes bump a group's version, which
+# changes the key of every page depending on it, so stale copies are simply
+# never read again and age out of the LRU.
+GROUPS = ('posts', 'comments', 'likes', 'tags', 'users')
+
+
+class MemoryTier:
+    """Per-process LRU with a TTL on each entry"""
+
+    name = 'memory'
+
+    def __init__(self, max_size=PAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, body)
+        self._versions = dict.fromkeys(GROUPS, 0)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, body, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def versions(self, groups):
+        with self._lock:
+            return [self._versions[group] for group in groups]
+
+    def bump(self, groups):
+        with self._lock:
+            for group in groups:
+                self._versions[group] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisTier:
+    """Cache shared by every worker; group versions live here too so an
+    invalidation in one process is seen by all of them"""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='page-cache:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        body = self.client.get(self.prefix + key)
+        return body.decode('utf-8') if body is not None else None
+
+    def set(self, key, body, ttl):
+        self.client.set(self.prefix + key, body.encode('utf-8'), ex=max(1, int(ttl)))
+
+    def versions(self, groups):
+        values = self.client.mget([f'{self.prefix}v:{group}' for group in groups])
+        return [int(value or 0) for value in values]
+
+    def bump(self, groups):
+        pipe = self.client.pipeline()
+        for group in groups:
+            pipe.incr(f'{self.prefix}v:{group}')
+        pipe.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class PageCache:
+    """Looks pages up in each tier in turn, filling the faster tiers on the way back"""
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self._stats_lock = threading.Lock()
+        self._stats = {tier.name: {'hits': 0, 'misses': 0} for tier in tiers}
+        self._stats['bypass'] = 0
+        self._stats['invalidations'] = 0
+        self._stats['version_errors'] = 0
+        self._last_invalidation = float('-inf')
+
+    def _count(self, tier, outcome):
+        with self._stats_lock:
+            self._stats[tier.name][outcome] += 1
+
+    def _versions(self, groups):
+        # The shared tier (if any) is the source of truth for versions. Without
+        # it nothing here can tell whether another worker invalidated a page,
+        # so None: the request runs uncached rather than risk a stale hit.
+        tier = self.tiers[-1]
+        try:
+            return tier.versions(groups)
+        except Exception as e:
+            print(f"Page cache {tier.name} version read failed: {e}")
+            with self._stats_lock:
+                self._stats['version_errors'] += 1
+            return None
+
+    def make_key(self, groups):
+        """The cache key for this request, or None if the group versions can't be read"""
+        versions = self._versions(groups)
+        if versions is None:
+            return None
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        view_args = ','.join(f'{k}={v}' for k, v in sorted((request.view_args or {}).items()))
+        stamp = ','.join(f'{group}{version}' for group, version in zip(groups, versions))
+        return f'{request.endpoint}|{view_args}|{args}|anon|{stamp}'
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            try:
+                body = tier.get(key)
+            except Exception as e:
+                print(f"Page cache {tier.name} read failed: {e}")
+                body = None
+            if body is not None:
+                self._count(tier, 'hits')
+                for faster in self.tiers[:i]:
+                    faster.set(key, body, PAGE_CACHE_TTL)
+                return body
+            self._count(tier, 'misses')
+        return None
+
+    def set(self, key, body, ttl):
+        for tier in self.tiers:
+            try:
+                tier.set(key, body, ttl)
+            except Exception as e:
+                print(f"Page cache {tier.name} write failed: {e}")
+
+    def invalidate(self, *groups):
+        for tier in self.tiers:
+            try:
+                tier.bump(groups)
+            except Exception as e:
+                print(f"Page cache {tier.name} invalidation failed: {e}")
+        with self._stats_lock:
+            self._stats['invalidations'] += 1
+            self._last_invalidation = time.monotonic()
+
+    def may_be_stale(self):
+        """Whether a page built from a replica could predate the last write
+
+        Only writes made by this process are known here; with several
+        workers the TTL still bounds how long a stale page lives.
+        """
+        with self._stats_lock:
+            return time.monotonic() - self._last_invalidation < REPLICA_MAX_LAG
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def bypassed(self):
+        with self._stats_lock:
+            self._stats['bypass'] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = {name: dict(value) if isinstance(value, dict) else value
+                     for name, value in self._stats.items()}
+        for tier in self.tiers:
+            if isinstance(tier, MemoryTier):
+                stats[tier.name]['entries'] = len(tier)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_page_cache():
+    """The shared PageCache, built from the PAGE_CACHE_* settings"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                tiers = [MemoryTier()]
+                if PAGE_CACHE_REDIS_URL:
+                    if redis is None:
+                        print("PAGE_CACHE_REDIS_URL is set but the redis package isn't installed; using the in-process cache only")
+                    else:
+                        tiers.append(RedisTier(PAGE_CACHE_REDIS_URL))
+                _cache = PageCache(tiers)
+    return _cache
+
+def invalidate_pages(*groups):
+    """Call after a write so pages depending on these groups get rebuilt"""
+    if PAGE_CACHE_ENABLED:
+        get_page_cache().invalidate(*groups)
+
+def skip_page_cache():
+    """Keep the current response out of the cache (e.g. an error page)"""
+    g.skip_page_cache = True
+
+def _lookup(groups):
+    """(cache, key, cached response) for this request; cache is None when it bypasses the cache"""
+    if not PAGE_CACHE_ENABLED or request.method != 'GET' or 'user_id' in session:
+        if PAGE_CACHE_ENABLED:
+            get_page_cache().bypassed()
+        return None, None, None
+
+    cache = get_page_cache()
+    key = cache.make_key(groups)
+    if key is None:
+        return None, None, None
+    body = cache.get(key)
+    if body is None:
+        return cache, key, None
+    response = make_response(body)
+    response.headers['X-Cache'] = 'HIT'
+    return cache, key, response
+
+def _store(cache, key, rv, ttl):
+    response = make_response(rv)
+    # A replica may not have the write that just invalidated this page yet
+    stale = g.get('read_from_replica') and cache.may_be_stale()
+    if response.status_code == 200 and not g.get('skip_page_cache') and not stale:
+        cache.set(key, response.get_data(as_text=True), ttl)
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
+def cached_page(*groups, ttl=PAGE_CACHE_TTL):
+    """Serve a page view from the cache for anonymous GET requests
+
+    groups lists what the page shows, so writes to any of them (see
+    invalidate_pages) take it out of the cache. Works on async views too.
+    """
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise ValueError(f"Unknown cache groups: {', '.join(sorted(unknown))}")
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                cache, key, hit = _lookup(groups)
+                if hit is not None:
+                    return hit
+                if cache is None:
+                    return await view(*args, **kwargs)
+                return _store(cache, key, await view(*args, **kwargs), ttl)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache, key, hit = _lookup(groups)
+            if hit is not None:
+                return hit
+            if cache is None:
+                return view(*args, **kwargs)
+            return _store(cache, key, view(*args, **kwargs), ttl)
+        return wrapper
+    return decorator
+
+def get_page_cache_stats():
+    """Hit/miss counts per tier, or None when the cache is off"""
+    if not PAGE_CACHE_ENABLED:
+        return None
+    return get_page_cache().stats()
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import bcrypt
+
+# bcrypt work factor for new hashes; older hashes are upgraded on login
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', 2))
+# Hash jobs allowed to wait for a worker before new ones are turned away
+PASSWORD_QUEUE_MAX = int(os.getenv('PASSWORD_QUEUE_MAX', 16))
+PASSWORD_TIMEOUT = float(os.getenv('PASSWORD_TIMEOUT', 10))
+
+# Attempt limits, each per LOGIN_WINDOW seconds
+LOGIN_WINDOW = float(os.getenv('LOGIN_WINDOW', 300))
+LOGIN_MAX_PER_IP = int(os.getenv('LOGIN_MAX_PER_IP', 30))
+LOGIN_MAX_FAILURES_PER_USER = int(os.getenv('LOGIN_MAX_FAILURES_PER_USER', 5))
+# Keys each limiter tracks at most; past this the least recently seen are forgotten
+LOGIN_MAX_TRACKED = int(os.getenv('LOGIN_MAX_TRACKED', 100000))
+
+# bcrypt releases the GIL while hashing, so a couple of threads keep the
+# hashing off the request threads without starving them of CPU
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix='password-worker')
+_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE_MAX)
+
+
+class PasswordBusyError(Exception):
+    """Raised when too many hash jobs are already queued, or one waited past PASSWORD_TIMEOUT"""
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordBusyError('Too many password checks in progress, try again shortly')
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_TIMEOUT)
+    except FutureTimeoutError:
+        # The job keeps its slot until it finishes, so a backed-up pool sheds load
+        raise PasswordBusyError('Password check timed out, try again shortly')
+
+def _hash(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def hash_password(password):
+    """bcrypt hash of password at the current work factor, computed on the worker pool"""
+    return _run(_hash, password)
+
+def check_password(password, password_hash):
+    """Whether password matches password_hash, computed on the worker pool"""
+    return _run(_check, password, password_hash)
+
+def hash_rounds(password_hash):
+    """Work factor a bcrypt hash was made with ('$2b$12$...' -> 12)"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+def needs_rehash(password_hash):
+    return hash_rounds(password_hash) < BCRYPT_ROUNDS
+
+
+class AttemptLimiter:
+    """Sliding-window counter of attempts per key
+
+    Keys are attacker-chosen (usernames, client IPs), so the table is kept
+    bounded: keys are ordered by their latest attempt, every hit drops the
+    ones whose window has passed, and beyond max_keys the least recently
+    seen are evicted even if still inside their window.
+    """
+
+    def __init__(self, max_attempts, window=LOGIN_WINDOW, max_keys=LOGIN_MAX_TRACKED):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._attempts = OrderedDict()  # key -> deque of monotonic times, by latest attempt
+
+    def _prune(self, key, now):
+        attempts = self._attempts.get(key)
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if attempts is not None and not attempts:
+            del self._attempts[key]
+        return attempts
+
+    def retry_after(self, key):
+        """Seconds until key may try again, or 0 if it's under the limit"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._prune(key, now)
+            if not attempts or len(attempts) < self.max_attempts:
+                return 0
+            return max(1, int(attempts[0] + self.window - now) + 1)
+
+    def _sweep(self, now):
+        # Expired keys are all at the front since they're ordered by latest attempt
+        while self._attempts:
+            attempts = next(iter(self._attempts.values()))
+            if attempts[-1] > now - self.window and len(self._attempts) <= self.max_keys:
+                break
+            self._attempts.popitem(last=False)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._prune(key, now)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            else:
+                self._attempts.move_to_end(key)
+            attempts.append(now)
+            self._sweep(now)
+
+    def __len__(self):
+        return len(self._attempts)
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+# Every login and registration counts against the client IP; failed logins
+# also count against the username, which stops slow guessing at one account
+# spread over many IPs
+ip_limiter = AttemptLimiter(LOGIN_MAX_PER_IP)
+user_limiter = AttemptLimiter(LOGIN_MAX_FAILURES_PER_USER)
@@ -0,0 +1,229 @@
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from flask import before_render_template, request, template_rendered
+
+from db.query_counter import set_query_listener
+
+# Per-request timing: query count and DB time, template and image time,
+# reported in a Server-Timing header and aggregated per route
+PROFILING_ENABLED = os.getenv('PROFILING', '0') == '1'
+# Also expose the aggregates at /debug/profile (keep off on public hosts)
+PROFILE_ENDPOINT = os.getenv('PROFILE_ENDPOINT', '0') == '1'
+# Fraction of requests to run under cProfile, dumped to PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# Statements slower than this are printed as they happen
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+SLOWEST_PER_REQUEST = 5
+MAX_TRACKED_STATEMENTS = 200
+
+_NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SPACE_RE = re.compile(r'\s+')
+
+_local = threading.local()
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and literals so the same statement groups together"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _STRING_RE.sub('?', str(sql))
+    sql = _NUMBER_RE.sub('?', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class RequestProfile:
+    """Timings collected while one request runs"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = []  # (seconds, sql)
+        self.sections = {}    # 'template' / 'image' -> seconds
+        self._section_starts = {}
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.db_time += seconds
+        self.statements.append((seconds, sql))
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            print(f"Slow query ({seconds * 1000:.0f} ms) in {request.endpoint}: {normalize_sql(sql)[:200]}")
+
+    def add_section(self, name, seconds):
+        self.sections[name] = self.sections.get(name, 0.0) + seconds
+
+    def slowest(self, n=SLOWEST_PER_REQUEST):
+        return sorted(self.statements, key=lambda s: s[0], reverse=True)[:n]
+
+
+class ProfileStats:
+    """Per-route totals across requests, plus the slowest statements seen"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.statements = {}  # normalized sql -> {'count', 'total_ms', 'max_ms'}
+        self.background = {}  # section -> {'count', 'total_ms', 'max_ms'}
+
+    def record(self, endpoint, profile, total):
+        with self._lock:
+            route = self.routes.setdefault(endpoint, {
+                'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'queries': 0, 'max_queries': 0, 'db_ms': 0.0, 'template_ms': 0.0, 'image_ms': 0.0,
+            })
+            route['requests'] += 1
+            route['total_ms'] += total * 1000
+            route['max_ms'] = max(route['max_ms'], total * 1000)
+            route['queries'] += profile.queries
+            route['max_queries'] = max(route['max_queries'], profile.queries)
+            route['db_ms'] += profile.db_time * 1000
+            route['template_ms'] += profile.sections.get('template', 0) * 1000
+            route['image_ms'] += profile.sections.get('image', 0) * 1000
+
+            for seconds, sql in profile.statements:
+                self._add(self.statements, normalize_sql(sql), seconds)
+            if len(self.statements) > MAX_TRACKED_STATEMENTS:
+                # Keep the statements that cost the most overall
+                keep = sorted(self.statements.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+                self.statements = dict(keep[:MAX_TRACKED_STATEMENTS])
+
+    def record_background(self, section, seconds):
+        with self._lock:
+            self._add(self.background, section, seconds)
+
+    @staticmethod
+    def _add(table, key, seconds):
+        entry = table.setdefault(key, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['count'] += 1
+        entry['total_ms'] += seconds * 1000
+        entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+
+    def snapshot(self, top=20):
+        with self._lock:
+            routes = {}
+            for endpoint, route in self.routes.items():
+                n = route['requests']
+                routes[endpoint] = {
+                    'requests': n,
+                    'avg_ms': round(route['total_ms'] / n, 2),
+                    'max_ms': round(route['max_ms'], 2),
+                    'avg_queries': round(route['queries'] / n, 2),
+                    'max_queries': route['max_queries'],
+                    'avg_db_ms': round(route['db_ms'] / n, 2),
+                    'avg_template_ms': round(route['template_ms'] / n, 2),
+                    'avg_image_ms': round(route['image_ms'] / n, 2),
+                }
+            slowest = sorted(self.statements.items(), key=lambda item: item[1]['max_ms'], reverse=True)[:top]
+            return {
+                'routes': routes,
+                'slowest_statements': [
+                    {'sql': sql, 'count': s['count'], 'max_ms': round(s['max_ms'], 2),
+                     'avg_ms': round(s['total_ms'] / s['count'], 2)}
+                    for sql, s in slowest
+                ],
+                'background': {
+                    name: {'count': s['count'], 'avg_ms': round(s['total_ms'] / s['count'], 2), 'max_ms': round(s['max_ms'], 2)}
+                    for name, s in self.background.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self.routes, self.statements, self.background = {}, {}, {}
+
+
+stats = ProfileStats()
+
+def current_profile():
+    """The profile of the request running on this thread, if profiling is on"""
+    return getattr(_local, 'profile', None)
+
+@contextmanager
+def timed(section):
+    """Time a block as `section` of the current request, or as background work
+
+    Outside a profiled request (e.g. on the image worker pool) the time is
+    aggregated under 'background' in /debug/profile.
+    """
+    if not PROFILING_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        profile = current_profile()
+        if profile is not None:
+            profile.add_section(section, elapsed)
+        else:
+            stats.record_background(section, elapsed)
+
+
+def _start_request():
+    profile = RequestProfile()
+    _local.profile = profile
+    set_query_listener(profile)
+
+    _local.cprofile = None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        _local.cprofile = cProfile.Profile()
+        _local.cprofile.enable()
+
+def _finish_request(response):
+    profile = current_profile()
+    if profile is None:
+        return response
+    total = time.perf_counter() - profile.started
+
+    sampler = getattr(_local, 'cprofile', None)
+    if sampler is not None:
+        sampler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{request.endpoint or 'unknown'}-{int(time.time() * 1000)}.prof"
+        sampler.dump_stats(os.path.join(PROFILE_DIR, name))
+        _local.cprofile = None
+
+    metrics = [
+        f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"',
+        f"tpl;dur={profile.sections.get('template', 0) * 1000:.1f}",
+    ]
+    if 'image' in profile.sections:
+        metrics.append(f"img;dur={profile.sections['image'] * 1000:.1f}")
+    metrics.append(f'total;dur={total * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(metrics)
+
+    stats.record(request.endpoint or 'unknown', profile, total)
+    return response
+
+def _end_request(exception=None):
+    _local.profile = None
+    set_query_listener(None)
+
+def _template_started(sender, template, context, **extra):
+    _local.template_started = time.perf_counter()
+
+def _template_finished(sender, template, context, **extra):
+    started = getattr(_local, 'template_started', None)
+    profile = current_profile()
+    if started is not None and profile is not None:
+        profile.add_section('template', time.perf_counter() - started)
+        _local.template_started = None
+
+def init_app(app):
+    """Hook request profiling into the Flask app when PROFILING=1"""
+    app.config.setdefault('PROFILE_ENDPOINT', PROFILE_ENDPOINT)
+    if not PROFILING_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)